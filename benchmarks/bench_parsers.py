@@ -0,0 +1,236 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+# Root of the project (the modules are imported from here)
+BENCHMARKS_DIR: str = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR: str = os.path.dirname(BENCHMARKS_DIR)
+BASELINE_FILE: str = os.path.join(BENCHMARKS_DIR, 'parser_baseline.json')
+
+# Parser method of every site and the fixture it parses
+PARSERS: dict = {
+    'aaaauto': ('AaaAutoScraper', 'parse_page'),
+    'sauto': ('SautoScraper', 'get_parsed_data'),
+    'tipcars': ('TipCarsScraper', 'parse_data'),
+    'sauto_api': ('SautoApiScraper', 'get_parsed_data'),
+}
+
+
+def prepare_environment(work_dir: str):
+    """
+    Points the project to a temporary SQLite database and log files, before its modules are imported.
+
+    Args:
+        work_dir (str): The temporary directory for the database and the logs.
+    """
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(work_dir, 'benchmark.db')
+    for variable in ('LOG_DIR_MAIN', 'LOG_DIR_SCRAPING', 'LOG_DIR_PROXIES', 'LOG_DIR_DATABASE'):
+        os.environ[variable] = os.path.join(work_dir, variable.lower() + '.log')
+    os.environ.setdefault('SETTINGS_APK', os.path.join(PROJECT_DIR, 'settings', 'config_file.json'))
+    for path in (PROJECT_DIR, BENCHMARKS_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def measure(func, repeat: int, setup=None):
+    """
+    Runs the function `repeat` times and keeps the fastest run, then once more under tracemalloc.
+
+    Args:
+        func (callable): The measured function.
+        repeat (int): The number of timed runs.
+        setup (callable, optional): Called before every run, not measured.
+
+    Returns:
+        tuple: The fastest duration in seconds and the peak of allocated memory in bytes.
+    """
+    timings: list = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start: float = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak
+
+
+def run_benchmark(repeat: int, pages: int, insert_rows: int, dedup_rows: int):
+    """
+    Measures the parsers (HTML pages and the JSON listing of sauto.cz), edit_list_cars_details, CarBatch,
+    compare_details_with_db and insert_data on the recorded fixtures and a temporary SQLite database.
+
+    Args:
+        repeat (int): The number of timed runs per stage.
+        pages (int): The number of parsed pages given to edit_list_cars_details and CarBatch.
+        insert_rows (int): The number of rows inserted by insert_data.
+        dedup_rows (int): The number of rows compared by compare_details_with_db (half of them are in the database).
+
+    Returns:
+        dict: Stage -> {'items': int, 'unit': str, 'seconds': float, 'throughput': float, 'peak_kb': float}.
+    """
+    import pandas as pd
+    import scraper
+    from db import Base, CarData, DatabaseManagerSettings, get_engine
+    from fixtures import FIXTURE_EXTENSIONS, load_fixture
+    from listings import add_listing_keys
+    from dimensions import DIMENSIONS
+    from records import CarBatch
+
+    # Logovanie každého auta by meralo konzolu, nie parser
+    for variable in ('LOG_DIR_SCRAPING', 'LOG_DIR_DATABASE'):
+        logging.getLogger(os.environ[variable]).setLevel(logging.WARNING)
+
+    Base.metadata.create_all(get_engine(), tables=[*(Model.__table__ for Model in DIMENSIONS.values()), CarData.__table__])
+    db_manager_settings = DatabaseManagerSettings()
+    results: dict = {}
+
+    def add_result(stage: str, items: int, unit: str, seconds: float, peak: int):
+        results[stage] = {
+            'items': items,
+            'unit': unit,
+            'seconds': round(seconds, 6),
+            'throughput': round(items / seconds, 1),
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    # Parsers
+    parsed_pages: list = []
+    for site, (class_name, method_name) in PARSERS.items():
+        site_scraper = getattr(scraper, class_name)(1000, 1, 0, 1)
+        parse = getattr(site_scraper, method_name)
+        html: str = load_fixture(site)
+        parsed: dict = parse(html, 1)
+        cards: int = len(parsed['url'])
+        # edit_list_cars_details dostáva len HTML stránky, aby sa dal porovnať s baseline
+        if site not in FIXTURE_EXTENSIONS:
+            parsed_pages.append(parsed)
+        seconds, peak = measure(lambda: parse(html, 1), repeat)
+        add_result(f'parse_{site}', cards, 'cards/s', seconds, peak)
+
+    # edit_list_cars_details
+    list_cars: list = (parsed_pages * (pages // len(parsed_pages) + 1))[:pages]
+    editor = scraper.Scraper(1000, 1, 0, 1)
+    rows: list = editor.edit_list_cars_details(list_cars)
+    seconds, peak = measure(lambda: editor.edit_list_cars_details(list_cars), repeat)
+    add_result('edit_list_cars_details', len(rows), 'rows/s', seconds, peak)
+
+    # CarBatch (the same pages column by column, as pipeline.scrape_pages collects them)
+    def build_batch():
+        batch = CarBatch()
+        for page in list_cars:
+            batch.extend(page)
+        return batch
+    seconds, peak = measure(build_batch, repeat)
+    add_result('car_batch', len(rows), 'rows/s', seconds, peak)
+
+    def make_rows(count: int):
+        # Unikátne listing id (posledné číslo v URL), aby sa riadky nezlúčili pri porovnaní s databázou
+        return [
+            dict(rows[index % len(rows)], url=re.sub(r'\d+(\D*)$', lambda match: f'{index + 1}{match.group(1)}', rows[index % len(rows)]['url']))
+            for index in range(count)
+        ]
+
+    # insert_data
+    df_insert: pd.DataFrame = pd.DataFrame(make_rows(insert_rows))
+    seconds, peak = measure(
+        lambda: db_manager_settings.insert_data(df_insert, CarData), repeat,
+        setup=lambda: db_manager_settings.delete_all_data(CarData),
+    )
+    add_result('insert_data', insert_rows, 'rows/s', seconds, peak)
+
+    # compare_details_with_db
+    dedup_input: list = make_rows(dedup_rows)
+    db_manager_settings.delete_all_data(CarData)
+    db_manager_settings.insert_data(add_listing_keys(pd.DataFrame(dedup_input[::2])), CarData)
+    check_new_items = scraper.CheckNewItems()
+    seconds, peak = measure(lambda: check_new_items.compare_details_with_db(dedup_input), repeat)
+    add_result('compare_details_with_db', dedup_rows, 'rows/s', seconds, peak)
+
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float):
+    """
+    Compares the results with the stored baseline.
+
+    Args:
+        results (dict): The results of run_benchmark.
+        baseline (dict): The stored baseline.
+        tolerance (float): Allowed drop of throughput and growth of memory as a fraction of the baseline (0.3 = 30 %).
+
+    Returns:
+        list: Descriptions of the regressions, empty if there are none.
+    """
+    regressions: list = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        expected: dict = baseline[stage]
+        limit: float = expected['throughput'] * (1 - tolerance)
+        if result['throughput'] < limit:
+            regressions.append(f'{stage}: {result["throughput"]} {result["unit"]} < {limit:.1f} (baseline {expected["throughput"]})')
+        limit = expected['peak_kb'] * (1 + tolerance)
+        if result['peak_kb'] > limit:
+            regressions.append(f'{stage}: peak memory {result["peak_kb"]} KiB > {limit:.1f} KiB (baseline {expected["peak_kb"]} KiB)')
+    return regressions
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the parsers and the database stages on recorded HTML fixtures.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per stage, the fastest one is kept (default: 5).')
+    parser.add_argument('--pages', type=int, default=300, help='Parsed pages given to edit_list_cars_details (default: 300).')
+    parser.add_argument('--insert-rows', type=int, default=2000, help='Rows inserted by insert_data (default: 2000).')
+    parser.add_argument('--dedup-rows', type=int, default=200, help='Rows compared by compare_details_with_db (default: 200).')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='Allowed drop of throughput and growth of memory (default: 0.3 = 30 %%).')
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this JSON file.')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline.')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='mcs-bench-') as work_dir:
+        prepare_environment(work_dir)
+        results: dict = run_benchmark(args.repeat, args.pages, args.insert_rows, args.dedup_rows)
+        from db import dispose_engine
+        dispose_engine()
+
+    for stage, result in results.items():
+        print(f'{stage:<26} {result["items"]:>6} items {result["seconds"] * 1000:>10.2f} ms {result["throughput"]:>12.1f} {result["unit"]:<7} peak {result["peak_kb"]:>9.1f} KiB')
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+        print(f'Baseline stored to {BASELINE_FILE}')
+        return 0
+
+    baseline: dict = {}
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+    regressions: list = compare_with_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import unicodedata
+from xml.sax.saxutils import escape
+
+
+# Directory with the recorded pages used by the benchmarks
+FIXTURES_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Cars per listing page, as on the sites (sauto_api is the JSON endpoint of sauto.cz, see scraper.SautoApiScraper)
+CARS_PER_PAGE: dict = {'aaaauto': 24, 'sauto': 20, 'tipcars': 20, 'sauto_api': 100}
+
+# Fixtures which are not HTML pages
+FIXTURE_EXTENSIONS: dict = {'sauto_api': 'json'}
+
+# Recorded sitemaps (fixtures/sitemaps/<site>/sitemap_index.xml and its sitemaps)
+SITEMAP_FIXTURE_PAGES: int = 3
+SITEMAP_URLS_PER_FILE: int = 40
+SITEMAP_XMLNS: str = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+CARS: tuple = (
+    ('Škoda', 'Octavia Combi'), ('Škoda', 'Fabia'), ('Škoda', 'Superb'), ('Škoda', 'Kodiaq'),
+    ('Volkswagen', 'Golf Variant'), ('Volkswagen', 'Passat'), ('Hyundai', 'i30'), ('Ford', 'Focus'),
+    ('Toyota', 'Corolla'), ('Kia', 'Ceed'), ('BMW', 'Řada 3'), ('Audi', 'A4 Avant'),
+)
+FUELS: tuple = ('Benzín', 'Nafta', 'Hybridní', 'LPG + benzín')
+GEARBOXES: tuple = ('Manuální', 'Automatická')
+ENGINES: tuple = (('1.0 TSI', 81), ('1.5 TSI', 110), ('2.0 TDI', 110), ('2.0 TDI', 140), ('1.6 MPI', 81))
+
+# Parts of the page around the listing, so the pages have the size of the real ones
+HEAD: str = '''<!DOCTYPE html>
+<html lang="cs">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="/static/css/main.css">
+<script src="/static/js/vendor.js"></script>
+</head>
+<body>
+<header class="header"><nav class="menu">{menu}</nav></header>
+'''
+FOOTER: str = '''<footer class="footer">
+<div class="footer__links">{links}</div>
+<p>&copy; Synthetic fixture for benchmarks, not a copy of the site.</p>
+</footer>
+<script>window.__INITIAL_STATE__ = {state};</script>
+</body>
+</html>
+'''
+
+
+def format_thousands(value: int, separator: str = ' '):
+    """
+    Formats a number with a thousands separator as on the sites (123 456).
+    """
+    return f'{value:,}'.replace(',', separator)
+
+
+def slugify(text: str):
+    """
+    Returns the text as an URL slug without diacritics (Škoda Octavia 2.0 -> skoda-octavia-2-0).
+    """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+
+def random_car(rng: random.Random):
+    """
+    Returns the details of one random car.
+    """
+    brand, model = rng.choice(CARS)
+    engine, power = rng.choice(ENGINES)
+    return {
+        'brand': brand,
+        'model': model,
+        'year': rng.randint(2010, 2024),
+        'km': rng.randint(5, 320) * 1000 + rng.randint(0, 999),
+        'fuel': rng.choice(FUELS),
+        'gearbox': rng.choice(GEARBOXES),
+        'engine': engine,
+        'power': power,
+        'price': rng.randint(60, 1200) * 1000 - 100,
+        'id': rng.randint(10_000_000, 999_999_999),
+    }
+
+
+def car_url(site: str, car: dict):
+    """
+    Returns the URL of the car as the parser of the site stores it in CarData.url.
+    """
+    if site == 'aaaauto':
+        return f"https://www.aaaauto.cz/cz/{slugify(car['brand'] + ' ' + car['model'])}/car.html?id={car['id']}#promo=listing"
+    if site in ('sauto', 'sauto_api'):
+        return f"https://www.sauto.cz/osobni/detail/{slugify(car['brand'])}/{slugify(car['model'].split()[0])}/{car['id']}"
+    return f"https://www.tipcars.com/{slugify(car['brand'] + ' ' + car['model'] + ' ' + car['engine'])}-{car['year']}-ojete-{car['id']}.html"
+
+
+def page_cars(site: str, page: int, cars_per_page: int = None):
+    """
+    Returns the cars of a listing page, the same ones as render_page shows.
+    """
+    rng: random.Random = random.Random(f'{site}-{page}')
+    return [random_car(rng) for _ in range(cars_per_page or CARS_PER_PAGE[site])]
+
+
+def page_frame(site: str, page: int, rng: random.Random, body: str):
+    """
+    Wraps the listing into a full page with header, footer and inline state.
+    """
+    menu: str = ''.join(f'<a href="/sekce-{index}/">Sekce {index}</a>' for index in range(40))
+    links: str = ''.join(f'<a href="/info/{index}/">Odkaz {index}</a>' for index in range(80))
+    state: str = '{' + ','.join(f'"k{index}":"{rng.getrandbits(64):016x}"' for index in range(300)) + '}'
+    return HEAD.format(title=f'{site} - strana {page}', menu=menu) + body + FOOTER.format(links=links, state=state)
+
+
+def page_window(page: int, before: int, after: int, total_pages: int = None):
+    """
+    Returns the page numbers shown in a pagination around the page, ending with the last page if it is known.
+    """
+    numbers: list = list(range(max(1, page - before), page + after + 1))
+    if total_pages is not None:
+        numbers = [number for number in numbers if number <= total_pages]
+        if total_pages not in numbers:
+            numbers.append(total_pages)
+    return numbers
+
+
+def render_aaaauto(page: int, cars: list, last: bool, total_pages: int = None):
+    if last:
+        return '<main><div class="paragraphWithIcon"><h3>Je nám líto, ale nenašli jsme žádné vozy.</h3></div></main>\n'
+    cards: list = []
+    for car in cars:
+        cards.append(f'''<div class="card box">
+<a class="primary notranslate" href="{car_url('aaaauto', car)}">
+
+\t\t\t\t\t{car['brand']} {car['model']}, {car['year']}</a>
+<ul class="carFeaturesList">
+<li>{format_thousands(car['km'])} km</li>
+<li class="odd">{car['gearbox']} / 6 st.</li>
+<li>{car['fuel']}</li>
+<li>{car['engine']} / {car['power']} kW</li>
+</ul>
+<h3 class="notranslate">{format_thousands(car['price'])} Kč</h3>
+</div>
+''')
+    pages: str = ''.join(f'<a href="https://www.aaaauto.cz/ojete-vozy/?page={number}">{number}</a>' for number in page_window(page, 4, 4, total_pages))
+    return '<main><div class="cars">\n' + ''.join(cards) + f'</div>\n<nav class="pagenav noprint center">{pages}</nav></main>\n'
+
+
+def render_sauto(page: int, cars: list, last: bool, total_pages: int = None):
+    if last:
+        return '<main><h1 class="c-error-box__title">Tady nic není</h1></main>\n'
+    items: list = []
+    for car in cars:
+        items.append(f'''<li class="c-item"><div class="c-item__data-wrap">
+<a class="sds-surface sds-surface--clickable sds-surface--00 c-item__link" href="{car_url('sauto', car)}">
+<span class="c-item__name c-item__name--hide">{car['brand']} {car['model']}, {car['engine']}</span>
+<span class="c-item__name--suffix">{car['engine']}, {car['power']} kW</span></a>
+<div class="c-item__info">{car['year']}, {format_thousands(car['km'], chr(160))}\xa0km</div>
+<span class="c-item__info-mobile-medium">, {car['fuel']}</span><span class="c-item__info-mobile-wide">, {car['gearbox']}</span>
+<div class="notranslate c-item__price">{format_thousands(car['price'], chr(160))} Kč</div>
+</div></li>
+''')
+    pages: str = ''.join(f'<a class="c-paging__btn-page" href="/inzerce/osobni/?strana={number}">{number}</a>' for number in page_window(page, 2, 2, total_pages))
+    return '<main><ul class="c-list">\n' + ''.join(items) + f'</ul>\n<nav class="c-paging">{pages}</nav></main>\n'
+
+
+def render_tipcars(page: int, cars: list, last: bool, total_pages: int = None):
+    listings: list = []
+    for car in ([] if last else cars):
+        listings.append(f'''<a class="w-100 float-l" href="{car_url('tipcars', car).removeprefix('https://www.tipcars.com')}">
+<h2 class="fs-20px lh-19 fs-tucne">{car['brand']} {car['model']}</h2>
+<div class="w-100 boxiky_s_udaji">{car['year']}</div>
+<div class="w-100 boxiky_s_udaji">{car['km'] // 1000} tkm</div>
+<div class="w-100 boxiky_s_udaji">{car['power']} kW</div>
+<div class="w-100 boxiky_s_udaji">{car['engine']}</div>
+<div class="w-100 boxiky_s_udaji">{car['fuel']}</div>
+<div class="fs-22px lh-19 fs-tucne mb-5">{format_thousands(car['price'], chr(160))}\xa0Kč</div>
+</a>
+''')
+    numbers: str = ''.join(f'<a href="/nabidka-vozidel/?str={number}">{number}</a>' for number in page_window(page, 2, 2, total_pages)) if total_pages else ''
+    paging: str = f'<div class="strankovani">{numbers}<a href="/nabidka-vozidel/?str={page + 1}"><i class="icon-doprava"></i></a></div>' if not last else ''
+    return '<main><div class="vypis">\n' + ''.join(listings) + f'</div>\n{paging}</main>\n'
+
+
+def render_sauto_api(page: int, cars: list, last: bool, total_pages: int = None):
+    """
+    Renders a page of the JSON listing of sauto.cz (only the fields read by SautoApiScraper and a few others).
+    """
+    limit: int = len(cars)
+    results: list = []
+    for car in ([] if last else cars):
+        model: str = car['model'].split()[0]
+        results.append({
+            'id': car['id'],
+            'name': f"{car['brand']} {car['model']} {car['engine']}",
+            'category_cb': {'name': 'Osobní', 'seo_name': 'osobni', 'value': 1},
+            'manufacturer_cb': {'name': car['brand'], 'seo_name': slugify(car['brand']), 'value': len(car['brand'])},
+            'model_cb': {'name': model, 'seo_name': slugify(model), 'value': len(model)},
+            'manufacturing_date': f"{car['year']}-01-01T00:00:00Z",
+            'in_operation_date': f"{car['year']}-03-01T00:00:00Z",
+            'tachometer': car['km'],
+            'fuel_cb': {'name': car['fuel'], 'seo_name': slugify(car['fuel']), 'value': 1},
+            'gearbox_cb': {'name': car['gearbox'], 'seo_name': slugify(car['gearbox']), 'value': 1},
+            'engine_power': car['power'],
+            'engine_volume': int(float(car['engine'].split()[0]) * 1000) - 2,
+            'price': car['price'],
+            'price_by_agreement': False,
+            'locality': {'district': 'Praha', 'region': 'Hlavní město Praha'},
+            'premise': {'id': car['id'] % 5000, 'name': 'Autobazar', 'seo_name': 'autobazar'},
+            'images': [{'url': f"//d46-a.sdn.cz/d_46/c_img_{car['id']}_{index}.jpeg"} for index in range(3)],
+        })
+    return json.dumps({
+        'pagination': {'limit': limit, 'offset': (page - 1) * limit, 'total': total_pages * limit if total_pages else (page - 1) * limit + len(results)},
+        'results': results,
+    }, ensure_ascii=False)
+
+
+RENDERERS: dict = {'aaaauto': render_aaaauto, 'sauto': render_sauto, 'tipcars': render_tipcars, 'sauto_api': render_sauto_api}
+
+
+def render_page(site: str, page: int, last: bool = False, cars_per_page: int = None, total_pages: int = None):
+    """
+    Renders a synthetic listing page in the markup the parsers of the site expect (JSON for sauto_api).
+
+    The same site and page always give the same cars, different pages give different ones.
+
+    Args:
+        site (str): The site key (aaaauto, sauto, tipcars, sauto_api).
+        page (int): The page number.
+        last (bool): Render the page shown after the last page of results.
+        cars_per_page (int, optional): The number of cars on the page.
+        total_pages (int, optional): The number of pages of the listing, shown in the pagination (only nearby pages if not given).
+
+    Returns:
+        str: The HTML (or JSON) of the page.
+    """
+    rng: random.Random = random.Random(f'{site}-{page}')
+    cars: list = [random_car(rng) for _ in range(cars_per_page or CARS_PER_PAGE[site])]
+    body: str = RENDERERS[site](page, cars, last, total_pages)
+    if site in FIXTURE_EXTENSIONS:
+        return body
+    return page_frame(site, page, rng, body)
+
+
+def render_sitemap(urls: list):
+    """
+    Renders a sitemap (urlset) with the given URLs.
+    """
+    entries: str = ''.join(f'<url><loc>{escape(url)}</loc><lastmod>2024-05-{index % 28 + 1:02d}</lastmod><changefreq>daily</changefreq></url>\n' for index, url in enumerate(urls))
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_XMLNS}">\n{entries}</urlset>\n'
+
+
+def render_sitemap_index(locations: list):
+    """
+    Renders a sitemap index pointing to the given sitemaps (relative locations are resolved against the index).
+    """
+    entries: str = ''.join(f'<sitemap><loc>{escape(location)}</loc><lastmod>2024-05-01</lastmod></sitemap>\n' for location in locations)
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_XMLNS}">\n{entries}</sitemapindex>\n'
+
+
+def sitemap_files(site: str, pages: int, urls_per_file: int = SITEMAP_URLS_PER_FILE):
+    """
+    Returns the sitemaps of a site listing the cars of its listing pages 1..pages (without the URL fragment).
+
+    The index points to a nested index of the car sitemaps (alternately gzipped and plain) and to a sitemap
+    of other pages, as on the real sites.
+
+    Returns:
+        dict: File name -> content (bytes); the entry point is sitemap_index.xml.
+    """
+    urls: list = [car_url(site, car).split('#')[0] for page in range(1, pages + 1) for car in page_cars(site, page)]
+    files: dict = {}
+    car_sitemaps: list = []
+    for number, index in enumerate(range(0, len(urls), urls_per_file), start=1):
+        content: bytes = render_sitemap(urls[index:index + urls_per_file]).encode('utf-8')
+        if number % 2:
+            name: str = f'cars-{number}.xml.gz'
+            content = gzip.compress(content, mtime=0)
+        else:
+            name = f'cars-{number}.xml'
+        files[name] = content
+        car_sitemaps.append(name)
+    files['cars-index.xml'] = render_sitemap_index(car_sitemaps).encode('utf-8')
+    files['pages.xml'] = render_sitemap([f'https://www.example.com/{site}/info/{index}/' for index in range(20)]).encode('utf-8')
+    files['sitemap_index.xml'] = render_sitemap_index(['cars-index.xml', 'pages.xml']).encode('utf-8')
+    return files
+
+
+def fixture_path(site: str, name: str = 'page'):
+    """
+    Returns the path of a recorded fixture, e.g. fixtures/sauto_page.html or fixtures/sauto_api_page.json.
+    """
+    return os.path.join(FIXTURES_DIR, f'{site}_{name}.{FIXTURE_EXTENSIONS.get(site, "html")}')
+
+
+def load_fixture(site: str, name: str = 'page'):
+    """
+    Returns the content of a recorded fixture.
+    """
+    with open(fixture_path(site, name), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Record the HTML and JSON fixtures of the listing pages used by the benchmarks.')
+    parser.parse_args(argv)
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for site in RENDERERS:
+        for name, last in (('page', False), ('last_page', True)):
+            with open(fixture_path(site, name), 'w', encoding='utf-8', newline='\n') as file:
+                file.write(render_page(site, 1, last=last))
+            print(f'Written {fixture_path(site, name)}')
+    for site in ('aaaauto', 'sauto', 'tipcars'):
+        directory: str = os.path.join(FIXTURES_DIR, 'sitemaps', site)
+        os.makedirs(directory, exist_ok=True)
+        for name, content in sitemap_files(site, SITEMAP_FIXTURE_PAGES).items():
+            with open(os.path.join(directory, name), 'wb') as file:
+                file.write(content)
+        print(f'Written {directory}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Root of the project (the modules are imported from here)
+PROJECT_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Timings of this machine stored with --save (not committed, the milliseconds of one machine mean nothing on another)
+BASELINE_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_time_baseline.json')
+
+# Entry points whose startup is tracked and the heavy packages they must not import
+ENTRY_POINTS: tuple = ('main', 'cli')
+HEAVY_MODULES: tuple = ('pandas', 'numpy', 'bs4', 'sqlalchemy', 'consolemenu', 'requests')
+
+
+def measure_import(module: str):
+    """
+    Imports the module in a fresh interpreter with `python -X importtime` and parses the report.
+
+    Args:
+        module (str): The name of the module to import.
+
+    Returns:
+        tuple: The cumulative import time of the module in microseconds and the set of all imported modules.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True,
+    )
+    cumulative_us: int = 0
+    imported: set = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        imported.add(name.strip())
+        if name.strip() == module and not name.startswith('  '):
+            cumulative_us = int(cumulative)
+    return cumulative_us, imported
+
+
+def run_benchmark(modules: tuple, runs: int):
+    """
+    Measures every module `runs` times and keeps the fastest run (the least disturbed by the machine).
+
+    Args:
+        modules (tuple): The names of the modules to import.
+        runs (int): The number of measurements per module.
+
+    Returns:
+        dict: Module -> {'cumulative_ms': float, 'heavy_modules': list}.
+    """
+    results: dict = {}
+    for module in modules:
+        timings: list = []
+        imported: set = set()
+        for _ in range(runs):
+            cumulative_us, imported = measure_import(module)
+            timings.append(cumulative_us)
+        results[module] = {
+            'cumulative_ms': round(min(timings) / 1000, 2),
+            'heavy_modules': sorted(name for name in HEAVY_MODULES if name in imported),
+        }
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float):
+    """
+    Checks that no entry point imports a heavy module and, if a baseline was saved on this machine,
+    that it is not slower than the baseline.
+
+    Args:
+        results (dict): The results of run_benchmark.
+        baseline (dict): The baseline saved with --save, empty if there is none.
+        tolerance (float): Allowed slowdown as a fraction of the baseline (0.5 = 50 %).
+
+    Returns:
+        list: Descriptions of the regressions, empty if there are none.
+    """
+    regressions: list = []
+    for module, result in results.items():
+        if result['heavy_modules']:
+            regressions.append(f'{module}: imports heavy modules at startup: {", ".join(result["heavy_modules"])}')
+        if module not in baseline:
+            continue
+        limit: float = baseline[module]['cumulative_ms'] * (1 + tolerance)
+        if result['cumulative_ms'] > limit:
+            regressions.append(f'{module}: {result["cumulative_ms"]} ms > {limit:.2f} ms (baseline {baseline[module]["cumulative_ms"]} ms)')
+    return regressions
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Startup import time benchmark based on python -X importtime.')
+    parser.add_argument('--modules', nargs='+', default=list(ENTRY_POINTS), help='Modules to import (default: main cli).')
+    parser.add_argument('--runs', type=int, default=5, help='Measurements per module, the fastest one is kept (default: 5).')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed slowdown against the local baseline (default: 0.5 = 50 %%).')
+    parser.add_argument('--save', action='store_true', help='Store the results as the baseline of this machine.')
+    args = parser.parse_args(argv)
+
+    results: dict = run_benchmark(tuple(args.modules), args.runs)
+    for module, result in results.items():
+        heavy: str = ', '.join(result['heavy_modules']) or '-'
+        print(f'{module:<12} {result["cumulative_ms"]:>9.2f} ms   heavy modules: {heavy}')
+
+    if args.save:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+        print(f'Baseline stored to {BASELINE_FILE}')
+        return 0
+
+    baseline: dict = {}
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+    regressions: list = compare_with_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from bench_parsers import PROJECT_DIR, prepare_environment
+from mock_car_sites import MockCarSites, SITE_ROUTES
+
+
+def write_settings(work_dir: str, base_urls: dict, timeout: int, api_urls: dict = None, api_page_size: int = 100, streaming: bool = False):
+    """
+    Writes a copy of the settings file pointing the sites to the mock server, without proxies.
+
+    Args:
+        work_dir (str): The temporary directory.
+        base_urls (dict): Site -> base URL on the mock server.
+        timeout (int): The request timeout in seconds.
+        api_urls (dict, optional): Site -> URL of its JSON endpoint on the mock server, turns the API mode of the site on.
+        api_page_size (int): The number of cars per page of the JSON endpoints.
+        streaming (bool): Read the listing pages only up to their pagination (scraping_settings.streaming_fetch).
+
+    Returns:
+        str: The path of the written settings file.
+    """
+    with open(os.path.join(PROJECT_DIR, 'settings', 'config_file.json'), 'r', encoding='utf-8') as file:
+        config_data: dict = json.load(file)
+    for site, base_url in base_urls.items():
+        config_data['scraping_settings'][f'base_url_{site}'] = base_url
+    config_data['scraping_settings']['request_timeout'] = timeout
+    for site, api_url in (api_urls or {}).items():
+        config_data['scraping_settings'][f'{site}_api'] = {'enabled': True, 'url': api_url, 'page_size': api_page_size}
+    config_data['scraping_settings'].setdefault('streaming_fetch', {})['enabled'] = streaming
+    config_data['proxy_settings']['use_proxy'] = False
+    path: str = os.path.join(work_dir, 'config_file.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(config_data, file, ensure_ascii=False)
+    return path
+
+
+def run_load_test(mock: MockCarSites, sites: list, pages: int, concurrency: int, request_call_limit: int, number_of_attempts: int, discover: bool = False, repeat: bool = False):
+    """
+    Runs the whole pipeline (fetch, parse, compare with the database, insert) for every site against the mock server.
+
+    Args:
+        mock (MockCarSites): The running mock server.
+        sites (list): The sites to scrape, one after another.
+        pages (int): The last page to scrape.
+        concurrency (int): The number of pages fetched at the same time.
+        request_call_limit (int): The request_call_limit of the scrapers (requests per second).
+        number_of_attempts (int): The number_of_attempts of the scrapers.
+        discover (bool): Read the last page from the first page instead of passing `pages` (pipeline.discover_last_page).
+        repeat (bool): Scrape every site a second time with the cars already stored, as a frequent re-crawl does.
+
+    Returns:
+        dict: Site -> {'pages', 'cars', 'inserted', 'seconds', 'pages_per_second', 'bytes'}, with `repeat` also
+            'repeat_seconds' and 'repeat_unchanged_pages'.
+    """
+    from db import Base, CarData, ProxySettings, ScrapingSettings, get_engine, session_scope
+    from metrics import metrics
+    import pipeline
+    from dimensions import DIMENSIONS
+
+    for variable in ('LOG_DIR_SCRAPING', 'LOG_DIR_DATABASE'):
+        logging.getLogger(os.environ[variable]).setLevel(logging.WARNING)
+
+    Base.metadata.create_all(get_engine(), tables=[*(Model.__table__ for Model in DIMENSIONS.values()), CarData.__table__, ScrapingSettings.__table__, ProxySettings.__table__])
+    with session_scope() as session:
+        session.add(ScrapingSettings(id=1, request_call_limit=request_call_limit, request_period_seconds=1, requests_made=0, number_of_attempts=number_of_attempts))
+        session.add(ProxySettings(id=1, number_of_proxies=0))
+
+    results: dict = {}
+    for site in sites:
+        metrics.reset()
+        start: float = time.perf_counter()
+        df = pipeline.scrape_site(site, 1, None if discover else pages, concurrency=concurrency, incremental=True)
+        pipeline.export_data(df, site, 'db')
+        seconds: float = time.perf_counter() - start
+
+        summary: dict = metrics.summary()
+        parsed_pages: int = sum(item['count'] for item in summary['histograms'] if item['name'] == 'parse_seconds')
+        cars: int = sum(item['value'] for item in summary['counters'] if item['name'] == 'cars_parsed_total')
+        results[site] = {
+            'pages': parsed_pages,
+            'cars': cars,
+            'inserted': len(df),
+            'seconds': round(seconds, 3),
+            'pages_per_second': round(parsed_pages / seconds, 2) if seconds else None,
+            'bytes': sum(item['value'] for item in summary['counters'] if item['name'] == 'bytes_downloaded_total'),
+        }
+        if repeat:
+            metrics.reset()
+            start = time.perf_counter()
+            df = pipeline.scrape_site(site, 1, None if discover else pages, concurrency=concurrency, incremental=True)
+            pipeline.export_data(df, site, 'db')
+            results[site]['repeat_seconds'] = round(time.perf_counter() - start, 3)
+            results[site]['repeat_unchanged_pages'] = sum(
+                item['value'] for item in metrics.summary()['counters'] if item['name'] == 'pages_unchanged_total'
+            )
+    return results
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='End-to-end load test of the scrape pipeline against the local mock car sites.')
+    parser.add_argument('--site', nargs='+', choices=list(SITE_ROUTES), default=list(SITE_ROUTES), help='Sites to scrape (default: all).')
+    parser.add_argument('--pages', type=int, default=20, help='Pages with cars per site (default: 20).')
+    parser.add_argument('--concurrency', type=int, default=4, help='Pages fetched at the same time (default: 4).')
+    parser.add_argument('--request-call-limit', type=int, default=1000, help='Requests per second allowed to the scraper (default: 1000).')
+    parser.add_argument('--attempts', type=int, default=3, help='number_of_attempts of the scrapers (default: 3).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Delay of every response in seconds (default: 0.05).')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Random extra delay of every response (default: 0.05).')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of responses replaced by 500 (0-1).')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of responses replaced by 429 (0-1).')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After of 429 responses in seconds (default: 0).')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random latency and errors (default: 1).')
+    parser.add_argument('--discover', action='store_true', help='Let the pipeline read the last page from the first page and schedule all pages at once.')
+    parser.add_argument('--sauto-api', action='store_true', help='Scrape sauto from its JSON endpoint (--pages pages of --api-page-size cars).')
+    parser.add_argument('--repeat', action='store_true', help='Scrape every site a second time (re-crawl of unchanged pages).')
+    parser.add_argument('--streaming', action='store_true', help='Stop reading every listing page after its pagination (scraping_settings.streaming_fetch).')
+    parser.add_argument('--api-page-size', type=int, default=100, help='Cars per page of the JSON endpoint (default: 100).')
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='mcs-load-') as work_dir, \
+            MockCarSites(pages=args.pages, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         rate_429=args.rate_429, retry_after=args.retry_after, seed=args.seed) as mock:
+        prepare_environment(work_dir)
+        api_urls: dict = {'sauto': mock.api_urls()['sauto']} if args.sauto_api else None
+        os.environ['SETTINGS_APK'] = write_settings(work_dir, mock.base_urls(), timeout=10, api_urls=api_urls, api_page_size=args.api_page_size, streaming=args.streaming)
+        results: dict = run_load_test(mock, args.site, args.pages, args.concurrency, args.request_call_limit, args.attempts, args.discover, args.repeat)
+        from db import dispose_engine
+        dispose_engine()
+
+    total_pages: int = sum(result['pages'] for result in results.values())
+    total_seconds: float = sum(result['seconds'] for result in results.values())
+    for site, result in results.items():
+        print(f'{site:<10} {result["pages"]:>5} pages {result["cars"]:>6} cars {result["inserted"]:>6} inserted {result["seconds"]:>9.3f} s {result["pages_per_second"]:>8.2f} pages/s {result["bytes"] / 1024:>9.1f} KiB')
+    for site, result in results.items():
+        if 'repeat_seconds' in result:
+            print(f'{site:<10} re-crawl {result["repeat_seconds"]:>9.3f} s, {result["repeat_unchanged_pages"]} unchanged pages skipped')
+    print(f'{"total":<10} {total_pages:>5} pages {total_seconds:>37.3f} s {total_pages / total_seconds if total_seconds else 0:>8.2f} pages/s')
+    print(f'server responses: {mock.stats}')
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as file:
+            json.dump({'sites': results, 'server': mock.stats, 'arguments': vars(args)}, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
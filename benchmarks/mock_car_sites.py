@@ -0,0 +1,246 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from fixtures import CARS_PER_PAGE, render_page, sitemap_files
+
+
+# Listing path and page parameter of every site, as in base_url_* of the settings file
+SITE_ROUTES: dict = {
+    'aaaauto': ('/ojete-vozy/', 'page'),
+    'sauto': ('/inzerce/osobni/', 'strana'),
+    'tipcars': ('/nabidka-vozidel/', 'str'),
+}
+
+# JSON endpoints (limit/offset paging) -> fixture site, see scraper.SautoApiScraper
+API_ROUTES: dict = {
+    '/api/v1/items/search': 'sauto_api',
+}
+
+
+class MockCarSites:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, pages: int = 20, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_429: float = 0.0, retry_after: int = 1, seed: int = None) -> None:
+        """
+        Initializes a local HTTP server with synthetic listing pages of aaaauto.cz, sauto.cz and tipcars.com.
+
+        Pages 1..pages have cars, higher pages return the page the site shows after the last page of results.
+        The JSON listing of sauto.cz (/api/v1/items/search?limit=&offset=) has `pages` pages of `limit` cars.
+        The sitemaps of a site (/sitemaps/<site>/sitemap_index.xml) list the cars of all its listing pages.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 picks a free port.
+            pages (int): The number of pages with cars per site.
+            latency (float): The delay of every response in seconds.
+            jitter (float): The random extra delay of every response, up to this many seconds.
+            error_rate (float): The share of responses replaced by 500 Internal Server Error.
+            rate_429 (float): The share of responses replaced by 429 Too Many Requests.
+            retry_after (int): The Retry-After header of 429 responses in seconds.
+            seed (int, optional): The seed of the random latency and errors, for repeatable runs.
+        """
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.page_cache: dict = {}
+        self.stats: dict = {}
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        The root URL of the server, e.g. http://127.0.0.1:8000.
+        """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def base_urls(self):
+        """
+        Returns the base URLs of the sites on this server, in the form of base_url_* of the settings file.
+        """
+        return {site: f'{self.url}{path}?{parameter}=' for site, (path, parameter) in SITE_ROUTES.items()}
+
+    def sitemap_urls(self):
+        """
+        Returns the sitemap index of every site on this server, in the form of sitemap_settings.sites.<site>.url.
+        """
+        return {site: f'{self.url}/sitemaps/{site}/sitemap_index.xml' for site in SITE_ROUTES}
+
+    def api_urls(self):
+        """
+        Returns the URLs of the JSON endpoints, in the form of scraping_settings.<site>_api.url of the settings file.
+        """
+        return {'sauto': f'{self.url}/api/v1/items/search?category_id=838&limit={{limit}}&offset={{offset}}'}
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def get_page(self, site: str, page: int, cars_per_page: int = None):
+        """
+        Returns the encoded page, rendered once and then served from memory.
+        """
+        key: tuple = (site, page if page <= self.pages else 'last', cars_per_page)
+        body: bytes = self.page_cache.get(key)
+        if body is None:
+            body = render_page(site, page, last=page > self.pages, cars_per_page=cars_per_page, total_pages=self.pages).encode('utf-8')
+            self.page_cache[key] = body
+        return body
+
+    def respond(self, handler: BaseHTTPRequestHandler):
+        """
+        Answers one GET request: a listing page, an injected error or 404.
+        """
+        url = urlsplit(handler.path)
+        if url.path.startswith('/sitemaps/'):
+            self.respond_sitemap(handler, url.path)
+            return
+        site: str = next((name for name, (path, _) in SITE_ROUTES.items() if url.path == path), None) or API_ROUTES.get(url.path)
+        if site is None:
+            self.count('404')
+            handler.send_error(404)
+            return
+
+        with self.lock:
+            delay: float = self.latency + self.random.uniform(0, self.jitter)
+            chance: float = self.random.random()
+        if delay:
+            time.sleep(delay)
+        if chance < self.rate_429:
+            self.count('429')
+            handler.send_response(429)
+            handler.send_header('Retry-After', str(self.retry_after))
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        if chance < self.rate_429 + self.error_rate:
+            self.count('500')
+            handler.send_error(500)
+            return
+
+        query: dict = parse_qs(url.query)
+        cars_per_page: int = None
+        try:
+            if site in SITE_ROUTES:
+                page: int = int(query.get(SITE_ROUTES[site][1], ['1'])[0])
+            else:
+                cars_per_page = max(1, int(query.get('limit', [CARS_PER_PAGE[site]])[0]))
+                page = int(query.get('offset', ['0'])[0]) // cars_per_page + 1
+        except ValueError:
+            page = 1
+        body: bytes = self.get_page(site, max(page, 1), cars_per_page)
+        self.count('200')
+        self.count(f'pages_{site}')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/html; charset=utf-8' if site in SITE_ROUTES else 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def respond_sitemap(self, handler: BaseHTTPRequestHandler, path: str):
+        """
+        Answers a request for a sitemap file of a site (no latency or injected errors).
+        """
+        _, _, site, name = (path.split('/') + [''])[:4]
+        with self.lock:
+            if ('sitemaps', site) not in self.page_cache and site in SITE_ROUTES:
+                self.page_cache[('sitemaps', site)] = sitemap_files(site, self.pages)
+            files: dict = self.page_cache.get(('sitemaps', site), {})
+        if name not in files:
+            self.count('404')
+            handler.send_error(404)
+            return
+        self.count(f'sitemaps_{site}')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/gzip' if name.endswith('.gz') else 'application/xml')
+        handler.send_header('Content-Length', str(len(files[name])))
+        handler.end_headers()
+        handler.wfile.write(files[name])
+
+    def make_handler(self):
+        mock: MockCarSites = self
+
+        class MockHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, as the real sites
+
+            def do_GET(self):
+                try:
+                    mock.respond(self)
+                except ConnectionError:
+                    # Klient zavrel spojenie pred koncom stránky (streaming fetch)
+                    self.close_connection = True
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return MockHandler
+
+    def start(self):
+        """
+        Serves the pages from a background thread.
+
+        Returns:
+            MockCarSites: The server itself.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes its socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Local stand-in for aaaauto.cz, sauto.cz and tipcars.com with synthetic listing pages.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: 8000).')
+    parser.add_argument('--pages', type=int, default=20, help='Pages with cars per site (default: 20).')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay of every response in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra delay of every response, up to this many seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of responses replaced by 500 (0-1).')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of responses replaced by 429 (0-1).')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of 429 responses in seconds (default: 1).')
+    parser.add_argument('--seed', type=int, help='Seed of the random latency and errors.')
+    args = parser.parse_args(argv)
+
+    mock = MockCarSites(args.host, args.port, args.pages, args.latency, args.jitter, args.error_rate, args.rate_429, args.retry_after, args.seed)
+    print(f'Serving mock car sites on {mock.url}')
+    for site, base_url in mock.base_urls().items():
+        print(f'  base_url_{site}: {base_url}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+        print(mock.stats)
+
+
+if __name__ == '__main__':
+    main()
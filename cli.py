@@ -0,0 +1,373 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+from config import load_env, get_settings
+from logs import logger
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_MAIN = os.getenv('LOG_DIR_MAIN')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_MAIN, name='main')
+
+# Site keys, kept in sync with pipeline.SITES (pipeline is imported lazily, it pulls in pandas and bs4)
+SITE_CHOICES: tuple = ('aaaauto', 'sauto', 'tipcars')
+OUTPUT_CHOICES: tuple = ('db', 'csv', 'xlsx', 'stdout', 'none')
+
+
+def build_parser():
+    """
+    Builds the argument parser of the headless command line interface.
+
+    Returns:
+        argparse.ArgumentParser: The argument parser.
+    """
+    parser = argparse.ArgumentParser(description='Multi cars scraping - non-interactive runs (cron, several hosts).')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scrape_parser = subparsers.add_parser('scrape', help='Scrape a range of pages of one or all sites.')
+    scrape_parser.add_argument('--site', choices=SITE_CHOICES + ('all',), required=True, help='Site to scrape.')
+    scrape_parser.add_argument('--start-page', type=int, default=1, help='First page to scrape (default: 1).')
+    scrape_parser.add_argument('--end-page', type=int, help='Last page to scrape (default: the last page of the listing, read from its first page).')
+    scrape_parser.add_argument('--concurrency', type=int, default=1, help='Number of pages fetched at the same time (default: 1).')
+    scrape_parser.add_argument('--output', choices=OUTPUT_CHOICES, default='db', help='Where to write the scraped data (default: db).')
+    scrape_parser.add_argument('--output-dir', default='multi-cars-scraping', help='Directory for csv and xlsx exports.')
+    scrape_parser.add_argument('--incremental', action='store_true', help='Keep only cars not yet stored in the database.')
+    scrape_parser.add_argument('--schedule', action='store_true', help='Repeat the run according to scheduler_settings in the settings file.')
+    add_metrics_arguments(scrape_parser)
+    add_profile_arguments(scrape_parser)
+    scrape_parser.set_defaults(handler=run_scrape)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Split a page range into tasks of the shared work queue.')
+    enqueue_parser.add_argument('--site', choices=SITE_CHOICES + ('all',), required=True, help='Site to scrape.')
+    enqueue_parser.add_argument('--start-page', type=int, default=1, help='First page to scrape (default: 1).')
+    enqueue_parser.add_argument('--end-page', type=int, help='Last page to scrape (default: the last page of the listing, read from its first page).')
+    enqueue_parser.add_argument('--pages-per-task', type=int, help='Number of pages in one task (default: work_queue_settings.pages_per_task).')
+    enqueue_parser.set_defaults(handler=run_enqueue)
+
+    worker_parser = subparsers.add_parser('worker', help='Process tasks of the shared work queue and insert new cars into the database.')
+    worker_parser.add_argument('--concurrency', type=int, default=1, help='Number of pages fetched at the same time (default: 1).')
+    worker_parser.add_argument('--lease-seconds', type=int, help='How long a claimed task stays reserved (default: work_queue_settings.lease_seconds).')
+    worker_parser.add_argument('--max-attempts', type=int, help='Attempts before a task is marked as failed (default: work_queue_settings.max_attempts).')
+    worker_parser.add_argument('--exit-when-empty', action='store_true', help='Stop when the queue is empty instead of waiting for new tasks.')
+    add_metrics_arguments(worker_parser)
+    add_profile_arguments(worker_parser)
+    worker_parser.set_defaults(handler=run_work_queue_worker)
+
+    status_parser = subparsers.add_parser('queue-status', help='Show the number of tasks in the work queue by status.')
+    status_parser.set_defaults(handler=run_queue_status)
+
+    enrich_parser = subparsers.add_parser('enrich', help='Fill the columns missing on the listing cards of stored cars from their detail pages.')
+    enrich_parser.add_argument('--site', choices=SITE_CHOICES + ('all',), required=True, help='Site of the cars.')
+    enrich_parser.add_argument('--limit', type=int, help='Maximum number of detail pages per site.')
+    add_metrics_arguments(enrich_parser)
+    enrich_parser.set_defaults(handler=run_enrich)
+
+    match_parser = subparsers.add_parser('match', help='Mark the cars listed on several sites in the whole database table.')
+    match_parser.add_argument('--batch-size', type=int, help='Blocking keys compared per query (default: matching_settings.batch_size).')
+    match_parser.set_defaults(handler=run_match)
+
+    listing_ids_parser = subparsers.add_parser('listing-ids', help='Compute the listing ids (site, listing_id) of the stored cars which do not have them yet.')
+    listing_ids_parser.add_argument('--batch-size', type=int, default=500, help='Cars updated per statement (default: 500).')
+    listing_ids_parser.set_defaults(handler=run_listing_ids)
+
+    dimensions_parser = subparsers.add_parser('dimensions', help='Move brand, model, fuel, transmission and country of the stored cars to the dimension tables.')
+    dimensions_parser.add_argument('--batch-size', type=int, default=500, help='Cars updated per statement (default: 500).')
+    dimensions_parser.set_defaults(handler=run_dimensions)
+
+    sitemap_parser = subparsers.add_parser('sitemap', help='Queue the listings from the sitemaps of a site which are not stored in the database yet.')
+    sitemap_parser.add_argument('--site', choices=SITE_CHOICES + ('all',), required=True, help='Site to read.')
+    sitemap_parser.add_argument('--sitemap', help='Sitemap index to read instead of sitemap_settings.sites.<site>.url (URL or local file, one site only).')
+    sitemap_parser.add_argument('--limit', type=int, help='Maximum number of listing URLs read per site.')
+    add_metrics_arguments(sitemap_parser)
+    sitemap_parser.set_defaults(handler=run_sitemap)
+
+    listings_parser = subparsers.add_parser('listings', help='Scrape the listings queued by sitemap from their detail pages and insert the new cars.')
+    listings_parser.add_argument('--site', choices=SITE_CHOICES + ('all',), required=True, help='Site of the listings.')
+    listings_parser.add_argument('--limit', type=int, help='Maximum number of listings per site.')
+    add_metrics_arguments(listings_parser)
+    listings_parser.set_defaults(handler=run_listings)
+    return parser
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for exporting the metrics of the run.
+    """
+    parser.add_argument('--metrics-json', help='Write the JSON summary of the run metrics to this file after every run.')
+    parser.add_argument('--metrics-port', type=int, help='Serve the metrics in Prometheus text format on http://0.0.0.0:PORT/metrics.')
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the options for profiling the run (see profiling.RunProfiler).
+    """
+    parser.add_argument('--profile', nargs='?', const='cprofile', choices=('cprofile', 'pyinstrument'),
+                        help='Profile every run and save the reports to profiles/<timestamp> next to the log files (default profiler: cprofile).')
+    parser.add_argument('--profile-page-sample', type=int, default=10, help='Trace every n-th page when profiling, 0 for none (default: 10).')
+    parser.add_argument('--profile-no-memory', action='store_true', help='Do not take tracemalloc snapshots after the stages when profiling.')
+
+
+def get_run_interval():
+    """
+    Reads the interval between scheduled runs from the settings file (scheduler_settings).
+
+    Returns:
+        timedelta or None: The interval between runs, or None if the scheduler is disabled.
+    """
+    scheduler_settings: dict = get_settings().scheduler
+    if not scheduler_settings.get('enable_scheduler', False):
+        return None
+    run_interval: timedelta = timedelta(**scheduler_settings.get('run_interval', {}))
+    if run_interval <= timedelta(0):
+        raise ValueError('scheduler_settings.run_interval must be a positive interval')
+    return run_interval
+
+
+def run_scrape(args: argparse.Namespace):
+    """
+    Scrapes the requested sites once and writes the data to the chosen output.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from pipeline import close_proxy_pool, export_data, get_proxy_pool, scrape_site, wait_for_enrichment
+
+    sites: tuple = SITE_CHOICES if args.site == 'all' else (args.site,)
+    # One pool for all sites and the enrichment of their cars, the proxies are checked once per run
+    proxy_pool = get_proxy_pool()
+    try:
+        for site in sites:
+            logger.info(f'Headless run: {site}, pages {args.start_page}-{args.end_page or 'last'}, concurrency {args.concurrency}, output {args.output}')
+            try:
+                df = scrape_site(site, args.start_page, args.end_page, concurrency=args.concurrency, incremental=args.incremental, proxy_pool=proxy_pool)
+                export_data(df, site, args.output, args.output_dir, proxy_pool=proxy_pool)
+            except Exception as e:
+                logger.exception(f'Headless run of {site} failed: {e}')
+    finally:
+        wait_for_enrichment()
+        close_proxy_pool(proxy_pool)
+
+
+def run_enqueue(args: argparse.Namespace):
+    """
+    Adds the page range of the requested sites to the shared work queue.
+    Without --end-page the last page of every site is read from its first page, so the whole listing is split into tasks at once.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from work_queue import WorkQueue
+
+    queue = WorkQueue()
+    sites: tuple = SITE_CHOICES if args.site == 'all' else (args.site,)
+    for site in sites:
+        end_page: int = args.end_page
+        if end_page is None:
+            from pipeline import discover_last_page
+            end_page = discover_last_page(site)
+            if end_page is None:
+                logger.error(f'Last page of {site} not found, use --end-page')
+                continue
+        queue.enqueue(site, args.start_page, end_page, args.pages_per_task)
+
+
+def run_work_queue_worker(args: argparse.Namespace):
+    """
+    Runs a worker of the shared work queue. Start one on every node sharing the same DATABASE_URL.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from work_queue import WorkQueue, run_worker
+
+    queue = WorkQueue(lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+    run_worker(queue, concurrency=args.concurrency, exit_when_empty=args.exit_when_empty)
+
+
+def run_queue_status(args: argparse.Namespace):
+    """
+    Prints the number of tasks in the work queue by status.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from work_queue import WorkQueue
+
+    for status, count in sorted(WorkQueue().stats().items()):
+        print(f'{status}: {count}')
+
+
+def run_enrich(args: argparse.Namespace):
+    """
+    Completes the stored cars of the requested sites from their detail pages (see pipeline.enrich_site).
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from pipeline import enrich_site
+
+    sites: tuple = SITE_CHOICES if args.site == 'all' else (args.site,)
+    for site in sites:
+        updated: int = enrich_site(site, limit=args.limit)
+        print(f'{site}: {updated} cars updated')
+
+
+def run_match(args: argparse.Namespace):
+    """
+    Finds the near-duplicate cars across sites in the whole table (see matching.NearDuplicateMatcher.match_table).
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from matching import NearDuplicateMatcher
+
+    result: dict = NearDuplicateMatcher(batch_size=args.batch_size).match_table()
+    print(f'blocks: {result["blocks"]}, duplicates: {result["duplicates"]}, updated: {result["updated"]}')
+
+
+def run_listing_ids(args: argparse.Namespace):
+    """
+    Backfills site and listing_id of the stored cars (see listings.backfill_listing_ids).
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from db import DatabaseManagerSettings, CarData
+    from listings import backfill_listing_ids
+
+    DatabaseManagerSettings().ensure_columns(CarData.__table__)
+    result: dict = backfill_listing_ids(batch_size=args.batch_size)
+    print(f'updated: {result["updated"]}, without id: {result["without_id"]}, repeated listings: {result["repeated"]}')
+
+
+def run_dimensions(args: argparse.Namespace):
+    """
+    Moves the dimension values of the stored cars to the dimension tables (see dimensions.backfill_dimensions).
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from dimensions import backfill_dimensions
+
+    print(f'updated: {backfill_dimensions(batch_size=args.batch_size)}')
+
+
+def run_sitemap(args: argparse.Namespace):
+    """
+    Queues the new listings of the requested sites from their sitemaps (see pipeline.discover_listings)
+    and prints the state of the listing queue.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from pipeline import discover_listings
+    from sitemap import listing_queue_stats
+
+    sites: tuple = SITE_CHOICES if args.site == 'all' else (args.site,)
+    if args.sitemap and len(sites) > 1:
+        raise SystemExit('--sitemap needs a single --site')
+    for site in sites:
+        result: dict = discover_listings(site, sitemap_url=args.sitemap, limit=args.limit)
+        print(f'{site}: {result["sitemaps"]} sitemaps, {result["listings"]} listings, {result["queued"]} queued')
+    for (site, status), count in sorted(listing_queue_stats().items()):
+        print(f'{site} {status}: {count}')
+
+
+def run_listings(args: argparse.Namespace):
+    """
+    Scrapes the queued listings of the requested sites (see pipeline.scrape_listing_queue) and prints the state
+    of the listing queue.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    from pipeline import close_proxy_pool, get_proxy_pool, scrape_listing_queue
+    from sitemap import listing_queue_stats
+
+    sites: tuple = SITE_CHOICES if args.site == 'all' else (args.site,)
+    proxy_pool = get_proxy_pool()
+    try:
+        for site in sites:
+            result: dict = scrape_listing_queue(site, limit=args.limit, proxy_pool=proxy_pool)
+            print(f'{site}: {result["fetched"]} fetched, {result["inserted"]} inserted, {result["failed"]} failed')
+    finally:
+        close_proxy_pool(proxy_pool)
+    for (site, status), count in sorted(listing_queue_stats().items()):
+        print(f'{site} {status}: {count}')
+
+
+def run_once(args: argparse.Namespace):
+    """
+    Runs the command once, profiled if requested, and writes the JSON summary of the metrics if requested.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    profiler = None
+    if getattr(args, 'profile', None):
+        from profiling import RunProfiler
+        profiler = RunProfiler(args.profile, memory=not args.profile_no_memory, page_sample=args.profile_page_sample).start()
+    try:
+        args.handler(args)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if getattr(args, 'metrics_json', None):
+            from metrics import metrics
+            metrics.write_json(args.metrics_json)
+            logger.info(f'Metrics summary written to {args.metrics_json}')
+
+
+def run_scheduled(args: argparse.Namespace):
+    """
+    Runs the command in a loop with the interval from scheduler_settings.
+
+    A run that takes longer than the interval is followed immediately by the next one.
+    If the scheduler is disabled in the settings file, the command runs only once.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    run_interval: timedelta = get_run_interval()
+    if run_interval is None:
+        logger.warning('Scheduler is disabled in scheduler_settings, running only once')
+        run_once(args)
+        return
+
+    next_run: datetime = datetime.now()
+    while True:
+        run_once(args)
+        next_run += run_interval
+        wait: float = (next_run - datetime.now()).total_seconds()
+        if wait < 0:
+            logger.warning(f'Run took longer than the interval {run_interval}, starting the next one now')
+            next_run = datetime.now()
+            continue
+        logger.info(f'Next scheduled run at {next_run:%Y-%m-%d %H:%M:%S}')
+        time.sleep(wait)
+
+
+def main(argv: list = None):
+    args: argparse.Namespace = build_parser().parse_args(argv)
+    if getattr(args, 'metrics_port', None):
+        from metrics import metrics
+        metrics.serve_prometheus(args.metrics_port)
+        logger.info(f'Metrics served on port {args.metrics_port} (/metrics)')
+    try:
+        if getattr(args, 'schedule', False):
+            run_scheduled(args)
+        else:
+            run_once(args)
+    except KeyboardInterrupt:
+        logger.info('Headless run interrupted')
+
+
+# Start program
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,76 @@
 import json
+import threading
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
 import os
 
 
+# Cache of the settings file and of the settings stored in the database
+_settings_lock = threading.Lock()
+_env_loaded: bool = False
+_file_cache: dict = {'path': None, 'mtime': None, 'data': None, 'settings': None}
+_db_settings_cache: dict = {'settings': None}
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    """Typed view of the settings file (SETTINGS_APK)."""
+    base_urls: dict  # Site key (aaaauto, sauto, tipcars) -> base URL
+    scraping: dict
+    user_agents: list
+    proxy: dict
+    logging: dict
+    scheduler: dict
+    work_queue: dict
+    data_storage: dict
+    matching: dict
+    enrichment: dict
+    sitemaps: dict
+    raw: dict = field(repr=False)
+
+    @classmethod
+    def from_dict(cls, config_data: dict):
+        scraping_settings: dict = config_data.get('scraping_settings', {})
+        base_urls: dict = {
+            key.removeprefix('base_url_'): value
+            for key, value in scraping_settings.items() if key.startswith('base_url_')
+        }
+        return cls(
+            base_urls=base_urls,
+            scraping=scraping_settings,
+            user_agents=scraping_settings.get('user_agents', []),
+            proxy=config_data.get('proxy_settings', {}),
+            logging=config_data.get('logging_settings', {}),
+            scheduler=config_data.get('scheduler_settings', {}),
+            work_queue=config_data.get('work_queue_settings', {}),
+            data_storage=config_data.get('data_storage', {}),
+            matching=config_data.get('matching_settings', {}),
+            enrichment=config_data.get('enrichment_settings', {}),
+            sitemaps=config_data.get('sitemap_settings', {}),
+            raw=config_data,
+        )
+
+
+@dataclass(frozen=True)
+class DbSettings:
+    """Settings stored in the database (ScrapingSettings and ProxySettings tables)."""
+    request_call_limit: int
+    request_period_seconds: int
+    requests_made: int
+    number_of_attempts: int
+    number_of_proxies: int
+
+
+def load_env():
+    """
+    Loads the environment variables from the .env file, only once per process.
+    """
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+
 # A function for loading a JSON file with application settings
 def load_settings():
     """Load settings from a JSON file.
@@ -13,6 +81,9 @@ def load_settings():
     exist, the function raises a FileNotFoundError. If the file cannot be
     decoded as a UTF-8 file, the function raises a UnicodeDecodeError.
 
+    The parsed file is cached and parsed again only when its modification
+    time changes. The returned dictionary is shared, do not modify it.
+
     Returns:
         A dictionary with the settings.
 
@@ -21,19 +92,75 @@ def load_settings():
         UnicodeDecodeError: If the settings file cannot be decoded as a UTF-8
             file.
     """
-    load_dotenv()
+    load_env()
     try:
         SETTINGS_APK = os.environ['SETTINGS_APK']
     except KeyError:
         raise FileNotFoundError('Environment variable SETTINGS_APK not set')
     try:
-        with open(SETTINGS_APK, 'r', encoding='utf-8') as file:
-            config_data = json.load(file)
+        mtime: int = os.stat(SETTINGS_APK).st_mtime_ns
     except FileNotFoundError:
         raise FileNotFoundError(f'Settings file {SETTINGS_APK} not found')
-    except UnicodeDecodeError:
-        raise UnicodeDecodeError(f'Settings file {SETTINGS_APK} is not UTF-8')
-    return config_data
+
+    with _settings_lock:
+        if _file_cache['path'] == SETTINGS_APK and _file_cache['mtime'] == mtime:
+            return _file_cache['data']
+        try:
+            with open(SETTINGS_APK, 'r', encoding='utf-8') as file:
+                config_data = json.load(file)
+        except FileNotFoundError:
+            raise FileNotFoundError(f'Settings file {SETTINGS_APK} not found')
+        except UnicodeDecodeError:
+            raise UnicodeDecodeError(f'Settings file {SETTINGS_APK} is not UTF-8')
+        _file_cache.update(path=SETTINGS_APK, mtime=mtime, data=config_data, settings=AppSettings.from_dict(config_data))
+        return config_data
+
+
+def get_settings():
+    """
+    Returns the typed settings from the settings file, cached like load_settings().
+
+    Returns:
+        AppSettings: The settings.
+    """
+    load_settings()
+    return _file_cache['settings']
 
 
+def get_db_settings():
+    """
+    Returns the settings stored in the database, read with a single query per table and cached.
+
+    Call invalidate_db_settings() after the settings in the database were changed.
 
+    Returns:
+        DbSettings: The settings.
+    """
+    with _settings_lock:
+        if _db_settings_cache['settings'] is not None:
+            return _db_settings_cache['settings']
+
+    from db import DatabaseManagerSettings, ScrapingSettings, ProxySettings
+
+    db_manager_settings = DatabaseManagerSettings()
+    scraping_settings = db_manager_settings.read_data(ScrapingSettings)
+    proxy_settings = db_manager_settings.read_data(ProxySettings)
+
+    db_settings = DbSettings(
+        request_call_limit=int(scraping_settings['request_call_limit'][0]),
+        request_period_seconds=int(scraping_settings['request_period_seconds'][0]),
+        requests_made=int(scraping_settings['requests_made'][0]),
+        number_of_attempts=int(scraping_settings['number_of_attempts'][0]),
+        number_of_proxies=int(proxy_settings['number_of_proxies'][0]),
+    )
+    with _settings_lock:
+        _db_settings_cache['settings'] = db_settings
+    return db_settings
+
+
+def invalidate_db_settings():
+    """
+    Drops the cached settings from the database, the next get_db_settings() reads them again.
+    """
+    with _settings_lock:
+        _db_settings_cache['settings'] = None
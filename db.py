@@ -1,25 +1,197 @@
-import pandas as pd
-import logging
-from dotenv import load_dotenv
 import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+from config import load_env, get_settings
 from logs import logger
-from rich import print
-from sqlalchemy import create_engine, Table, Column, Integer, String, DateTime, Date, Enum, Float, Boolean, Text
-from sqlalchemy.orm import sessionmaker, declarative_base
+from metrics import metrics
+from sqlalchemy import create_engine, event, inspect, text, Table, Column, ForeignKey, Index, Integer, BigInteger, String, DateTime, Date, Enum, Float, Boolean, Text
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-# Load environment variables
-load_dotenv()
+
+# Load environment variables (once per process)
+load_env()
 
 # Load logger settings from .env file
 LOG_DIR_DATABASE = os.getenv('LOG_DIR_DATABASE')
 
 # Create logger object
-logger = logger.get_logger(log_file=LOG_DIR_DATABASE, log_level=logging.INFO)
+logger = logger.get_logger(log_file=LOG_DIR_DATABASE, name='database')
+
+# One engine (connection pool) and one session factory per process, created on first use
+_engine_lock = threading.Lock()
+_engine = None
+_session_factory = None
+_scoped_session = None
+_ensured_tables: set = set()  # Tables checked by DatabaseManagerSettings.ensure_columns
+
+
+def get_engine():
+    """
+    Returns the process-wide engine for DATABASE_URL, created on first use.
+
+    Pool options are read from data_storage.pool in the settings file. SQLite connections
+    get the PRAGMAs from data_storage.sqlite_pragmas (WAL journal, busy timeout, ...) and may
+    be shared between threads, so several scraper workers can use the same engine.
+
+    Returns:
+        Engine: The SQLAlchemy engine.
+    """
+    global _engine, _session_factory, _scoped_session
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+
+        load_env()
+        db_url: str = os.getenv('DATABASE_URL')
+        data_storage: dict = get_settings().data_storage
+        pool_settings: dict = dict(data_storage.get('pool', {}))
+        engine_options: dict = {'pool_pre_ping': pool_settings.pop('pool_pre_ping', True)}
+
+        if db_url.startswith('sqlite'):
+            engine_options['connect_args'] = {'check_same_thread': False}
+            engine = create_engine(db_url, **engine_options)
+            sqlite_pragmas: dict = data_storage.get('sqlite_pragmas', {})
+
+            @event.listens_for(engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma, value in sqlite_pragmas.items():
+                    cursor.execute(f'PRAGMA {pragma}={value}')
+                cursor.close()
+        else:
+            engine = create_engine(db_url, **engine_options, **pool_settings)
+
+        _engine = engine
+        _session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        _scoped_session = scoped_session(_session_factory)
+        logger.info(f'Database engine created ({engine.dialect.name}, pool {engine.pool.__class__.__name__})')
+        return _engine
+
+
+def get_session_factory():
+    """
+    Returns the process-wide session factory bound to the shared engine.
+    """
+    get_engine()
+    return _session_factory
+
+
+def get_scoped_session():
+    """
+    Returns the thread-local session registry; every thread gets its own session.
+    """
+    get_engine()
+    return _scoped_session
+
+
+@contextmanager
+def session_scope():
+    """
+    Provides a new session for a unit of work: commits at the end, rolls back on error and always closes.
+
+    Example:
+        with session_scope() as session:
+            session.add(obj)
+    """
+    session = get_session_factory()()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def dispose_engine():
+    """
+    Closes all pooled connections and drops the engine, e.g. in a forked worker process.
+    """
+    global _engine, _session_factory, _scoped_session
+    with _engine_lock:
+        if _scoped_session is not None:
+            _scoped_session.remove()
+        if _engine is not None:
+            _engine.dispose()
+        _engine = _session_factory = _scoped_session = None
+        _ensured_tables.clear()
+
+
+def ensure_table_columns(connection, table: Table):
+    """
+    Creates the table or adds its missing columns and indexes on an open connection, see
+    DatabaseManagerSettings.ensure_columns (also used by the async manager through run_sync).
+
+    Parameters:
+        connection (Connection): The connection, inside a transaction.
+        table (Table): The Table object of the model (Model.__table__).
+
+    Returns:
+        list: The names of the added columns.
+    """
+    if table.name in _ensured_tables:
+        return []
+    # Tabuľky, na ktoré odkazujú cudzie kľúče, musia existovať skôr
+    for foreign_key in table.foreign_keys:
+        ensure_table_columns(connection, foreign_key.column.table)
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        # checkfirst: iné spojenie mohlo tabuľku medzitým vytvoriť
+        table.create(connection, checkfirst=True)
+        _ensured_tables.add(table.name)
+        return []
+
+    existing: set = {column['name'] for column in inspector.get_columns(table.name)}
+    added: list = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type: str = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        added.append(column.name)
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+    _ensured_tables.add(table.name)
+    if added:
+        logger.info(f'Added columns {added} to table {table.name}')
+    return added
+
 
 # Database tables definition (declarative base)
 Base = declarative_base()
 
+# Dimension tables of the repeated text columns of CarData, see dimensions.py
+class Brand(Base):
+    __tablename__ = 'car_brands'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+class CarModel(Base):
+    __tablename__ = 'car_models'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+class FuelType(Base):
+    __tablename__ = 'fuel_types'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+class Transmission(Base):
+    __tablename__ = 'transmissions'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+class Country(Base):
+    __tablename__ = 'countries'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+
 class CarData(Base):
     __tablename__ = 'car_data_from_multiple_sources'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -35,6 +207,18 @@ class CarData(Base):
     url = Column(Text)
     krajina = Column(Text)
     datum_pridania = Column(DateTime)
+    blocking_key = Column(String(160), index=True)  # znacka|model|rok, see matching.py
+    duplicate_of = Column(Integer, index=True)  # id of the same car listed on another site
+    site = Column(String(16))  # site key from the URL, see listings.py
+    listing_id = Column(BigInteger)  # id of the listing on its site, unique with site
+    # znacka, model, palivo, prevodovka and krajina of new rows are stored only as ids of the dimension tables,
+    # see dimensions.py; the text columns keep the values of older rows until dimensions.backfill_dimensions
+    znacka_id = Column(Integer, ForeignKey('car_brands.id'), index=True)
+    model_id = Column(Integer, ForeignKey('car_models.id'))
+    palivo_id = Column(Integer, ForeignKey('fuel_types.id'), index=True)
+    prevodovka_id = Column(Integer, ForeignKey('transmissions.id'))
+    krajina_id = Column(Integer, ForeignKey('countries.id'))
+    __table_args__ = (Index('ux_car_data_site_listing_id', 'site', 'listing_id', unique=True),)
 
 class ScrapingSettings(Base):
     __tablename__ = 'scraping_settings'
@@ -56,21 +240,70 @@ class LoggingSettings(Base):
     log_level = Column(String)
 
 
+class CrawlTask(Base):
+    __tablename__ = 'crawl_tasks'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    site = Column(String(16), nullable=False)
+    start_page = Column(Integer, nullable=False)
+    end_page = Column(Integer, nullable=False)
+    status = Column(String(16), nullable=False, default='pending', index=True)  # pending, leased, done, failed
+    lease_owner = Column(String(128))
+    lease_expires_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+
+class ListingUrl(Base):
+    __tablename__ = 'listing_queue'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    site = Column(String(16), nullable=False)
+    url = Column(String(512), nullable=False, unique=True)  # canonical URL (without fragment), see sitemap.py
+    lastmod = Column(String(32))
+    status = Column(String(16), nullable=False, default='pending', index=True)  # pending, done, failed
+    discovered_at = Column(DateTime)
+
+
+class PageFingerprint(Base):
+    __tablename__ = 'page_fingerprints'
+    site = Column(String(16), primary_key=True)
+    page = Column(Integer, primary_key=True)
+    fingerprint = Column(String(40), nullable=False)  # hash of the listing cards, see Scraper.listing_fingerprint
+    cars = Column(Integer)
+    updated_at = Column(DateTime)
+
+
 class DatabaseManagerSettings:
     def __init__(self):
         """
         Initializes the DatabaseManagerSettings class.
-        This method loads environment variables using the `load_dotenv` function from the `dotenv` module. 
-        It retrieves the database URL from the `DATABASE_URL` environment variable using the `os.getenv` function. 
-        It creates an engine using the `create_engine` function from the `sqlalchemy` module, passing the database URL as an argument. 
-        It creates a session using the `sessionmaker` function from the `sqlalchemy.orm` module, binding it to the engine. 
-        Finally, it creates a session using the `Session` class and assigns it to the `session` attribute of the class.
-        """
-        load_dotenv()  # Load environment variables
-        db_url = os.getenv('DATABASE_URL')  # Retrieve the database URL
-        self.engine = create_engine(db_url)  # Create an engine
-        self.Session = sessionmaker(bind=self.engine)  # Create a session
-        self.session = self.Session()  # Assign the session to the class
+        All instances share the process-wide engine from `get_engine`, which is created on first use,
+        so creating the manager neither connects to the database nor creates a new connection pool.
+        Every operation runs in its own session from `session_scope`, so one manager can be used from several threads.
+        """
+        load_env()  # Load environment variables
+
+    @property
+    def engine(self):
+        """
+        The shared engine (see `get_engine`).
+        """
+        return get_engine()
+
+    @property
+    def Session(self):
+        """
+        The shared session factory (see `get_session_factory`).
+        """
+        return get_session_factory()
+
+    @property
+    def session(self):
+        """
+        The session of the current thread (see `get_scoped_session`).
+        """
+        return get_scoped_session()()
 
     def create_table(self, table: Table):
         """
@@ -81,6 +314,22 @@ class DatabaseManagerSettings:
         """
         table.create(self.engine)
 
+    def ensure_columns(self, table: Table):
+        """
+        Creates the table if it does not exist, otherwise adds the columns and indexes missing in an older database.
+        Existing columns are not changed. Every table is checked only once per process.
+
+        Parameters:
+            table (Table): The Table object of the model (Model.__table__).
+
+        Returns:
+            list: The names of the added columns.
+        """
+        if table.name in _ensured_tables:
+            return []
+        with self.engine.begin() as connection:
+            return ensure_table_columns(connection, table)
+
 
     # def insert_data(self, obj):
     #     """Vloží objekt (riadok) do tabuľky."""
@@ -88,7 +337,7 @@ class DatabaseManagerSettings:
     #     self.session.commit()
 
     
-    def insert_data(self, df: pd.DataFrame, Model: declarative_base):
+    def insert_data(self, df: 'pd.DataFrame', Model: declarative_base):
         """
         Inserts data from a pandas DataFrame into a database table using the provided Model.
         
@@ -96,10 +345,16 @@ class DatabaseManagerSettings:
             df (pd.DataFrame): The DataFrame containing the data to be inserted.
             Model (declarative_base): The SQLAlchemy model representing the table schema.
         """
-        for _, row in df.iterrows():
-            obj = Model(**row.to_dict())
-            self.session.add(obj)
-        self.session.commit()
+        start_time: float = time.perf_counter()
+        if Model is CarData:
+            from dimensions import encode_dimensions
+            df = encode_dimensions(df)
+        with session_scope() as session:
+            for _, row in df.iterrows():
+                obj = Model(**row.to_dict())
+                session.add(obj)
+        metrics.observe('insert_seconds', time.perf_counter() - start_time, table=Model.__tablename__)
+        metrics.inc('rows_inserted_total', len(df), table=Model.__tablename__)
 
     def read_data(self, model, conditions=None):
         """
@@ -110,12 +365,22 @@ class DatabaseManagerSettings:
             conditions (Optional[BinaryExpression]): The optional conditions to filter the query results.
 
         Returns:
-            pandas.DataFrame: The queried data as a DataFrame.
+            pandas.DataFrame: The queried data as a DataFrame. For CarData, the columns stored in the dimension
+            tables are read as text again, with the pandas category dtype (see dimensions.read_cars).
         """
-        query = self.session.query(model)
-        if conditions:
-            query = query.filter(conditions)
-        data = pd.read_sql(query.statement, self.session.bind)
+        import pandas as pd
+
+        if model is CarData:
+            from dimensions import read_cars
+            return read_cars(conditions)
+
+        with session_scope() as session:
+            query = session.query(model)
+            # `if conditions:` would evaluate the SQL expression (e.g. CarData.url == url) to False and drop the filter
+            if conditions is not None:
+                query = query.filter(conditions)
+            with self.engine.connect() as connection:
+                data = pd.read_sql(query.statement, connection)
         return data
 
     def update_data(self, model, updates):
@@ -126,8 +391,8 @@ class DatabaseManagerSettings:
             model (DeclarativeMeta): The SQLAlchemy model representing the table schema.
             updates (dict): A dictionary containing the column names and their corresponding new values.
         """
-        self.session.query(model).update(updates, synchronize_session=False)
-        self.session.commit()
+        with session_scope() as session:
+            session.query(model).update(updates, synchronize_session=False)
         
     # def update_data(self, model, conditions, updates):
     #     """Aktualizuje dáta v tabuľke podľa podmienok."""
@@ -146,18 +411,18 @@ class DatabaseManagerSettings:
         Parameters:
             model: The SQLAlchemy model representing the table schema.
         """
-        self.session.query(model).delete()
-        self.session.commit()
+        with session_scope() as session:
+            session.query(model).delete()
 
     def close_connection(self):
         """
-        Closes the connection to the database.
-        This method closes the session object, which releases any resources held by the session and closes the database connection.
+        Closes the session of the current thread and returns its connection to the shared pool.
+        The operations of the class close their sessions themselves, so this is needed only after using `session` directly.
 
         Parameters:
             self (DatabaseManagerSettings): The instance of the DatabaseManagerSettings class.
         """
-        self.session.close()
+        get_scoped_session().remove()
 
 
 # Príklad použitia
@@ -0,0 +1,296 @@
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+from config import load_env, get_settings
+from logs import logger
+from metrics import metrics
+from sqlalchemy import event, select, insert, update, delete, tuple_, Table
+from sqlalchemy.engine import make_url
+from db import CarData, ensure_table_columns, _ensured_tables
+from dimensions import BATCH_SIZE, encode_dimensions, read_cars
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_DATABASE = os.getenv('LOG_DIR_DATABASE')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_DATABASE, name='database')
+
+# Async driver of every database backend (installed separately: pip install aiosqlite / asyncpg / aiomysql)
+ASYNC_DRIVERS: dict = {
+    'sqlite': 'aiosqlite',
+    'postgresql': 'asyncpg',
+    'mysql': 'aiomysql',
+}
+
+# One engine per event loop: the connections of asyncpg and aiosqlite cannot be used from another loop
+_async_engines = weakref.WeakKeyDictionary()
+# Locks of every event loop by name, an asyncio.Lock can be used only in the loop where it was first awaited
+_loop_locks = weakref.WeakKeyDictionary()
+
+
+def async_database_url(db_url: str):
+    """
+    Returns DATABASE_URL with the async driver of its backend, e.g. sqlite:///cars.db -> sqlite+aiosqlite:///cars.db,
+    postgresql+psycopg2://... -> postgresql+asyncpg://... A URL which already names an async driver is kept.
+    """
+    url = make_url(db_url)
+    backend: str = url.get_backend_name()
+    driver: str = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f'No async driver known for database {backend}')
+    if url.get_driver_name() in ASYNC_DRIVERS.values():
+        return url
+    return url.set(drivername=f'{backend}+{driver}')
+
+
+def get_async_engine():
+    """
+    Returns the engine of the running event loop for DATABASE_URL, created on first use.
+
+    Pool options and the SQLite PRAGMAs are the same as for the sync engine (data_storage.pool,
+    data_storage.sqlite_pragmas). Must be called inside a running event loop.
+
+    Returns:
+        AsyncEngine: The SQLAlchemy async engine.
+
+    Raises:
+        ImportError: If SQLAlchemy's asyncio extension or the async driver of the database is not installed.
+    """
+    loop = asyncio.get_running_loop()
+    engine = _async_engines.get(loop)
+    if engine is not None:
+        return engine
+
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+    except ImportError as e:
+        raise ImportError('SQLAlchemy asyncio extension is not available (pip install "sqlalchemy[asyncio]")') from e
+
+    load_env()
+    url = async_database_url(os.getenv('DATABASE_URL'))
+    data_storage: dict = get_settings().data_storage
+    pool_settings: dict = dict(data_storage.get('pool', {}))
+    engine_options: dict = {'pool_pre_ping': pool_settings.pop('pool_pre_ping', True)}
+    try:
+        if url.get_backend_name() == 'sqlite':
+            engine = create_async_engine(url, **engine_options)
+            sqlite_pragmas: dict = data_storage.get('sqlite_pragmas', {})
+
+            @event.listens_for(engine.sync_engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma, value in sqlite_pragmas.items():
+                    cursor.execute(f'PRAGMA {pragma}={value}')
+                cursor.close()
+        else:
+            engine = create_async_engine(url, **engine_options, **pool_settings)
+    except ImportError as e:
+        raise ImportError(f'The async driver {url.get_driver_name()} is not installed (pip install {url.get_driver_name()})') from e
+
+    _async_engines[loop] = engine
+    logger.info(f'Async database engine created ({url.get_backend_name()}+{url.get_driver_name()}, pool {engine.pool.__class__.__name__})')
+    return engine
+
+
+def loop_lock(name: str):
+    """
+    Returns the lock `name` of the running event loop, created on first use.
+    """
+    return _loop_locks.setdefault(asyncio.get_running_loop(), {}).setdefault(name, asyncio.Lock())
+
+
+async def dispose_async_engine():
+    """
+    Closes all pooled connections of the engine of the running event loop; call it before the loop ends.
+    """
+    engine = _async_engines.pop(asyncio.get_running_loop(), None)
+    if engine is not None:
+        await engine.dispose()
+
+
+@asynccontextmanager
+async def async_session_scope():
+    """
+    Provides a new async session for a unit of work: commits at the end, rolls back on error and always closes.
+
+    Example:
+        async with async_session_scope() as session:
+            await session.execute(query)
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    session = AsyncSession(get_async_engine(), expire_on_commit=False)
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+def frame_rows(df: 'pd.DataFrame'):
+    """
+    Returns the rows of a DataFrame as dicts for an executemany statement, with None for every missing value.
+    """
+    data = df.astype(object)
+    return data.where(data.notna(), None).to_dict('records')
+
+
+async def stored_listing_keys(keys: list, batch_size: int = BATCH_SIZE):
+    """
+    Returns the (site, listing_id) keys which are already stored in CarData, `batch_size` keys per query;
+    the async counterpart of listings.stored_listing_keys.
+    """
+    keys = sorted(set(keys))
+    stored: set = set()
+    async with async_session_scope() as session:
+        for index in range(0, len(keys), batch_size):
+            result = await session.execute(
+                select(CarData.site, CarData.listing_id).where(tuple_(CarData.site, CarData.listing_id).in_(keys[index:index + batch_size]))
+            )
+            stored.update(result.tuples().all())
+    return stored
+
+
+class AsyncDatabaseManagerSettings:
+    def __init__(self, batch_size: int = None):
+        """
+        Initializes the async variant of DatabaseManagerSettings for code running in an asyncio event loop.
+
+        It has the same read/insert/update/delete methods as coroutines on SQLAlchemy's asyncio extension
+        (aiosqlite for SQLite, asyncpg for PostgreSQL), so a database call awaits its I/O instead of blocking
+        the loop and the fetches running in it. Rows are inserted in batches of `batch_size` rows per statement.
+        Creating the manager does not connect to the database.
+
+        Parameters:
+            batch_size (int, optional): The number of rows written per statement (data_storage.async_batch_size).
+        """
+        load_env()  # Load environment variables
+        self.batch_size: int = batch_size or get_settings().data_storage.get('async_batch_size', 500)
+
+    @property
+    def engine(self):
+        """
+        The engine of the running event loop (see `get_async_engine`).
+        """
+        return get_async_engine()
+
+    async def create_table(self, table: Table):
+        """
+        Creates a table in the database using the provided Table object.
+
+        Parameters:
+            table (Table): The Table object representing the table to be created.
+        """
+        async with self.engine.begin() as connection:
+            await connection.run_sync(table.create)
+
+    async def ensure_columns(self, table: Table):
+        """
+        Creates the table if it does not exist, otherwise adds the columns and indexes missing in an older database,
+        see DatabaseManagerSettings.ensure_columns.
+
+        Parameters:
+            table (Table): The Table object of the model (Model.__table__).
+
+        Returns:
+            list: The names of the added columns.
+        """
+        if table.name in _ensured_tables:
+            return []
+        # Súbežné inserty na novej databáze by tabuľky vytvárali naraz
+        async with loop_lock('ensure_columns'):
+            async with self.engine.begin() as connection:
+                return await connection.run_sync(ensure_table_columns, table)
+
+    async def insert_data(self, df: 'pd.DataFrame', Model):
+        """
+        Inserts data from a pandas DataFrame into a database table, `batch_size` rows per statement.
+        The values of the dimension columns of CarData are inserted as ids (see dimensions.py).
+
+        Parameters:
+            df (pd.DataFrame): The DataFrame containing the data to be inserted.
+            Model (declarative_base): The SQLAlchemy model representing the table schema.
+        """
+        start_time: float = time.perf_counter()
+        if Model is CarData:
+            await self.ensure_columns(CarData.__table__)
+            # dimensions.DimensionCache na spojení tejto slučky; zámok drží vlákno, preto jeden lookup naraz
+            async with loop_lock('dimensions'), self.engine.connect() as connection:
+                df = await connection.run_sync(lambda sync_connection: encode_dimensions(df, sync_connection))
+        rows: list = frame_rows(df)
+        async with async_session_scope() as session:
+            for index in range(0, len(rows), self.batch_size):
+                await session.execute(insert(Model), rows[index:index + self.batch_size])
+        metrics.observe('insert_seconds', time.perf_counter() - start_time, table=Model.__tablename__)
+        metrics.inc('rows_inserted_total', len(df), table=Model.__tablename__)
+
+    async def read_data(self, model, conditions=None):
+        """
+        Reads data from the specified model in the database based on optional conditions.
+
+        Parameters:
+            model (DeclarativeMeta): The model class to query.
+            conditions (Optional[BinaryExpression]): The optional conditions to filter the query results.
+
+        Returns:
+            pandas.DataFrame: The queried data as a DataFrame, for CarData as from dimensions.read_cars.
+        """
+        import pandas as pd
+
+        if model is CarData:
+            await self.ensure_columns(CarData.__table__)
+            async with self.engine.connect() as connection:
+                return await connection.run_sync(lambda sync_connection: read_cars(conditions, sync_connection))
+
+        query = select(model)
+        # `if conditions:` would evaluate the SQL expression (e.g. CarData.url == url) to False and drop the filter
+        if conditions is not None:
+            query = query.where(conditions)
+        async with self.engine.connect() as connection:
+            return await connection.run_sync(lambda sync_connection: pd.read_sql(query, sync_connection))
+
+    async def update_data(self, model, updates):
+        """
+        Updates data in the database table based on the provided model and updates.
+
+        Parameters:
+            model (DeclarativeMeta): The SQLAlchemy model representing the table schema.
+            updates (dict): A dictionary containing the column names and their corresponding new values.
+        """
+        async with async_session_scope() as session:
+            await session.execute(update(model).values(updates))
+
+    async def update_rows(self, model, rows: list):
+        """
+        Updates rows by their primary key, `batch_size` rows per statement.
+
+        Parameters:
+            model (DeclarativeMeta): The SQLAlchemy model representing the table schema.
+            rows (list): Dictionaries with the primary key and the new values of the row, e.g. {'id': 1, 'cena': '1000'}.
+        """
+        async with async_session_scope() as session:
+            for index in range(0, len(rows), self.batch_size):
+                await session.execute(update(model), rows[index:index + self.batch_size])
+
+    async def delete_all_data(self, model):
+        """
+        Deletes all data from the specified model in the database.
+
+        Parameters:
+            model: The SQLAlchemy model representing the table schema.
+        """
+        async with async_session_scope() as session:
+            await session.execute(delete(model))
@@ -0,0 +1,261 @@
+import os
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from sqlalchemy import select, insert, update, func, or_
+from sqlalchemy.exc import IntegrityError
+from logs import logger
+from config import load_env
+from db import DatabaseManagerSettings, CarData, Brand, CarModel, FuelType, Transmission, Country, get_engine, session_scope
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_DATABASE = os.getenv('LOG_DIR_DATABASE')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_DATABASE, name='database')
+
+# Text column of CarData -> its dimension table, the id is stored in the column <name>_id
+DIMENSIONS: dict = {
+    'znacka': Brand,
+    'model': CarModel,
+    'palivo': FuelType,
+    'prevodovka': Transmission,
+    'krajina': Country,
+}
+
+NAME_LENGTH: int = 255
+BATCH_SIZE: int = 500
+
+
+def dimension_value(value):
+    """
+    Returns the value stored in a dimension table, None for a missing one (None, NaN, '' or the text 'nan').
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    value = str(value).strip()
+    return None if value in ('', 'nan') else value
+
+
+class DimensionCache:
+    def __init__(self) -> None:
+        """
+        Initializes the in-process cache of the dimension tables (value -> id), shared by all threads.
+
+        The ids never change once inserted, so the cache is only filled: an insert looks up the values it has not
+        seen yet in one query per `BATCH_SIZE` values and inserts the ones which are not stored. The cache is kept
+        per database URL, so a test or benchmark switching the database does not get ids of another one.
+        The queries run in sessions of the shared engine, or on a given connection (the async manager passes
+        the connection of its event loop through run_sync).
+        """
+        self.lock = threading.Lock()
+        self.ids: dict = {}
+
+    def lookup(self, Model, values: set, connection=None):
+        """
+        Returns the ids of the values in the dimension table of `Model`, inserting the missing values.
+
+        Args:
+            Model: The dimension model (see DIMENSIONS).
+            values (set): The values, already cleaned by dimension_value.
+            connection (Connection, optional): An open connection outside a transaction, sessions of the shared
+                engine if not given.
+
+        Returns:
+            dict: Value -> id.
+        """
+        with self.lock:
+            engine = connection.engine if connection is not None else get_engine()
+            cached: dict = self.ids.setdefault((str(engine.url), Model.__tablename__), {})
+            missing: list = sorted(value for value in values if value not in cached)
+            # Ďalší proces mohol vložiť tie isté hodnoty, po IntegrityError sa načítajú znova
+            for _ in range(3):
+                if not missing:
+                    break
+                cached.update(self.select_ids(Model, missing, connection))
+                missing = [value for value in missing if value not in cached]
+                if not missing:
+                    break
+                try:
+                    with transaction(connection) as executor:
+                        for index in range(0, len(missing), BATCH_SIZE):
+                            executor.execute(insert(Model), [{'name': value} for value in missing[index:index + BATCH_SIZE]])
+                except IntegrityError:
+                    continue
+                logger.info(f'{len(missing)} new values in {Model.__tablename__}')
+            return {value: cached[value] for value in values if value in cached}
+
+    @staticmethod
+    def select_ids(Model, values: list, connection=None):
+        """
+        Returns the stored ids of the values, `BATCH_SIZE` values per query.
+        """
+        ids: dict = {}
+        with transaction(connection) as executor:
+            for index in range(0, len(values), BATCH_SIZE):
+                ids.update(executor.execute(select(Model.name, Model.id).where(Model.name.in_(values[index:index + BATCH_SIZE]))).tuples().all())
+        return ids
+
+    def clear(self):
+        with self.lock:
+            self.ids.clear()
+
+
+@contextmanager
+def transaction(connection=None):
+    """
+    Provides a unit of work on the given connection (a transaction committed at the end), or a session
+    from session_scope if no connection is given.
+    """
+    if connection is None:
+        with session_scope() as session:
+            yield session
+    else:
+        with connection.begin():
+            yield connection
+
+
+# Create the shared cache (once per process)
+dimension_cache: DimensionCache = DimensionCache()
+
+
+def ensure_dimension_tables():
+    """
+    Creates the dimension tables and the *_id columns of CarData in an older database (once per process).
+    """
+    DatabaseManagerSettings().ensure_columns(CarData.__table__)
+
+
+def encode_values(column: str, values: list, connection=None):
+    """
+    Returns the dimension ids of the values of a CarData column and the values left in the text column
+    (None for every encoded or missing value; a value longer than the name column stays as text).
+
+    Args:
+        column (str): The column from DIMENSIONS.
+        values (list): Its values.
+        connection (Connection, optional): The connection for the lookups, see DimensionCache.lookup.
+
+    Returns:
+        tuple: (ids, texts), lists of the same length as values.
+    """
+    cleaned: list = [dimension_value(value) for value in values]
+    ids: dict = dimension_cache.lookup(
+        DIMENSIONS[column], {value for value in cleaned if value is not None and len(value) <= NAME_LENGTH}, connection
+    )
+    return [ids.get(value) for value in cleaned], [value if value not in ids else None for value in cleaned]
+
+
+def encode_dimensions(df: pd.DataFrame, connection=None):
+    """
+    Returns the cars with the values of the DIMENSIONS columns replaced by the ids of the dimension tables,
+    the form in which they are inserted into CarData (see DatabaseManagerSettings.insert_data).
+
+    Args:
+        df (pd.DataFrame): The cars with the text columns.
+        connection (Connection, optional): An open connection outside a transaction, with the tables already
+            checked (e.g. from db_async through run_sync), sessions of the shared engine if not given.
+
+    Returns:
+        pd.DataFrame: A copy with the columns <column>_id; the text columns are None where the value is encoded.
+    """
+    if connection is None:
+        ensure_dimension_tables()
+    df = df.copy()
+    for column in DIMENSIONS:
+        if column not in df.columns:
+            continue
+        ids, texts = encode_values(column, list(df[column]), connection)
+        # dtype object, inak by pandas zmenil None na NaN a ids na float
+        df[f'{column}_id'] = pd.Series(ids, index=df.index, dtype=object)
+        df[column] = pd.Series(texts, index=df.index, dtype=object)
+    return df
+
+
+def decoded_columns():
+    """
+    Returns the DIMENSIONS columns of CarData read as text (the name from the dimension table, or the text column
+    of a row not encoded yet) and the FROM clause joining the dimension tables.
+
+    Returns:
+        tuple: (dict column -> labelled expression, join of CarData with the dimension tables)
+    """
+    columns: dict = {}
+    source = CarData.__table__
+    for column, Model in DIMENSIONS.items():
+        dimension = Model.__table__.alias(f'{column}_dimension')
+        source = source.outerjoin(dimension, dimension.c.id == getattr(CarData, f'{column}_id'))
+        columns[column] = func.coalesce(dimension.c.name, getattr(CarData, column)).label(column)
+    return columns, source
+
+
+def read_cars(conditions=None, connection=None):
+    """
+    Reads the cars with their dimension values as text, in the column order of CarData without the *_id columns.
+    The DIMENSIONS columns get the pandas category dtype: a few hundred brands and models repeated in every row
+    take one integer code per row instead of one string object.
+
+    Args:
+        conditions (Optional[BinaryExpression]): The optional conditions to filter the cars.
+        connection (Connection, optional): An open connection with the tables already checked
+            (e.g. from db_async through run_sync), a connection of the shared engine if not given.
+
+    Returns:
+        pd.DataFrame: The cars.
+    """
+    decoded, source = decoded_columns()
+    id_columns: set = {f'{column}_id' for column in DIMENSIONS}
+    query = select(*(
+        decoded.get(column.name, column) for column in CarData.__table__.columns if column.name not in id_columns
+    )).select_from(source)
+    if conditions is not None:
+        query = query.where(conditions)
+    if connection is None:
+        ensure_dimension_tables()
+        with get_engine().connect() as connection:
+            data: pd.DataFrame = pd.read_sql(query.order_by(CarData.id), connection)
+    else:
+        data: pd.DataFrame = pd.read_sql(query.order_by(CarData.id), connection)
+    for column in DIMENSIONS:
+        data[column] = data[column].astype('category')
+    return data
+
+
+def backfill_dimensions(batch_size: int = BATCH_SIZE):
+    """
+    Moves the DIMENSIONS values of the stored cars inserted before the dimension tables into them: sets the ids
+    and clears the text columns. A SQLite file does not shrink by itself, run VACUUM afterwards.
+
+    Returns:
+        int: The number of updated cars.
+    """
+    ensure_dimension_tables()
+    pending = or_(*(getattr(CarData, column).is_not(None) for column in DIMENSIONS))
+    updated: int = 0
+    last_id: int = 0
+    while True:
+        with session_scope() as session:
+            rows: list = session.execute(
+                select(CarData.id, *(getattr(CarData, column) for column in DIMENSIONS), *(getattr(CarData, f'{column}_id') for column in DIMENSIONS))
+                .where(pending, CarData.id > last_id).order_by(CarData.id).limit(batch_size)
+            ).mappings().all()
+        if not rows:
+            break
+        changes: list = [{'id': row['id']} for row in rows]
+        for column in DIMENSIONS:
+            ids, texts = encode_values(column, [row[column] for row in rows])
+            for change, row, dimension_id, value in zip(changes, rows, ids, texts):
+                # Riadok môže mať id aj text (text sa nezmestil do tabuľky), id sa neprepíše
+                change[f'{column}_id'] = row[f'{column}_id'] if dimension_id is None else dimension_id
+                change[column] = value
+        with session_scope() as session:
+            session.execute(update(CarData), changes)
+        last_id = rows[-1]['id']
+        updated += len(rows)
+    if updated:
+        logger.info(f'Dimension values of {updated} stored cars moved to the dimension tables')
+    return updated
@@ -0,0 +1,355 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from bs4 import BeautifulSoup
+from sqlalchemy import select, update, and_, or_
+from logs import logger
+from metrics import metrics
+from config import load_env, get_settings
+from db import CarData, session_scope
+from dimensions import DIMENSIONS, decoded_columns, encode_values
+from matching import SITE_DOMAINS
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_SCRAPING = os.getenv('LOG_DIR_SCRAPING')
+
+# Create logger object (the same logger as in scraper.py)
+logger = logger.get_logger(log_file=LOG_DIR_SCRAPING, name='scraping')
+
+# Columns the listing cards of a site do not show -> labels of the value on its detail page
+DETAIL_FIELDS: dict = {
+    'sauto': {'vykon_motora': ('Výkon',)},
+    'tipcars': {'prevodovka': ('Převodovka',)},
+}
+
+# Labels of all columns of a car on its detail page, for the listings queued from the sitemaps (sitemap.py)
+LISTING_FIELDS: dict = {
+    'znacka': ('Značka', 'Výrobce'),
+    'model': ('Model',),
+    'rok': ('Rok výroby', 'Vyrobeno', 'První registrace', 'Rok'),
+    'km': ('Tachometr', 'Stav tachometru', 'Najeto'),
+    'palivo': ('Palivo',),
+    'prevodovka': ('Převodovka',),
+    'vykon_motora': ('Výkon',),
+    'objem_motora': ('Objem motoru', 'Zdvihový objem', 'Objem'),
+    'cena': ('Cena',),
+}
+
+# schema.org types of the JSON-LD object describing the car
+VEHICLE_TYPES: frozenset = frozenset(('Car', 'Vehicle', 'Motorcycle', 'Product'))
+
+POWER_PATTERN = re.compile(r'(\d+)\s*kW', re.IGNORECASE)
+YEAR_PATTERN = re.compile(r'(?:19|20)\d{2}')
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        """
+        Initializes a thread-safe token bucket: on average `rate` requests per second, at most `burst` at once.
+
+        Args:
+            rate (float): Tokens added per second, 0 turns the limit off.
+            burst (int): The capacity of the bucket.
+        """
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens: float = self.capacity
+        self.updated_at: float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, waiting until there is one.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now: float = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait: float = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_detail_fields(html: str, fields: dict):
+    """
+    Finds the labelled values on a detail page (a label element followed by its value, as in dt/dd, th/td or span/span).
+
+    Args:
+        html (str | BeautifulSoup): The detail page, or its parsed tree.
+        fields (dict): Column -> labels of its value, see DETAIL_FIELDS.
+
+    Returns:
+        dict: Column -> value for the columns found on the page (vykon_motora only the kW number, e.g. '110').
+    """
+    soup: BeautifulSoup = html if isinstance(html, BeautifulSoup) else BeautifulSoup(html, 'html.parser')
+    labels: dict = {label.lower(): column for column, column_labels in fields.items() for label in column_labels}
+    values: dict = {}
+    for element in soup.find_all(['dt', 'th', 'td', 'span', 'div', 'li', 'strong', 'b']):
+        # Len elementy s vlastným textom, nie celé bloky stránky
+        if element.find(True) is not None:
+            continue
+        column: str = labels.get(element.get_text(strip=True).rstrip(':').strip().lower())
+        if column is None or column in values:
+            continue
+        value_element = element.find_next_sibling()
+        value: str = value_element.get_text(' ', strip=True) if value_element is not None else ''
+        if column == 'vykon_motora':
+            power = POWER_PATTERN.search(value)
+            value = power.group(1) if power else ''
+        if value:
+            values[column] = value
+        if len(values) == len(fields):
+            break
+    return values
+
+
+def json_ld_vehicle(soup: BeautifulSoup):
+    """
+    Returns the schema.org object of the car from the JSON-LD scripts of a page (see VEHICLE_TYPES), or an empty dict.
+    """
+    for script in soup.find_all('script', type='application/ld+json'):
+        try:
+            data = json.loads(script.string or '')
+        except ValueError:
+            continue
+        items: list = data if isinstance(data, list) else data.get('@graph', [data]) if isinstance(data, dict) else []
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            types = item.get('@type')
+            if VEHICLE_TYPES.intersection(types if isinstance(types, list) else [types]):
+                return item
+    return {}
+
+
+def schema_value(value, field: str = 'name'):
+    """
+    Returns the text of a schema.org value (a text, a number, or an object with `field`, e.g. brand.name
+    or mileageFromOdometer.value), None if it is missing.
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get(field)
+    if value is None or str(value).strip() == '':
+        return None
+    return str(value).strip()
+
+
+def parse_listing_page(html: str, url: str):
+    """
+    Returns the car of a detail page in the columns of the listing parsers (records.CAR_COLUMNS without
+    datum_pridania), for the listings queued from the sitemaps. The values are read from the schema.org JSON-LD
+    of the page where it has them, the rest from the labelled values (LISTING_FIELDS). rok is the year,
+    km and cena only the digits, vykon_motora the kW number.
+
+    Args:
+        html (str): The detail page.
+        url (str): The URL of the page, stored as the url of the car.
+
+    Returns:
+        dict or None: Column -> value (None for a missing one), None if the page shows neither the brand nor the price.
+    """
+    soup: BeautifulSoup = BeautifulSoup(html, 'html.parser')
+    vehicle: dict = json_ld_vehicle(soup)
+    engine = vehicle.get('vehicleEngine') or {}
+    engine = (engine[0] if engine else {}) if isinstance(engine, list) else engine
+    offers = vehicle.get('offers') or {}
+    offers = (offers[0] if offers else {}) if isinstance(offers, list) else offers
+    power = engine.get('enginePower') if isinstance(engine, dict) else None
+    car: dict = {
+        'znacka': schema_value(vehicle.get('brand') or vehicle.get('manufacturer')),
+        'model': schema_value(vehicle.get('model')),
+        'rok': schema_value(vehicle.get('vehicleModelDate') or vehicle.get('productionDate') or vehicle.get('dateVehicleFirstRegistered')),
+        'km': schema_value(vehicle.get('mileageFromOdometer'), 'value'),
+        'palivo': schema_value(vehicle.get('fuelType') or (engine.get('fuelType') if isinstance(engine, dict) else None)),
+        'prevodovka': schema_value(vehicle.get('vehicleTransmission')),
+        # Výkon sa ukladá v kW, iné jednotky (HP) sa doplnia z textu stránky
+        'vykon_motora': schema_value(power, 'value') if not isinstance(power, dict) or power.get('unitCode', 'KWT') == 'KWT' else None,
+        'objem_motora': schema_value(engine.get('engineDisplacement') if isinstance(engine, dict) else None, 'value'),
+        'cena': schema_value(offers.get('price') if isinstance(offers, dict) else None),
+    }
+    missing: dict = {column: labels for column, labels in LISTING_FIELDS.items() if car[column] is None}
+    if missing:
+        car.update(parse_detail_fields(soup, missing))
+    if car['znacka'] is None and car['cena'] is None:
+        return None
+
+    if car['rok'] is not None:
+        year = YEAR_PATTERN.search(car['rok'])
+        car['rok'] = year.group(0) if year else None
+    if car['km'] is not None:
+        # 125 tkm = 125000 km ako v TipCarsScraper.parse_data
+        digits: str = re.sub(r'\D', '', car['km'])
+        car['km'] = (digits + '000' if 'tkm' in car['km'].lower() else digits) or None
+    if car['cena'] is not None:
+        car['cena'] = re.sub(r'\D', '', car['cena'].split(',')[0].split('.')[0]) or None
+    car['url'] = url
+    car['krajina'] = 'Czech Republic'
+    return car
+
+
+class DetailEnricher:
+    def __init__(self, workers: int = None, rate_per_second: float = None, burst: int = None, batch_size: int = None) -> None:
+        """
+        Initializes the enrichment of stored cars with the columns their listing card does not show
+        (DETAIL_FIELDS: engine power on sauto.cz, transmission on tipcars.com).
+
+        The detail pages are fetched by a bounded pool of `workers` threads with its own rate budget (a token bucket
+        of `rate_per_second` requests), separate from the listing crawl. The found values are written to CarData
+        in batches of `batch_size` rows. The defaults are taken from enrichment_settings in the settings file.
+
+        Args:
+            workers (int, optional): The number of detail pages fetched at the same time.
+            rate_per_second (float, optional): The average number of detail pages fetched per second.
+            burst (int, optional): The number of detail pages which may be fetched at once after a pause.
+            batch_size (int, optional): The number of rows updated in one statement.
+        """
+        enrichment_settings: dict = get_settings().enrichment
+        self.workers: int = workers or enrichment_settings.get('workers', 4)
+        self.batch_size: int = batch_size or enrichment_settings.get('batch_size', 100)
+        self.rate_limiter = TokenBucket(
+            rate_per_second if rate_per_second is not None else enrichment_settings.get('rate_per_second', 2),
+            burst or enrichment_settings.get('burst', self.workers),
+        )
+
+    def find_incomplete(self, site: str, urls: list = None, limit: int = None):
+        """
+        Returns the stored cars of the site with a missing column from DETAIL_FIELDS.
+
+        Args:
+            site (str): The site key from pipeline.SITES.
+            urls (list, optional): Only these cars (e.g. the cars inserted by the last run).
+            limit (int, optional): The maximum number of cars.
+
+        Returns:
+            list: Dictionaries with the id, url and the missing columns (None) of the cars.
+        """
+        columns: list = list(DETAIL_FIELDS.get(site, {}))
+        if not columns:
+            return []
+        domain: str = next(domain for domain, domain_site in SITE_DOMAINS.items() if domain_site == site)
+        decoded, source = decoded_columns()
+        conditions: list = []
+        for column in columns:
+            condition = or_(getattr(CarData, column).is_(None), getattr(CarData, column) == 'nan')
+            # Stĺpec z dimenzií (prevodovka) chýba, ak nemá ani id, ani text
+            if column in DIMENSIONS:
+                condition = and_(condition, getattr(CarData, f'{column}_id').is_(None))
+            conditions.append(condition)
+        missing = or_(*conditions)
+        query = select(CarData.id, CarData.url, *(decoded.get(column, getattr(CarData, column)) for column in columns)).select_from(source).where(
+            CarData.url.contains(domain), missing
+        ).order_by(CarData.id)
+
+        cars: list = []
+        with session_scope() as session:
+            if urls is None:
+                cars = [dict(row) for row in session.execute(query.limit(limit)).mappings()]
+            else:
+                urls = [url for url in urls if isinstance(url, str)]
+                for index in range(0, len(urls), self.batch_size):
+                    chunk_query = query.where(CarData.url.in_(urls[index:index + self.batch_size]))
+                    cars.extend(dict(row) for row in session.execute(chunk_query).mappings())
+        for car in cars:
+            for column in columns:
+                if car[column] == 'nan':
+                    car[column] = None
+        return cars[:limit] if limit else cars
+
+    def fetch_details(self, site: str, scraper, car: dict, proxy: str, headers: dict):
+        """
+        Fetches the detail page of a car and returns the update of its missing columns, or None.
+        """
+        self.rate_limiter.acquire()
+        try:
+            # fetch_page skladá URL ako base_url + page_url
+            html: str = scraper.fetch_page(car['url'], '', proxy, headers)
+        except Exception as e:
+            logger.error(f'Failed to fetch detail page {car["url"]}: {e}')
+            return None
+        if html is None:
+            return None
+        missing: dict = {column: labels for column, labels in DETAIL_FIELDS[site].items() if car.get(column) is None}
+        values: dict = parse_detail_fields(html, missing)
+        if not values:
+            logger.info(f'No details found on {car["url"]}')
+            return None
+        return {'id': car['id'], **values}
+
+    def enrich(self, site: str, scraper, proxy_pool: Iterator, headers_pool: Iterator, urls: list = None, limit: int = None):
+        """
+        Fills the missing columns of the stored cars of a site from their detail pages.
+
+        Args:
+            site (str): The site key from pipeline.SITES.
+            scraper (Scraper): The scraper of the site used for fetching (its own instance, not the one of the crawl).
+            proxy_pool (Iterator): The pool of proxies to use.
+            headers_pool (Iterator): The pool of headers to use.
+            urls (list, optional): Only these cars, all incomplete cars of the site if not given.
+            limit (int, optional): The maximum number of detail pages to fetch.
+
+        Returns:
+            int: The number of updated cars.
+        """
+        cars: list = self.find_incomplete(site, urls, limit)
+        if not cars:
+            return 0
+        logger.info(f'Fetching {len(cars)} detail pages of {site} ({self.workers} workers)')
+        start_time: float = time.perf_counter()
+        updated: int = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index in range(0, len(cars), self.batch_size):
+                batch: list = cars[index:index + self.batch_size]
+                # Proxy a hlavičky sa berú tu, pooly nie sú thread-safe
+                try:
+                    jobs: list = [(car, next(proxy_pool), next(headers_pool)) for car in batch]
+                except StopIteration:
+                    logger.error('Proxy pool empty')
+                    break
+                updates: list = [
+                    values for values in executor.map(lambda job: self.fetch_details(site, scraper, *job), jobs)
+                    if values is not None
+                ]
+                updated += self.update_cars(updates)
+        metrics.observe('enrich_seconds', time.perf_counter() - start_time, site=site)
+        metrics.inc('cars_enriched_total', updated, site=site)
+        logger.info(f'Enriched {updated} of {len(cars)} cars of {site} from their detail pages')
+        return updated
+
+    def update_cars(self, updates: list):
+        """
+        Writes the found values to CarData, one statement per column set. The values of the DIMENSIONS columns
+        are written as ids of the dimension tables.
+
+        Returns:
+            int: The number of updated rows.
+        """
+        for column in DIMENSIONS:
+            rows: list = [values for values in updates if column in values]
+            if not rows:
+                continue
+            ids, texts = encode_values(column, [values[column] for values in rows])
+            for values, dimension_id, value in zip(rows, ids, texts):
+                values[f'{column}_id'] = dimension_id
+                values[column] = value
+        groups: dict = {}
+        for values in updates:
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+        with session_scope() as session:
+            for rows in groups.values():
+                session.execute(update(CarData), rows)
+        return len(updates)
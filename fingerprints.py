@@ -0,0 +1,90 @@
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import select, delete, insert
+from logs import logger
+from config import load_env
+from db import DatabaseManagerSettings, PageFingerprint, session_scope
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_DATABASE = os.getenv('LOG_DIR_DATABASE')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_DATABASE, name='database')
+
+
+class PageFingerprintStore:
+    def __init__(self, site: str) -> None:
+        """
+        Initializes the fingerprints of the listing pages of a site (Scraper.listing_fingerprint) from the last runs.
+
+        A page whose fingerprint did not change since its cars were stored has no new cars, so an incremental
+        scrape skips its parsing and its comparison with the database. New fingerprints are only collected here;
+        they are written by `save_page_fingerprints` after the cars of the run were inserted, so a failed insert
+        never hides a page from the next run.
+
+        Args:
+            site (str): The site key from pipeline.SITES.
+        """
+        self.site = site
+        self.lock = threading.Lock()  # Pages are parsed from several threads (pipeline.scrape_pages)
+        self.pending: dict = {}
+        DatabaseManagerSettings().ensure_columns(PageFingerprint.__table__)
+        with session_scope() as session:
+            rows = session.execute(select(PageFingerprint.page, PageFingerprint.fingerprint).where(PageFingerprint.site == site))
+            self.known: dict = {page: fingerprint for page, fingerprint in rows}
+
+    def unchanged(self, page: int, fingerprint: str):
+        """
+        Returns True if the page has the same fingerprint as when its cars were stored.
+        """
+        return fingerprint is not None and self.known.get(page) == fingerprint
+
+    def update(self, page: int, fingerprint: str, cars: int):
+        """
+        Remembers the fingerprint of a parsed page, to be saved after its cars are stored.
+        """
+        if fingerprint is None or self.known.get(page) == fingerprint:
+            return
+        with self.lock:
+            self.pending[page] = (fingerprint, cars)
+
+    def to_dict(self):
+        """
+        Returns the fingerprints collected in this run, see save_page_fingerprints.
+        """
+        with self.lock:
+            return {'site': self.site, 'pages': dict(self.pending)}
+
+
+def save_page_fingerprints(fingerprints: dict):
+    """
+    Writes the fingerprints collected by a PageFingerprintStore, replacing the stored ones of the same pages.
+
+    Parameters:
+        fingerprints (dict): {'site': site, 'pages': {page: (fingerprint, cars)}} from PageFingerprintStore.to_dict.
+
+    Returns:
+        int: The number of written pages.
+    """
+    site: str = fingerprints['site']
+    pages: dict = fingerprints['pages']
+    if not pages:
+        return 0
+    DatabaseManagerSettings().ensure_columns(PageFingerprint.__table__)
+    now: datetime = datetime.now()
+    numbers: list = sorted(pages)
+    with session_scope() as session:
+        for index in range(0, len(numbers), 500):
+            batch: list = numbers[index:index + 500]
+            session.execute(delete(PageFingerprint).where(PageFingerprint.site == site, PageFingerprint.page.in_(batch)))
+            session.execute(insert(PageFingerprint), [
+                {'site': site, 'page': page, 'fingerprint': pages[page][0], 'cars': pages[page][1], 'updated_at': now}
+                for page in batch
+            ])
+    logger.info(f'Fingerprints of {len(pages)} pages of {site} saved')
+    return len(pages)
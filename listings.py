@@ -0,0 +1,170 @@
+import os
+import re
+import threading
+import pandas as pd
+from sqlalchemy import select, update, tuple_
+from logs import logger
+from config import load_env
+from db import CarData, get_engine, session_scope
+from matching import site_of_url
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_DATABASE = os.getenv('LOG_DIR_DATABASE')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_DATABASE, name='database')
+
+# Listing id in the URL of every site, the rest of the URL (slug, tracking parameters, fragment) may change
+LISTING_ID_PATTERNS: dict = {
+    'aaaauto': re.compile(r'[?&]id=(\d+)'),
+    'sauto': re.compile(r'/detail/[^/?#]+/[^/?#]+/(\d+)'),
+    'tipcars': re.compile(r'-(\d+)\.html(?:$|[?#])'),
+}
+
+BATCH_SIZE: int = 500
+
+# Databases (URLs) whose stored cars got their listing ids in this process, see ensure_listing_ids
+_backfilled_databases: set = set()
+_backfill_lock = threading.Lock()
+
+
+def listing_key(url):
+    """
+    Returns the site and the listing id of a listing URL, e.g.
+    https://www.aaaauto.cz/cz/skoda-octavia/car.html?id=123#promo=listing -> ('aaaauto', 123).
+
+    Args:
+        url: The URL of the car.
+
+    Returns:
+        tuple: (site, listing_id); site is '' for an unknown domain, listing_id None if the URL has no id.
+    """
+    if not isinstance(url, str):
+        return '', None
+    site: str = site_of_url(url) or ''
+    pattern = LISTING_ID_PATTERNS.get(site)
+    match = pattern.search(url) if pattern is not None else None
+    return site, int(match.group(1)) if match else None
+
+
+def add_listing_keys(df: pd.DataFrame):
+    """
+    Returns the cars with the columns site and listing_id computed from their URLs.
+    """
+    df = df.copy()
+    keys: list = [listing_key(url) for url in df['url']] if 'url' in df.columns else []
+    df['site'] = [site for site, _ in keys]
+    df['listing_id'] = pd.Series([listing_id for _, listing_id in keys], index=df.index, dtype=object)
+    return df
+
+
+def stored_listing_keys(keys: list, batch_size: int = BATCH_SIZE):
+    """
+    Returns the (site, listing_id) keys which are already stored in CarData, `batch_size` keys per query.
+    """
+    keys = sorted(set(keys))
+    stored: set = set()
+    with session_scope() as session:
+        for index in range(0, len(keys), batch_size):
+            batch: list = keys[index:index + batch_size]
+            stored.update(session.execute(
+                select(CarData.site, CarData.listing_id).where(tuple_(CarData.site, CarData.listing_id).in_(batch))
+            ).tuples())
+    return stored
+
+
+def stored_urls(urls: list, batch_size: int = BATCH_SIZE):
+    """
+    Returns the URLs which are already stored in CarData, `batch_size` URLs per query
+    (for URLs without a listing id).
+    """
+    urls = sorted(set(urls))
+    stored: set = set()
+    with session_scope() as session:
+        for index in range(0, len(urls), batch_size):
+            stored.update(session.scalars(select(CarData.url).where(CarData.url.in_(urls[index:index + batch_size]))))
+    return stored
+
+
+def new_listing_mask(df: pd.DataFrame):
+    """
+    Marks the cars which are neither stored in CarData nor repeated earlier in the frame (a car moving between
+    pages during the crawl), by their listing key or, without a listing id, by their URL.
+
+    Args:
+        df (pd.DataFrame): The cars with the columns url, site and listing_id (see add_listing_keys).
+
+    Returns:
+        pd.Series: True for the new cars.
+    """
+    has_id: pd.Series = df['listing_id'].notna()
+    stored_keys: set = stored_listing_keys(list(zip(df.loc[has_id, 'site'], df.loc[has_id, 'listing_id'].astype(int))))
+    stored_url_set: set = stored_urls([url for url in df.loc[~has_id, 'url'] if isinstance(url, str)])
+    seen: set = set()
+    new: list = []
+    for url, site, listing_id in zip(df['url'], df['site'], df['listing_id']):
+        key: tuple = (site, int(listing_id)) if listing_id is not None and not pd.isna(listing_id) else ('url', url)
+        is_new: bool = key not in seen and key not in stored_keys and (key[0] != 'url' or url not in stored_url_set)
+        seen.add(key)
+        new.append(is_new)
+    return pd.Series(new, index=df.index, dtype=bool)
+
+
+def backfill_listing_ids(batch_size: int = BATCH_SIZE):
+    """
+    Computes site and listing_id of the stored cars which do not have them yet (inserted before the listing ids
+    existed). Every checked car gets its site, so it is not checked again. Of several stored cars with the same
+    listing (URL variants of one car), only the oldest one gets the listing id, the unique index allows one.
+
+    Returns:
+        dict: {'updated': checked cars, 'without_id': cars whose URL has no listing id, 'repeated': later copies of a listing}.
+    """
+    result: dict = {'updated': 0, 'without_id': 0, 'repeated': 0}
+    last_id: int = 0
+    while True:
+        with session_scope() as session:
+            rows: list = session.execute(
+                select(CarData.id, CarData.url).where(CarData.site.is_(None), CarData.id > last_id)
+                .order_by(CarData.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            keys: dict = {row.id: listing_key(row.url) for row in rows}
+            stored: set = set(session.execute(
+                select(CarData.site, CarData.listing_id).where(tuple_(CarData.site, CarData.listing_id).in_(
+                    sorted({key for key in keys.values() if key[1] is not None})
+                ))
+            ).tuples())
+            changes: list = []
+            for car_id, (site, listing_id) in keys.items():
+                if listing_id is None:
+                    result['without_id'] += 1
+                elif (site, listing_id) in stored:
+                    result['repeated'] += 1
+                    listing_id = None
+                else:
+                    stored.add((site, listing_id))
+                changes.append({'id': car_id, 'site': site, 'listing_id': listing_id})
+            session.execute(update(CarData), changes)
+        last_id = rows[-1].id
+        result['updated'] += len(rows)
+    if result['updated']:
+        logger.info(f'Listing ids computed for {result["updated"]} stored cars ({result["without_id"]} without id, {result["repeated"]} repeated listings)')
+    return result
+
+
+def ensure_listing_ids():
+    """
+    Runs backfill_listing_ids once per process and database. It is a one-time migration of the cars stored before
+    the listing ids, later runs would only scan the table again; the listing-ids command runs it on demand.
+    """
+    url: str = str(get_engine().url)
+    with _backfill_lock:
+        if url in _backfilled_databases:
+            return
+        backfill_listing_ids()
+        _backfilled_databases.add(url)
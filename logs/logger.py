@@ -1,23 +1,119 @@
+import atexit
 import logging
-from rich import print
+import logging.handlers
+import queue
+import threading
 
 
-def get_logger(log_file, log_level):
+# Formát logovania, ak nie je nastavený v logging_settings.log_format
+LOG_FORMAT: str = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Predvolená rotácia súborov, ak nie je nastavená v logging_settings
+DEFAULT_MAX_BYTES: int = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT: int = 5
+
+# Spustené QueueListener-y (jeden na logger), zastavia sa pri ukončení programu
+_listeners: dict = {}
+_listeners_lock = threading.Lock()
+
+
+def get_logging_settings():
+    """
+    Returns logging_settings from the settings file, or an empty dict if the file is not available.
+    """
+    try:
+        from config import load_settings
+        return load_settings().get('logging_settings', {})
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def resolve_log_level(name: str, log_level, logging_settings: dict):
+    """
+    Returns the level of the logger: the explicit log_level, else logging_settings.log_levels[name],
+    else logging_settings.log_level, else INFO.
+    """
+    if log_level is None:
+        log_level = logging_settings.get('log_levels', {}).get(name) or logging_settings.get('log_level', 'INFO')
+    if isinstance(log_level, str):
+        log_level = logging.getLevelName(log_level.upper())
+    return log_level if isinstance(log_level, int) else logging.INFO
+
+
+def get_logger(log_file, log_level=None, name: str = None):
+    """
+    Returns the logger for the log file, configured on the first call only.
+
+    The logger gets a single QueueHandler, so logging from the scraper only puts the record into a queue.
+    A QueueListener thread writes the records to the rotating log file and to the console.
+    Calling the function again for the same log file returns the same logger without adding handlers.
+    The records are formatted with logging_settings.log_format, LOG_FORMAT if it is not set.
+
+    Args:
+        log_file (str): The path of the log file (also the name of the logger). If None, logs go only to the console.
+        log_level (int or str, optional): The level of the logger. If not given, it is taken from logging_settings
+            (log_levels[name] or log_level) in the settings file.
+        name (str, optional): The key of the logger in logging_settings.log_levels (main, scraping, proxies, database).
+
+    Returns:
+        logging.Logger: The logger.
+    """
     # Vytvorenie loggera
     logger = logging.getLogger(log_file)
-    logger.setLevel(log_level)
-
-    # Nastavenie formátu logovania
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-    # Nastavenie logovania do súboru
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-
-    # Nastavenie logovania na konzolu
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
-    
-    return logger
\ No newline at end of file
+
+    with _listeners_lock:
+        if log_file in _listeners:
+            if log_level is not None:
+                logger.setLevel(resolve_log_level(name, log_level, {}))
+            return logger
+
+        logging_settings: dict = get_logging_settings()
+        logger.setLevel(resolve_log_level(name, log_level, logging_settings))
+
+        # Nastavenie formátu logovania
+        formatter = logging.Formatter(logging_settings.get('log_format') or LOG_FORMAT)
+        handlers: list = []
+
+        # Nastavenie logovania do súboru (s rotáciou)
+        if log_file and logging_settings.get('log_to_file', True):
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=logging_settings.get('max_bytes', DEFAULT_MAX_BYTES),
+                backupCount=logging_settings.get('backup_count', DEFAULT_BACKUP_COUNT),
+                encoding='utf-8',
+            )
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+        # Nastavenie logovania na konzolu
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        handlers.append(stream_handler)
+
+        # Zápis do súboru a na konzolu vo vlákne QueueListener-a
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        logger.propagate = False
+
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[log_file] = listener
+
+    return logger
+
+
+def shutdown():
+    """
+    Stops all QueueListener threads after they wrote the queued records.
+    """
+    with _listeners_lock:
+        for listener in _listeners.values():
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+        _listeners.clear()
+
+
+atexit.register(shutdown)
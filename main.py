@@ -1,361 +1,108 @@
-from itertools import cycle
-from typing import Iterator
-import pandas as pd
-from scraper import CheckNewItems, AaaAutoScraper, SautoScraper, TipCarsScraper
-from db import DatabaseManagerSettings, CarData
+from typing import TYPE_CHECKING
 from menu import MainMenu, CarsMenu
-import logging
-from datetime import datetime
 from logs import logger
-from dotenv import load_dotenv
 import os
 from rich import print
-from db import ScrapingSettings, ProxySettings
-from config import load_settings
-from proxy import ProxyScraper
-import requests
+from config import load_env, get_db_settings, invalidate_db_settings
+
+# pandas, bs4 and SQLAlchemy are imported on first use (pipeline, db), so the menu appears without waiting for them
+if TYPE_CHECKING:
+    import pandas as pd
+    from db import DatabaseManagerSettings
+
+# Menu number of the site -> site key from pipeline.SITES
+SITE_IDS: dict = {'1': 'aaaauto', '2': 'sauto', '3': 'tipcars'}
+
+
+def site_menu(site: str, scraper, cars_menu: CarsMenu, db_manager_settings: 'DatabaseManagerSettings'):
+    """
+    Runs the menu of one site: scraping pages, displaying and deleting data from DB.
+
+    Args:
+        site (str): The site key from pipeline.SITES.
+        scraper (Scraper): The scraper instance for the site.
+        cars_menu (CarsMenu): The menu to display.
+        db_manager_settings (DatabaseManagerSettings): The database manager.
+    """
+    from db import CarData
+    from pipeline import SITES, close_proxy_pool, export_data, get_proxy_pool, scrape_site, wait_for_enrichment
+
+    proxy_pool = None
+    try:
+        while True:
+            print(f'\n\t *** {SITES[site]["label"]} Menu ***')
+            choice: str = cars_menu.menu_cars()
+            # Scrape Pages
+            if choice == '1':
+                print('\n\t *** Enter start and end pages to check ***')
+                start_page: int = int(input('Enter start page: '))
+                end_page: int = int(input('Enter end page: '))
+
+                # The proxies are checked at the first scrape and kept for the next ones and the enrichment
+                if proxy_pool is None:
+                    proxy_pool = get_proxy_pool()
+                df_to_insert: pd.DataFrame = scrape_site(site, start_page, end_page, scraper=scraper, proxy_pool=proxy_pool)
+
+                while True:
+                    choice: str = cars_menu.sub_menu_cars()
+                    # Show as DataFrame
+                    if choice == '1':
+                        print(df_to_insert)
+                    # Add to DB
+                    elif choice == '2':
+                        export_data(df_to_insert, site, 'db', proxy_pool=proxy_pool)
+                    # Export to csv
+                    elif choice == '3':
+                        export_data(df_to_insert, site, 'csv')
+                    # Export to xlsx
+                    elif choice == '4':
+                        export_data(df_to_insert, site, 'xlsx')
+                    # Back
+                    elif choice == '5':
+                        break
+
+            # Display all data from DB
+            elif choice == '2':
+                car_data: pd.DataFrame = db_manager_settings.read_data(CarData)
+                print(car_data)
+            # Delete all data from DB
+            elif choice == '3':
+                db_manager_settings.delete_all_data(model=CarData)
+                logger.info('All data was successfully deleted from DB')
+            # Back to Main Menu
+            elif choice == '4':
+                break
+    finally:
+        wait_for_enrichment()
+        close_proxy_pool(proxy_pool)
 
 
 def main():
     main_menu: MainMenu = MainMenu()
-    db_manager_settings: DatabaseManagerSettings = DatabaseManagerSettings()
-    check_new_items: CheckNewItems = CheckNewItems()
-    
-    scraping_settings: pd.DataFrame = db_manager_settings.read_data(ScrapingSettings)
-    request_call_limit: int = scraping_settings['request_call_limit'][0]
-    request_period_seconds: int = scraping_settings['request_period_seconds'][0]
-    requests_made: int = scraping_settings['requests_made'][0]
-    number_of_attempts = scraping_settings['number_of_attempts'][0]
-    db_manager_settings.close_connection()
-    
-    # Get base_url from settings file (ScrapingSettings)
-    base_url_aaaauto: str = load_settings()['scraping_settings']['base_url_aaaauto']
-    
-    # Get base_url from settings file (ScrapingSettings)
-    base_url_sauto: str = load_settings()['scraping_settings']['base_url_sauto']
 
-    # Get base_url from settings file (ScrapingSettings)
-    base_url_tipcars: str = load_settings()['scraping_settings']['base_url_tipcars']
-
-    # Get list user_agents of headers for scraping from settings file (ScrapingSettings)
-    headers_list: list = load_settings()['scraping_settings']['user_agents']
-    headers_pool: Iterator = cycle(headers_list)
-                    
     running_program: bool = True
     while running_program:
         site_id = main_menu.start_page_menu()
-        # AaaAuto.cz
-        if site_id == '1':
-            aaaauto_scraper: AaaAutoScraper = AaaAutoScraper(request_call_limit, request_period_seconds, requests_made, number_of_attempts)
-            cars_menu: CarsMenu = CarsMenu()
-            
-            while True:
-                print('\n\t *** AaaAuto Menu ***')
-                choice: str = cars_menu.menu_cars()
-                # Scrape Pages
-                if choice == '1':
-                    print('\n\t *** Enter start and end pages to check ***')
-                    start_page: int = int(input('Enter start page: '))
-                    end_page: int = int(input('Enter end page: '))
-                    
-                    # Get list of proxies for scraping
-                    try:
-                        proxy_list: list = ProxyScraper().get_proxy_list()
-                    except Exception as e:
-                        logger.error(f'Failed to get proxy list: {e}')
-                    try:
-                        available_proxies: list = ProxyScraper().check_proxies(proxies = proxy_list)
-                    except Exception as e:
-                        logger.error(f'Failed to check proxies: {e}')
-                    proxy_pool: Iterator = cycle(available_proxies)
-                    
-                    list_cars: list = []
-                    list_all_cars_details: list = []
-                    start_time: datetime = datetime.now()
-                    print('\t*** Start scraping all pages with proxies... ***')
-                    for page in range(start_page, end_page + 1):
-                        # Get proxy from pool
-                        try:
-                            proxy: str = next(proxy_pool)
-                        except StopIteration:
-                            logger.error('Proxy pool empty')
-                            break
-                        # Get headers from pool
-                        headers: dict = next(headers_pool)
-                        
-                        try:
-                            response: requests.models.Response = aaaauto_scraper.fetch_page(base_url_aaaauto, page, proxy, headers)
-                        except Exception as e:
-                            logger.error(f'Failed to fetch page: {e}')
-                            break
-                        if response is None:
-                            logger.info(f'Page {page} not found. Skipping...\n')
-                            break
-                        try:
-                            cars_details: dict = aaaauto_scraper.parse_page(response, page)
-                        except Exception as e:
-                            logger.error(f'Failed to parse page: {e}')
-                            break
-                        if cars_details is None:
-                            logger.info(f'Page parse {page} not found. Skipping...\n')
-                            break
-                        list_cars.append(cars_details)
-                    list_cars_details = aaaauto_scraper.edit_list_cars_details(list_cars)
-                    end_time = datetime.now()
-                    logger.info(f'Elapsed time for scraping: {end_time - start_time}')
-                    logger.info(f'Total number of cars found: {len(list_cars_details)}\n')
-                    
-                    list_all_cars_details.extend(list_cars_details)
-                    df_to_insert: pd.DataFrame = check_new_items.compare_details_with_db(list_all_cars_details)
-                    logger.info('Process scraping was successfully completed')
-                    logger.info('Total number of records to insert: %s', len(df_to_insert))
+        # AaaAuto.cz, SAuto.cz, TipCars.com
+        if site_id in SITE_IDS:
+            from db import DatabaseManagerSettings
+            from pipeline import SITES
 
-                    while True:
-                        choice: str = cars_menu.sub_menu_cars()
-                        # Show as DataFrame
-                        if choice == '1':
-                            print(df_to_insert)
-                        # Add to DB
-                        elif choice == '2':
-                            db_manager_settings.insert_data(df=df_to_insert, Model=CarData)
-                            db_manager_settings.close_connection()
-                            logger.info(f"Data was successfully inserted. {df_to_insert.shape[0]} rows inserted.")
-                        # Export to csv
-                        elif choice == '3':
-                            unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            df_to_insert.to_csv(f'multi-cars-scraping/aaaauto_data_{unique_suffix}.csv', index=False, encoding='utf-8-sig')
-                            logger.info('Data was successfully exported to csv')
-                        # Export to xlsx
-                        elif choice == '4':
-                            unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            df_to_insert.to_excel(f'multi-cars-scraping/aaaauto_data_{unique_suffix}.xlsx')
-                            logger.info('Data was successfully exported to xlsx')
-                        # Back
-                        elif choice == '5':
-                            break
-                        
-                # Display all data from DB
-                elif choice == '2':
-                    car_data: pd.DataFrame = db_manager_settings.read_data(CarData)
-                    db_manager_settings.close_connection()
-                    print(car_data)
-                # Delete all data from DB
-                elif choice == '3': 
-                    db_manager_settings.delete_all_data(model=CarData)
-                    db_manager_settings.close_connection()
-                    logger.info('All data was successfully deleted from DB')
-                # Back to Main Menu
-                elif choice == '4':
-                    break
-        
-        # SAuto.cz
-        elif site_id == '2':
-            sauto_scraper: SautoScraper = SautoScraper(request_call_limit, request_period_seconds, requests_made, number_of_attempts)
-            cars_menu: CarsMenu = CarsMenu()
-            
-            while True:
-                print('\n\t *** SAuto Menu ***')
-                choice: str = cars_menu.menu_cars()
-                # Scrape Pages
-                if choice == '1':
-                    print('\n\t *** Enter start and end pages to check ***')
-                    start_page: int = int(input('Enter start page: '))
-                    end_page: int = int(input('Enter end page: '))
-                    
-                    # Get list of proxies for scraping
-                    try:
-                        proxy_list: list = ProxyScraper().get_proxy_list()
-                    except Exception as e:
-                        logger.error(f'Failed to get proxy list: {e}')
-                    try:
-                        available_proxies: list = ProxyScraper().check_proxies(proxies = proxy_list)
-                    except Exception as e:
-                        logger.error(f'Failed to check proxies: {e}')
-                    proxy_pool: Iterator = cycle(available_proxies)
-                    
-                    list_cars: list = []
-                    list_all_cars_details: list = []
-                    start_time: datetime = datetime.now()
-                    print('\t*** Start scraping all pages with proxies... ***')
-                    for page in range(start_page, end_page + 1):
-                        # Get proxy from pool
-                        try:
-                            proxy: str = next(proxy_pool)
-                        except StopIteration:
-                            logger.error('Proxy pool empty')
-                            break
-                        # Get headers from pool
-                        headers: dict = next(headers_pool)
-                        try:
-                            response: requests.models.Response = sauto_scraper.fetch_page(base_url_sauto, page, proxy, headers)
-                        except Exception as e:
-                            logger.error(f'Failed to fetch page: {e}')
-                            break
-                        if response is None:
-                            logger.info(f'Page {page} not found. Skipping...\n')
-                            break
-                        try:
-                            cars_details: dict = sauto_scraper.get_parsed_data(response, page)
-                        except Exception as e:
-                            logger.error(f'Failed to parse page: {e}')
-                            break
-                        if cars_details is None:
-                            logger.info(f'Page parse {page} not found. Skipping...\n')
-                            break
-                        list_cars.append(cars_details)
-                    list_cars_details = sauto_scraper.edit_list_cars_details(list_cars)
-                    end_time = datetime.now()
-                    logger.info(f'Elapsed time for scraping: {end_time - start_time}')
-                    logger.info(f'Total number of cars found: {len(list_cars_details)}\n')
-                    
-                    list_all_cars_details.extend(list_cars_details)
-                    df_to_insert: pd.DataFrame = check_new_items.compare_details_with_db(list_all_cars_details)
-                    logger.info('Process scraping was successfully completed')
-                    logger.info('Total number of records to insert: %s', len(df_to_insert))
+            db_settings = get_db_settings()
+            request_call_limit: int = db_settings.request_call_limit
+            request_period_seconds: int = db_settings.request_period_seconds
+            requests_made: int = db_settings.requests_made
+            number_of_attempts: int = db_settings.number_of_attempts
 
-                    while True:
-                        choice: str = cars_menu.sub_menu_cars()
-                        # Show as DataFrame
-                        if choice == '1':
-                            print(df_to_insert)
-                        # Add to DB
-                        elif choice == '2':
-                            db_manager_settings.insert_data(df=df_to_insert, Model=CarData)
-                            db_manager_settings.close_connection()
-                            logger.info(f"Data was successfully inserted. {df_to_insert.shape[0]} rows inserted.")
-                        # Export to csv
-                        elif choice == '3':
-                            unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            df_to_insert.to_csv(f'multi-cars-scraping/sauto_data_{unique_suffix}.csv', index=False, encoding='utf-8-sig')
-                            logger.info('Data was successfully exported to csv')
-                        # Export to xlsx
-                        elif choice == '4':
-                            unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            df_to_insert.to_excel(f'multi-cars-scraping/sauto_data_{unique_suffix}.xlsx')
-                            logger.info('Data was successfully exported to xlsx')
-                        # Back
-                        elif choice == '5':
-                            break
-                        
-                # Display all data from DB
-                elif choice == '2':        
-                    car_data: pd.DataFrame = db_manager_settings.read_data(CarData)
-                    db_manager_settings.close_connection()
-                    print(car_data)
-                # Delete all data from DB
-                elif choice == '3': 
-                    db_manager_settings.delete_all_data(model=CarData)
-                    db_manager_settings.close_connection()
-                    logger.info('All data was successfully deleted from DB')
-                # Back to Main Menu
-                elif choice == '4':
-                    break
-                
-        # TipCars.com
-        elif site_id == '3':
-            tipcars_scraper: TipCarsScraper = TipCarsScraper(request_call_limit, request_period_seconds, requests_made, number_of_attempts)
-            cars_menu: CarsMenu = CarsMenu()
-            
-            while True:
-                print('\n\t *** TipCars Menu ***')
-                choice: str = cars_menu.menu_cars()
-                # Scrape Pages
-                if choice == '1':
-                    print('\n\t *** Enter start and end pages to check ***')
-                    start_page: int = int(input('Enter start page: '))
-                    end_page: int = int(input('Enter end page: '))
-                    
-                    # Get list of proxies for scraping
-                    try:
-                        proxy_list: list = ProxyScraper().get_proxy_list()
-                    except Exception as e:
-                        logger.error(f'Failed to get proxy list: {e}')
-                    try:
-                        available_proxies: list = ProxyScraper().check_proxies(proxies = proxy_list)
-                    except Exception as e:
-                        logger.error(f'Failed to check proxies: {e}')
-                    proxy_pool: Iterator = cycle(available_proxies)
+            site: str = SITE_IDS[site_id]
+            scraper = SITES[site]['scraper'](request_call_limit, request_period_seconds, requests_made, number_of_attempts)
+            site_menu(site, scraper, CarsMenu(), DatabaseManagerSettings())
 
-                    list_cars: list = []
-                    list_all_cars_details: list = []
-                    start_time: datetime = datetime.now()
-                    print('\t*** Start scraping all pages with proxies... ***')
-                    for page in range(start_page, end_page + 1):
-                        # Get proxy from pool
-                        try:
-                            proxy: str = next(proxy_pool)
-                        except StopIteration:
-                            logger.error('Proxy pool empty')
-                            break
-                        # Get headers from pool
-                        headers: dict = next(headers_pool)
-                        try:
-                            response: requests.models.Response = tipcars_scraper.fetch_page(base_url_tipcars, page, proxy, headers)
-                        except Exception as e:
-                            logger.error(f'Failed to fetch page: {e}')
-                            break
-                        if response is None:
-                            logger.info(f'Page {page} not found. Skipping...\n')
-                            break
-                        try:
-                            cars_details: dict = tipcars_scraper.parse_data(response, page)
-                        except Exception as e:
-                            logger.error(f'Failed to parse page: {e}')
-                            break
-                        if cars_details is None:
-                            logger.info(f'Page parse {page} not found. Skipping...\n')
-                            break
-                        list_cars.append(cars_details)
-                    list_cars_details = tipcars_scraper.edit_list_cars_details(list_cars)
-                    end_time = datetime.now()
-                    logger.info(f'Elapsed time for scraping: {end_time - start_time}')
-                    logger.info(f'Total number of cars found: {len(list_cars_details)}\n')
-                    
-                    list_all_cars_details.extend(list_cars_details)
-                    df_to_insert: pd.DataFrame = check_new_items.compare_details_with_db(list_all_cars_details)
-                    logger.info('Process scraping was successfully completed')
-                    logger.info('Total number of records to insert: %s', len(df_to_insert))
-                    
-                    while True:
-                        choice: str = cars_menu.sub_menu_cars()
-                        # Show as DataFrame
-                        if choice == '1':
-                            print(df_to_insert)
-                        # Add to DB
-                        elif choice == '2':
-                            db_manager_settings.insert_data(df=df_to_insert, Model=CarData)
-                            db_manager_settings.close_connection()
-                            logger.info(f"Data was successfully inserted. {df_to_insert.shape[0]} rows inserted.")
-                        # Export to csv
-                        elif choice == '3':
-                            unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            df_to_insert.to_csv(f'multi-cars-scraping/tipcars_data_{unique_suffix}.csv', index=False, encoding='utf-8-sig')
-                            logger.info('Data was successfully exported to csv')
-                        # Export to xlsx
-                        elif choice == '4':
-                            unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            df_to_insert.to_excel(f'multi-cars-scraping/tipcars_data_{unique_suffix}.xlsx')
-                            logger.info('Data was successfully exported to xlsx')
-                        # Back
-                        elif choice == '5':
-                            break
-                        
-                # Display all data from DB
-                elif choice == '2':        
-                    car_data: pd.DataFrame = db_manager_settings.read_data(CarData)
-                    db_manager_settings.close_connection()
-                    print(car_data)
-                # Delete all data from DB
-                elif choice == '3': 
-                    db_manager_settings.delete_all_data(model=CarData)
-                    db_manager_settings.close_connection()
-                    logger.info('All data was successfully deleted from DB')
-                # Back to Main Menu
-                elif choice == '4':
-                    break
-        
         # Settings
         elif site_id == '4':
+            from db import DatabaseManagerSettings, ScrapingSettings, ProxySettings
+
+            db_manager_settings: DatabaseManagerSettings = DatabaseManagerSettings()
             while True:
                 settings_id: str = main_menu.settings_menu()
                 # Scraping Settings
@@ -388,8 +135,7 @@ def main():
                     # Update number of attempts in DB
                     db_manager_settings.update_data(ScrapingSettings, {'number_of_attempts': number_of_attempts})
                     
-                    # Close DB connection
-                    db_manager_settings.close_connection()
+                    invalidate_db_settings()
                     logger.info('Settings were successfully updated')
                     
                 # Proxy Settings
@@ -404,8 +150,7 @@ def main():
                     # Update number of proxies in DB
                     db_manager_settings.update_data(ProxySettings, {'number_of_proxies': number_of_proxies})
                     
-                    # Close DB connection
-                    db_manager_settings.close_connection()
+                    invalidate_db_settings()
                     logger.info('Settings were successfully updated')
 
                 # Logging Settings
@@ -423,13 +168,13 @@ def main():
 # Start program
 if __name__ == '__main__':
     # Load environment variables
-    load_dotenv()
+    load_env()
     
     # Load logger settings from .env file
     LOG_DIR_MAIN = os.getenv('LOG_DIR_MAIN')
     
     # Create logger object
-    logger = logger.get_logger(log_file=LOG_DIR_MAIN, log_level=logging.INFO)
+    logger = logger.get_logger(log_file=LOG_DIR_MAIN, name='main')
     
     # Run program
     main()
\ No newline at end of file
@@ -0,0 +1,299 @@
+import os
+import re
+import time
+import unicodedata
+from urllib.parse import urlsplit
+import pandas as pd
+from sqlalchemy import select, update, func
+from logs import logger
+from metrics import metrics
+from config import load_env, get_settings
+from db import DatabaseManagerSettings, CarData, session_scope
+from dimensions import decoded_columns
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_DATABASE = os.getenv('LOG_DIR_DATABASE')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_DATABASE, name='database')
+
+# Domain of the listings of every site, the site of a stored row is known only from its URL
+SITE_DOMAINS: dict = {
+    'aaaauto.cz': 'aaaauto',
+    'sauto.cz': 'sauto',
+    'tipcars.com': 'tipcars',
+}
+
+# Brands written differently on the sites (normalized form -> common form)
+BRAND_ALIASES: dict = {
+    'vw': 'volkswagen',
+    'mercedes': 'mercedesbenz',
+    'alfa': 'alfaromeo',
+}
+
+YEAR_PATTERN = re.compile(r'(?:19|20)\d{2}')
+
+
+def normalize_text(value):
+    """
+    Returns the text in lower case without diacritics and punctuation (Škoda Octavia -> skoda octavia), '' for a missing value.
+    """
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    value = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', value.lower()).split())
+
+
+def to_number(value):
+    """
+    Returns the number in a scraped value (125 000, 125000 km, 110 kW), or None if there is none.
+    """
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    digits: str = re.sub(r'\D', '', str(value))
+    return int(digits) if digits else None
+
+
+def blocking_key(znacka, model, rok):
+    """
+    Returns the blocking key of a car: normalized brand, first word of the model and the year (skoda|octavia|2018).
+    Only cars with the same key are compared, so the matcher never compares the whole table pairwise.
+
+    Args:
+        znacka: The brand.
+        model: The model, on some sites with the version (Octavia Combi 2.0 TDI).
+        rok: The year, possibly with the month (5/2018).
+
+    Returns:
+        str: The key, '' if the brand, model or year is missing.
+    """
+    brand: str = normalize_text(znacka).replace(' ', '')
+    brand = BRAND_ALIASES.get(brand, brand)
+    model_words: list = normalize_text(model).split()
+    # Ak parser nechal značku v modeli (Skoda Octavia), preskočí sa
+    if model_words and model_words[0] == brand:
+        model_words = model_words[1:]
+    year = YEAR_PATTERN.search(str(rok)) if rok is not None else None
+    if not brand or not model_words or year is None:
+        return ''
+    return f'{brand}|{model_words[0]}|{year.group()}'[:160]
+
+
+def site_of_url(url: str):
+    """
+    Returns the site key of a listing URL (https://www.sauto.cz/... -> sauto), or None.
+    """
+    try:
+        host: str = urlsplit(str(url)).hostname or ''
+    except ValueError:
+        return None
+    for domain, site in SITE_DOMAINS.items():
+        if host == domain or host.endswith('.' + domain):
+            return site
+    return None
+
+
+class NearDuplicateMatcher:
+    def __init__(self, km_tolerance: float = None, km_tolerance_abs: int = None, price_tolerance: float = None,
+                 power_tolerance_kw: int = None, min_compared_fields: int = None, batch_size: int = None) -> None:
+        """
+        Initializes the matcher of the same car listed on several sites under different URLs.
+
+        Cars are blocked on the indexed `blocking_key` column (brand, model, year); within a block, two cars
+        from different sites are the same car when their mileage, price and engine power differ at most by the
+        tolerances. Values missing on one of the sites are not compared, but at least `min_compared_fields`
+        of them must be known on both. The defaults are taken from matching_settings in the settings file.
+
+        Args:
+            km_tolerance (float, optional): Allowed difference of the mileage as a fraction (0.03 = 3 %).
+            km_tolerance_abs (int, optional): Allowed difference of the mileage in km, for cars with a low mileage.
+            price_tolerance (float, optional): Allowed difference of the price as a fraction.
+            power_tolerance_kw (int, optional): Allowed difference of the engine power in kW.
+            min_compared_fields (int, optional): The number of values which must be known on both sites.
+            batch_size (int, optional): The number of keys or rows read and updated in one query.
+        """
+        matching_settings: dict = get_settings().matching
+        self.km_tolerance: float = km_tolerance if km_tolerance is not None else matching_settings.get('km_tolerance', 0.03)
+        self.km_tolerance_abs: int = km_tolerance_abs if km_tolerance_abs is not None else matching_settings.get('km_tolerance_abs', 1500)
+        self.price_tolerance: float = price_tolerance if price_tolerance is not None else matching_settings.get('price_tolerance', 0.05)
+        self.power_tolerance_kw: int = power_tolerance_kw if power_tolerance_kw is not None else matching_settings.get('power_tolerance_kw', 5)
+        self.min_compared_fields: int = min_compared_fields or matching_settings.get('min_compared_fields', 2)
+        self.batch_size: int = batch_size or matching_settings.get('batch_size', 500)
+        self.db_manager_settings = DatabaseManagerSettings()
+        self.db_manager_settings.ensure_columns(CarData.__table__)
+
+    def features(self, row: dict):
+        """
+        Returns the values compared by the matcher: (site, km, price, power).
+        """
+        return site_of_url(row.get('url')), to_number(row.get('km')), to_number(row.get('cena')), to_number(row.get('vykon_motora'))
+
+    def is_same_car(self, first: tuple, second: tuple):
+        """
+        Compares the features of two cars with the same blocking key (see `features`).
+
+        Returns:
+            bool: True if the cars are from different sites and all values known on both sites are within the tolerances.
+        """
+        if first[0] is None or first[0] == second[0]:
+            return False
+        km, other_km = first[1], second[1]
+        price, other_price = first[2], second[2]
+        power, other_power = first[3], second[3]
+        compared: int = 0
+        if km is not None and other_km is not None:
+            if abs(km - other_km) > max(self.km_tolerance_abs, self.km_tolerance * max(km, other_km)):
+                return False
+            compared += 1
+        if price is not None and other_price is not None:
+            if abs(price - other_price) > self.price_tolerance * max(price, other_price):
+                return False
+            compared += 1
+        if power is not None and other_power is not None:
+            if abs(power - other_power) > self.power_tolerance_kw:
+                return False
+            compared += 1
+        return compared >= self.min_compared_fields
+
+    def read_blocks(self, keys: list, canonical_only: bool = False):
+        """
+        Reads the stored cars with the given blocking keys, in batches of `batch_size` keys.
+
+        Args:
+            keys (list): The blocking keys.
+            canonical_only (bool): Read only cars which are not duplicates themselves.
+
+        Returns:
+            dict: Blocking key -> list of (id, duplicate_of, features) ordered by id.
+        """
+        blocks: dict = {}
+        columns: tuple = (CarData.id, CarData.duplicate_of, CarData.blocking_key, CarData.url, CarData.km, CarData.cena, CarData.vykon_motora)
+        with session_scope() as session:
+            for index in range(0, len(keys), self.batch_size):
+                query = select(*columns).where(CarData.blocking_key.in_(keys[index:index + self.batch_size]))
+                if canonical_only:
+                    query = query.where(CarData.duplicate_of.is_(None))
+                for row in session.execute(query.order_by(CarData.id)).mappings():
+                    blocks.setdefault(row['blocking_key'], []).append((row['id'], row['duplicate_of'], self.features(row)))
+        return blocks
+
+    def match_new(self, df: pd.DataFrame, site: str, skip_duplicates: bool = None):
+        """
+        Adds the columns blocking_key and duplicate_of to the cars scraped from a site before they are inserted.
+
+        Args:
+            df (pd.DataFrame): The new cars of the site (output of the dedup stage).
+            site (str): The site key from pipeline.SITES.
+            skip_duplicates (bool, optional): Drop the cars already stored from another site instead of only
+                marking them (matching_settings.skip_duplicates by default).
+
+        Returns:
+            pd.DataFrame: The cars with the new columns, without the duplicates if skip_duplicates is set.
+        """
+        if skip_duplicates is None:
+            skip_duplicates = get_settings().matching.get('skip_duplicates', False)
+        df = df.copy()
+        if df.empty:
+            df['blocking_key'] = pd.Series(dtype=object)
+            df['duplicate_of'] = pd.Series(dtype=object)
+            return df
+
+        start_time: float = time.perf_counter()
+        records: list = df.to_dict('records')
+        keys: list = [blocking_key(record.get('znacka'), record.get('model'), record.get('rok')) for record in records]
+        blocks: dict = self.read_blocks(sorted({key for key in keys if key}), canonical_only=True)
+
+        duplicates: list = []
+        for record, key in zip(records, keys):
+            duplicate_of = None
+            if key in blocks:
+                car: tuple = self.features(record)
+                duplicate_of = next((car_id for car_id, _, other in blocks[key] if self.is_same_car(car, other)), None)
+            duplicates.append(duplicate_of)
+
+        df['blocking_key'] = keys
+        df['duplicate_of'] = pd.Series(duplicates, index=df.index, dtype=object)
+        found: int = sum(duplicate is not None for duplicate in duplicates)
+        metrics.observe('match_seconds', time.perf_counter() - start_time, site=site)
+        metrics.inc('duplicates_found_total', found, site=site)
+        logger.info(f'Near-duplicate matching of {site}: {found} of {len(df)} cars already listed on another site')
+        if skip_duplicates:
+            df = df[df['duplicate_of'].isna()].reset_index(drop=True)
+        return df
+
+    def backfill_blocking_keys(self):
+        """
+        Computes the blocking key of stored cars which do not have one yet (inserted before the matcher existed).
+
+        Returns:
+            int: The number of updated cars.
+        """
+        updated: int = 0
+        last_id: int = 0
+        decoded, source = decoded_columns()
+        while True:
+            with session_scope() as session:
+                rows: list = session.execute(
+                    select(CarData.id, decoded['znacka'], decoded['model'], CarData.rok).select_from(source)
+                    .where(CarData.blocking_key.is_(None), CarData.id > last_id)
+                    .order_by(CarData.id).limit(self.batch_size)
+                ).all()
+                if not rows:
+                    break
+                session.execute(update(CarData), [
+                    {'id': row.id, 'blocking_key': blocking_key(row.znacka, row.model, row.rok)} for row in rows
+                ])
+            last_id = rows[-1].id
+            updated += len(rows)
+        if updated:
+            logger.info(f'Blocking key computed for {updated} stored cars')
+        return updated
+
+    def match_table(self):
+        """
+        Finds the near-duplicates in the whole table: backfills the blocking keys, then compares the cars only
+        within the blocks with more than one car. In every block the oldest car of a listing stays canonical,
+        the later ones from other sites get its id in duplicate_of.
+
+        Returns:
+            dict: {'blocks': compared blocks, 'duplicates': cars marked as duplicates, 'updated': changed rows}.
+        """
+        self.backfill_blocking_keys()
+        with session_scope() as session:
+            keys: list = session.scalars(
+                select(CarData.blocking_key).where(CarData.blocking_key != '')
+                .group_by(CarData.blocking_key).having(func.count() > 1)
+            ).all()
+
+        duplicates: int = 0
+        updated: int = 0
+        for index in range(0, len(keys), self.batch_size):
+            blocks: dict = self.read_blocks(keys[index:index + self.batch_size])
+            changes: list = []
+            for cars in blocks.values():
+                canonical: list = []
+                for car_id, current, car in cars:
+                    duplicate_of = next((other_id for other_id, other in canonical if self.is_same_car(car, other)), None)
+                    if duplicate_of is None:
+                        canonical.append((car_id, car))
+                    else:
+                        duplicates += 1
+                    if duplicate_of != current:
+                        changes.append({'id': car_id, 'duplicate_of': duplicate_of})
+            self.update_duplicates(changes)
+            updated += len(changes)
+
+        logger.info(f'Near-duplicate matching of the table: {len(keys)} blocks, {duplicates} duplicates')
+        return {'blocks': len(keys), 'duplicates': duplicates, 'updated': updated}
+
+    def update_duplicates(self, changes: list):
+        """
+        Writes the changed duplicate_of values, `batch_size` rows per statement.
+        """
+        for index in range(0, len(changes), self.batch_size):
+            with session_scope() as session:
+                session.execute(update(CarData), changes[index:index + self.batch_size])
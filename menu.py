@@ -1,5 +1,3 @@
-from consolemenu import *
-from consolemenu.items import *
 from rich import print
 
 
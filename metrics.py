@@ -0,0 +1,259 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS: tuple = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix of the metric names in the Prometheus output
+PROMETHEUS_PREFIX: str = 'mcs_'
+
+# Descriptions of the metrics used by the scraper (shown as # HELP in the Prometheus output)
+METRIC_HELP: dict = {
+    'request_latency_seconds': 'Latency of HTTP requests for listing pages by site and proxy.',
+    'requests_total': 'HTTP requests for listing pages by site and status (code or error).',
+    'request_retries_total': 'Repeated attempts to fetch a page by site.',
+    'bytes_downloaded_total': 'Bytes of downloaded page bodies by site.',
+    'pages_stopped_early_total': 'Listing pages whose download stopped after the pagination by site.',
+    'parse_seconds': 'Time to parse one listing page by site.',
+    'cars_parsed_total': 'Cars parsed from listing pages by site.',
+    'pages_unchanged_total': 'Listing pages skipped because their cards did not change since they were stored by site.',
+    'dedup_seconds': 'Time to compare scraped cars with the database.',
+    'insert_seconds': 'Time to insert a batch of rows by table.',
+    'rows_inserted_total': 'Rows inserted into the database by table.',
+    'stage_seconds': 'Duration of the stages of a scrape run by site and stage.',
+    'proxy_quarantined_total': 'Proxies moved to quarantine after repeated failures.',
+    'proxy_restored_total': 'Quarantined proxies which passed the check again.',
+    'proxy_harvested_total': 'New proxies added to the pool by the refresher.',
+    'match_seconds': 'Time to match new cars with the cars listed on other sites by site.',
+    'duplicates_found_total': 'New cars already listed on another site by site.',
+    'enrich_seconds': 'Time to fill the missing columns of cars from their detail pages by site.',
+    'cars_enriched_total': 'Cars updated with values from their detail pages by site.',
+    'sitemap_seconds': 'Time to read the sitemaps of a site and queue its new listings.',
+    'sitemap_listings_total': 'Listing URLs found in the sitemaps by site.',
+    'listings_queued_total': 'Listings from the sitemaps not stored yet and queued by site.',
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        """
+        Initializes a histogram with fixed bucket upper bounds (the last bucket is +Inf).
+
+        Args:
+            buckets (tuple): The upper bounds of the buckets, in ascending order.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        """
+        Adds one observed value to the histogram.
+        """
+        index: int = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float):
+        """
+        Estimates the quantile from the buckets (upper bound of the bucket containing it, max for the +Inf bucket).
+        """
+        if self.count == 0:
+            return None
+        rank: float = q * self.count
+        cumulative: int = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        """
+        Returns the histogram as a JSON-friendly dictionary.
+        """
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """
+        Initializes the registry of counters and histograms, identified by a name and labels.
+        """
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.counters: dict = {}
+        self.histograms: dict = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increases the counter `name` with the given labels by `value`.
+        """
+        key: tuple = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Adds the value to the histogram `name` with the given labels.
+        """
+        key: tuple = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram: Histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Measures the duration of the block and adds it (in seconds) to the histogram `name`.
+
+        Example:
+            with metrics.timer('parse_seconds', site='sauto'):
+                parse(page)
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        """
+        Drops all collected values.
+        """
+        with self.lock:
+            self.started_at = datetime.now()
+            self.counters.clear()
+            self.histograms.clear()
+
+    def summary(self):
+        """
+        Returns the run summary: every counter and histogram with its labels.
+
+        Returns:
+            dict: The JSON-friendly summary.
+        """
+        with self.lock:
+            counters: list = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms: list = [
+                {'name': name, 'labels': dict(labels), **histogram.summary()}
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def write_json(self, path: str):
+        """
+        Writes the run summary to a JSON file.
+
+        Args:
+            path (str): The path of the JSON file.
+        """
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2, ensure_ascii=False, default=str)
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics as text.
+        """
+        def format_labels(labels) -> str:
+            if not labels:
+                return ''
+            values: str = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+            return '{' + values + '}'
+
+        lines: list = []
+        described: set = set()
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                metric: str = PROMETHEUS_PREFIX + name
+                if metric not in described:
+                    described.add(metric)
+                    lines.append(f'# HELP {metric} {METRIC_HELP.get(name, name)}')
+                    lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric}{format_labels(labels)} {value}')
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric: str = PROMETHEUS_PREFIX + name
+                if metric not in described:
+                    described.add(metric)
+                    lines.append(f'# HELP {metric} {METRIC_HELP.get(name, name)}')
+                    lines.append(f'# TYPE {metric} histogram')
+                cumulative: int = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{metric}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{metric}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def serve_prometheus(self, port: int, host: str = '0.0.0.0'):
+        """
+        Serves the metrics on http://host:port/metrics from a background thread.
+
+        Args:
+            port (int): The port to listen on.
+            host (str): The address to listen on.
+
+        Returns:
+            ThreadingHTTPServer: The running server (call shutdown() to stop it).
+        """
+        registry: MetricsRegistry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body: bytes = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Metrics of the process, shared by all modules
+metrics = MetricsRegistry()
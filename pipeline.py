@@ -0,0 +1,585 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import cycle
+from typing import Iterator
+import pandas as pd
+import profiling
+from logs import logger
+from metrics import metrics
+from config import load_env, get_settings, get_db_settings
+from db import DatabaseManagerSettings, CarData
+from matching import NearDuplicateMatcher
+from enrichment import DetailEnricher
+from sitemap import SitemapDiscovery, ListingQueueScraper, local_path, mark_listings, pending_listings
+from fingerprints import PageFingerprintStore, save_page_fingerprints
+from listings import add_listing_keys, new_listing_mask
+from records import CarBatch
+from proxy import ProxyHarvester, ProxyPool, ProxyPoolRefresher
+from scraper import CheckNewItems, AaaAutoScraper, SautoScraper, SautoApiScraper, TipCarsScraper
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_SCRAPING = os.getenv('LOG_DIR_SCRAPING')
+
+# Create logger object (the same logger as in scraper.py)
+logger = logger.get_logger(log_file=LOG_DIR_SCRAPING, name='scraping')
+
+# Supported sites: scraper class and name of its parse method (base URLs are in the settings file),
+# api_scraper reads the JSON endpoint of the site instead if scraping_settings.<site>_api.enabled
+SITES: dict = {
+    'aaaauto': {'label': 'AaaAuto', 'scraper': AaaAutoScraper, 'parse': 'parse_page'},
+    'sauto': {'label': 'SAuto', 'scraper': SautoScraper, 'api_scraper': SautoApiScraper, 'parse': 'get_parsed_data'},
+    'tipcars': {'label': 'TipCars', 'scraper': TipCarsScraper, 'parse': 'parse_data'},
+}
+
+OUTPUTS: tuple = ('db', 'csv', 'xlsx', 'stdout', 'none')
+
+# Enrichment of the inserted cars (see export_data) runs in one background thread, one site after another
+_enrich_executor: ThreadPoolExecutor = None
+_enrich_futures: list = []
+_enrich_lock = threading.Lock()
+
+
+def get_scraping_limits():
+    """
+    Reads the scraping limits from the database (ScrapingSettings), cached by config.get_db_settings().
+
+    Returns:
+        tuple: request_call_limit, request_period_seconds, requests_made and number_of_attempts.
+    """
+    db_settings = get_db_settings()
+    return (
+        db_settings.request_call_limit,
+        db_settings.request_period_seconds,
+        db_settings.requests_made,
+        db_settings.number_of_attempts,
+    )
+
+
+def create_scraper(site: str, api: bool = None):
+    """
+    Creates the scraper for the given site with the limits stored in the database.
+
+    Args:
+        site (str): The site key from SITES.
+        api (bool, optional): Use the JSON endpoint of the site (api_scraper in SITES),
+            by default if scraping_settings.<site>_api.enabled is set.
+
+    Returns:
+        Scraper: A new scraper instance for the site.
+    """
+    if site not in SITES:
+        raise ValueError(f'Unknown site: {site}')
+    if api is None:
+        api = get_settings().scraping.get(f'{site}_api', {}).get('enabled', False)
+    if api and 'api_scraper' in SITES[site]:
+        return SITES[site]['api_scraper'](*get_scraping_limits())
+    return SITES[site]['scraper'](*get_scraping_limits())
+
+
+def get_proxy_pool():
+    """
+    Returns an endless pool of working proxies, filled by ProxyHarvester in a background thread.
+
+    The proxies of all sources are checked at once and go into the pool as soon as they pass, so the function
+    returns with the first working proxy instead of after checking the whole list.
+
+    The pool (proxy.ProxyPool) quarantines proxies which keep failing. If proxy_settings.pool.refresh_interval_seconds
+    is set, a ProxyPoolRefresher thread rechecks the quarantined proxies and harvests new ones, so the pool stays
+    at number_of_proxies during long crawls; stop it with `close_proxy_pool`.
+
+    If proxies are disabled in the settings file (proxy_settings.use_proxy), the pool yields None
+    and the pages are fetched without a proxy. If proxy_settings.gateway_url is set, all pages go through
+    that rotating gateway (proxy/proxy_server.py --gateway), which checks and rotates the proxies itself.
+
+    Returns:
+        Iterator: An endless iterator over the available proxies.
+    """
+    proxy_settings: dict = get_settings().proxy
+    if not proxy_settings.get('use_proxy', True):
+        return cycle([None])
+    if proxy_settings.get('gateway_url'):
+        return cycle([proxy_settings['gateway_url']])
+
+    pool_settings: dict = proxy_settings.get('pool', {})
+    refresh: bool = bool(pool_settings.get('refresh_interval_seconds'))
+    number_of_proxies: int = get_db_settings().number_of_proxies
+    proxy_pool: ProxyPool = ProxyPool(
+        [],
+        target_size=number_of_proxies,
+        wait_seconds=pool_settings.get('wait_seconds', 30) if refresh else 0,
+    )
+    harvested = threading.Event()
+    harvest_thread = threading.Thread(target=fill_proxy_pool, args=(proxy_pool, number_of_proxies, harvested), name='proxy-pool-harvest', daemon=True)
+    harvest_thread.start()
+    # Čaká sa len na prvú fungujúcu proxy (alebo na koniec zberu, ak žiadna neprešla)
+    with proxy_pool.condition:
+        proxy_pool.condition.wait_for(lambda: proxy_pool.healthy or harvested.is_set())
+    if refresh:
+        proxy_pool.refresher = ProxyPoolRefresher(proxy_pool)
+        proxy_pool.refresher.start()
+    return proxy_pool
+
+
+def fill_proxy_pool(proxy_pool: ProxyPool, limit: int, harvested: threading.Event = None):
+    """
+    Adds the proxies of ProxyHarvester.harvest_healthy to the pool one by one as they pass the check.
+    Sets `harvested` (under the lock of the pool, waking its waiters) when the harvest is over.
+    """
+    try:
+        for proxy in ProxyHarvester().harvest_healthy(limit=limit):
+            proxy_pool.add([proxy])
+    except Exception as e:
+        logger.error(f'Failed to harvest proxies: {e}')
+    finally:
+        with proxy_pool.condition:
+            if harvested is not None:
+                harvested.set()
+            proxy_pool.condition.notify_all()
+    logger.info(f'Proxy pool filled: {proxy_pool.stats()}')
+
+
+def close_proxy_pool(proxy_pool: Iterator):
+    """
+    Stops the background refresher of a pool returned by get_proxy_pool (other pools are left as they are).
+    """
+    if isinstance(proxy_pool, ProxyPool):
+        proxy_pool.close()
+
+
+def get_headers_pool():
+    """
+    Returns an endless pool of user-agent headers from the settings file (ScrapingSettings).
+
+    Returns:
+        Iterator: An endless iterator over the headers.
+    """
+    return cycle(get_settings().user_agents)
+
+
+def discover_last_page(site: str, scraper=None, proxy_pool: Iterator = None, headers_pool: Iterator = None):
+    """
+    Fetches the first listing page of the site and reads the number of its last page from the pagination
+    (or the total number of cars), see Scraper.discover_last_page.
+
+    Args:
+        site (str): The site key from SITES.
+        scraper (Scraper, optional): The scraper instance to use, a new one is created if not given.
+        proxy_pool (Iterator, optional): The pool of proxies to use, proxies are fetched and checked if not given.
+        headers_pool (Iterator, optional): The pool of headers to use, taken from the settings file if not given.
+
+    Returns:
+        int or None: The number of the last page, or None if the first page could not be fetched or has no pagination.
+    """
+    if scraper is None:
+        scraper = create_scraper(site)
+    own_proxy_pool: bool = proxy_pool is None
+    if own_proxy_pool:
+        proxy_pool = get_proxy_pool()
+    if headers_pool is None:
+        headers_pool = get_headers_pool()
+    try:
+        response: str = scraper.fetch_page(get_settings().base_urls[site], 1, next(proxy_pool), next(headers_pool))
+    except StopIteration:
+        logger.error('Proxy pool empty')
+        return None
+    finally:
+        if own_proxy_pool:
+            close_proxy_pool(proxy_pool)
+    if response is None:
+        logger.error(f'Failed to discover the last page of {site}: the first page could not be fetched')
+        return None
+    last_page = scraper.discover_last_page(response)
+    logger.info(f'Last page of {site}: {last_page}')
+    return last_page
+
+
+# Result of a page with the same cards as when they were stored (see PageFingerprintStore)
+UNCHANGED_PAGE: dict = {}
+
+
+def scrape_pages(site: str, scraper, start_page: int, end_page: int, proxy_pool: Iterator, headers_pool: Iterator, concurrency: int = 1, known_range: bool = False,
+                 fingerprints: PageFingerprintStore = None):
+    """
+    Fetches and parses the pages from start_page to end_page of the given site.
+
+    Pages are fetched in batches of `concurrency` pages at once. Scraping stops after the first batch
+    containing a page that could not be fetched or parsed, the same way the serial loop stops on the last page.
+    If the range is known to exist (`known_range`, end_page found by discover_last_page), all pages are scheduled
+    at once without waiting for the batches, and a page that fails is skipped instead of ending the scrape.
+    With `fingerprints`, a page whose cards did not change since they were stored is not parsed at all.
+
+    Args:
+        site (str): The site key from SITES.
+        scraper (Scraper): The scraper instance for the site.
+        start_page (int): The first page to scrape.
+        end_page (int): The last page to scrape.
+        proxy_pool (Iterator): The pool of proxies to use.
+        headers_pool (Iterator): The pool of headers to use.
+        concurrency (int): The number of pages fetched at the same time.
+        known_range (bool): All pages from start_page to end_page exist.
+        fingerprints (PageFingerprintStore, optional): The fingerprints of the pages from the last runs, gets the new ones.
+
+    Returns:
+        CarBatch: The cars of all parsed pages, stored column by column (see records.py).
+    """
+    base_url: str = get_settings().base_urls[site]
+    parse = getattr(scraper, SITES[site]['parse'])
+    scraper.proxy_pool = proxy_pool if isinstance(proxy_pool, ProxyPool) else None
+    concurrency = max(1, concurrency)
+
+    def scrape_page(page: int, proxy: str, headers: dict):
+        with profiling.trace_page(site, page) as trace:
+            return trace_scrape_page(page, proxy, headers, trace)
+
+    def trace_scrape_page(page: int, proxy: str, headers: dict, trace):
+        try:
+            with trace.span('fetch'):
+                response: str = scraper.fetch_page(base_url, page, proxy, headers)
+        except Exception as e:
+            logger.error(f'Failed to fetch page: {e}')
+            return None
+        if response is None:
+            logger.info(f'Page {page} not found. Skipping...\n')
+            return None
+        trace.set(characters=len(response))
+        fingerprint: str = scraper.listing_fingerprint(response) if fingerprints is not None else None
+        if fingerprints is not None and fingerprints.unchanged(page, fingerprint):
+            trace.set(unchanged=True)
+            metrics.inc('pages_unchanged_total', site=site)
+            return UNCHANGED_PAGE
+        try:
+            with trace.span('parse'), metrics.timer('parse_seconds', site=site):
+                cars_details: dict = parse(response, page)
+        except Exception as e:
+            logger.error(f'Failed to parse page: {e}')
+            return None
+        if cars_details is None:
+            logger.info(f'Page parse {page} not found. Skipping...\n')
+            return None
+        trace.set(cars=len(cars_details['url']))
+        metrics.inc('cars_parsed_total', len(cars_details['url']), site=site)
+        if fingerprints is not None:
+            fingerprints.update(page, fingerprint, len(cars_details['url']))
+        return cars_details
+
+    # Stránky sa pridávajú v hlavnom vlákne, hneď ako sú hotové, slovníky stránok sa potom uvoľnia
+    cars: CarBatch = CarBatch()
+    start_time: datetime = datetime.now()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if known_range:
+            # Proxies and headers are taken here, the pools are not thread-safe
+            jobs: list = []
+            for page in range(start_page, end_page + 1):
+                try:
+                    jobs.append((page, next(proxy_pool), next(headers_pool)))
+                except StopIteration:
+                    logger.error('Proxy pool empty')
+                    break
+            for (page, _, _), cars_details in zip(jobs, executor.map(lambda job: scrape_page(*job), jobs)):
+                if cars_details is None:
+                    logger.error(f'Page {page} of {site} failed, skipping it')
+                    continue
+                if cars_details is not UNCHANGED_PAGE:
+                    cars.extend(cars_details)
+        else:
+            for batch_start in range(start_page, end_page + 1, concurrency):
+                pages: range = range(batch_start, min(batch_start + concurrency, end_page + 1))
+                # Proxies and headers are taken here, the pools are not thread-safe
+                try:
+                    jobs: list = [(page, next(proxy_pool), next(headers_pool)) for page in pages]
+                except StopIteration:
+                    logger.error('Proxy pool empty')
+                    break
+                results: list = list(executor.map(lambda job: scrape_page(*job), jobs))
+                last_page_reached: bool = False
+                for cars_details in results:
+                    if cars_details is None:
+                        last_page_reached = True
+                        break
+                    if cars_details is not UNCHANGED_PAGE:
+                        cars.extend(cars_details)
+                if last_page_reached:
+                    break
+
+    end_time: datetime = datetime.now()
+    logger.info(f'Elapsed time for scraping: {end_time - start_time}')
+    logger.info(f'Total number of cars found: {len(cars)}\n')
+    return cars
+
+
+def scrape_site(site: str, start_page: int, end_page: int = None, concurrency: int = 1, incremental: bool = True, scraper=None, proxy_pool: Iterator = None, headers_pool: Iterator = None):
+    """
+    Runs the whole scrape of one site: proxies, fetching, parsing, (optionally) comparing with the database
+    and marking the cars already listed on another site (matching_settings.enabled, see matching.py).
+
+    An incremental scrape with scraping_settings.page_fingerprints.enabled skips the pages whose cards did not
+    change since they were stored; the new fingerprints are returned in df.attrs['page_fingerprints'] and
+    saved by export_data once the cars are in the database.
+
+    Args:
+        site (str): The site key from SITES.
+        start_page (int): The first page to scrape.
+        end_page (int, optional): The last page to scrape. If not given, the last page of the listing is read
+            from the first page (discover_last_page) and the whole range is scheduled at once.
+        concurrency (int): The number of pages fetched at the same time.
+        incremental (bool): If True, only the cars not yet stored in the database are returned.
+        scraper (Scraper, optional): The scraper instance to use, a new one is created if not given.
+        proxy_pool (Iterator, optional): The pool of proxies to use, proxies are fetched and checked if not given
+            (the pool created here is closed at the end of the scrape).
+        headers_pool (Iterator, optional): The pool of headers to use, taken from the settings file if not given.
+
+    Returns:
+        pd.DataFrame: A dataframe containing the scraped car details.
+    """
+    if scraper is None:
+        scraper = create_scraper(site)
+    own_proxy_pool: bool = proxy_pool is None
+    if own_proxy_pool:
+        with metrics.timer('stage_seconds', site=site, stage='proxies'), profiling.stage(site, 'proxies'):
+            proxy_pool = get_proxy_pool()
+    if headers_pool is None:
+        headers_pool = get_headers_pool()
+
+    fingerprints: PageFingerprintStore = None
+    if incremental and get_settings().scraping.get('page_fingerprints', {}).get('enabled', False):
+        fingerprints = PageFingerprintStore(site)
+
+    print('\t*** Start scraping all pages with proxies... ***')
+    try:
+        known_range: bool = False
+        if end_page is None:
+            with metrics.timer('stage_seconds', site=site, stage='discover'), profiling.stage(site, 'discover'):
+                end_page = discover_last_page(site, scraper, proxy_pool, headers_pool)
+            known_range = end_page is not None
+            if end_page is None:
+                end_page = get_settings().scraping.get('max_pages', 1000)
+                logger.warning(f'Last page of {site} not found, scraping up to page {end_page} until the listing ends')
+        with metrics.timer('stage_seconds', site=site, stage='scrape'), profiling.stage(site, 'scrape'):
+            list_cars_details: CarBatch = scrape_pages(site, scraper, start_page, end_page, proxy_pool, headers_pool, concurrency, known_range, fingerprints)
+    finally:
+        if own_proxy_pool:
+            close_proxy_pool(proxy_pool)
+
+    with metrics.timer('stage_seconds', site=site, stage='dedup'), profiling.stage(site, 'dedup'):
+        # Ak sa žiadna stránka nezmenila, nie je čo porovnávať
+        if incremental and list_cars_details:
+            df: pd.DataFrame = CheckNewItems().compare_details_with_db(list_cars_details)
+        else:
+            df: pd.DataFrame = list_cars_details.to_frame()
+
+    if get_settings().matching.get('enabled', False):
+        with metrics.timer('stage_seconds', site=site, stage='match'), profiling.stage(site, 'match'):
+            df = NearDuplicateMatcher().match_new(df, site)
+    if fingerprints is not None:
+        df.attrs['page_fingerprints'] = fingerprints.to_dict()
+    logger.info('Process scraping was successfully completed')
+    logger.info('Total number of records to insert: %s', len(df))
+    return df
+
+
+def export_data(df: pd.DataFrame, site: str, output: str, output_dir: str = 'multi-cars-scraping', proxy_pool: Iterator = None):
+    """
+    Writes the scraped data to the chosen output.
+
+    With the 'db' output, the page fingerprints of the scrape (df.attrs['page_fingerprints'], see scrape_site)
+    are saved after the insert, and with enrichment_settings.enabled the inserted cars are then completed
+    from their detail pages in the background (see submit_enrichment), so the next site does not wait for them.
+
+    Args:
+        df (pd.DataFrame): The scraped data.
+        site (str): The site key from SITES, used in the name of exported files.
+        output (str): One of OUTPUTS: 'db', 'csv', 'xlsx', 'stdout' or 'none'.
+        output_dir (str): The directory for exported csv and xlsx files.
+        proxy_pool (Iterator, optional): The pool of proxies for the detail pages (the pool of the crawl),
+            created if not given. Call wait_for_enrichment before closing it.
+    """
+    with metrics.timer('stage_seconds', site=site, stage='export'), profiling.stage(site, 'export'):
+        write_output(df, site, output, output_dir)
+        if output == 'db' and df.attrs.get('page_fingerprints'):
+            save_page_fingerprints(df.attrs['page_fingerprints'])
+
+    if output == 'db' and not df.empty and get_settings().enrichment.get('enabled', False):
+        submit_enrichment(site, df['url'].tolist(), proxy_pool)
+
+
+def submit_enrichment(site: str, urls: list, proxy_pool: Iterator = None):
+    """
+    Completes the cars from their detail pages (enrich_site) in the background thread of the process.
+
+    Returns:
+        Future: The number of updated cars (0 if the enrichment failed, the error is logged).
+    """
+    global _enrich_executor
+
+    def run_enrichment():
+        try:
+            with metrics.timer('stage_seconds', site=site, stage='enrich'), profiling.stage(site, 'enrich'):
+                return enrich_site(site, urls=urls, proxy_pool=proxy_pool)
+        except Exception as e:
+            logger.exception(f'Enrichment of {site} failed: {e}')
+            return 0
+
+    with _enrich_lock:
+        if _enrich_executor is None:
+            _enrich_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='enrich')
+        future = _enrich_executor.submit(run_enrichment)
+        _enrich_futures.append(future)
+    return future
+
+
+def wait_for_enrichment():
+    """
+    Waits for the enrichment submitted so far; call it before closing the proxy pool passed to export_data.
+
+    Returns:
+        int: The number of updated cars.
+    """
+    with _enrich_lock:
+        futures: list = _enrich_futures[:]
+        _enrich_futures.clear()
+    return sum(future.result() for future in futures)
+
+
+def enrich_site(site: str, urls: list = None, limit: int = None, proxy_pool: Iterator = None, headers_pool: Iterator = None):
+    """
+    Fills the columns missing on the listing cards (enrichment.DETAIL_FIELDS) of the stored cars of a site
+    from their detail pages. Uses its own scraper, so the rate budget of the listing crawl is not touched.
+
+    Args:
+        site (str): The site key from SITES.
+        urls (list, optional): Only these cars (e.g. the cars inserted by the last run), all incomplete cars if not given.
+        limit (int, optional): The maximum number of detail pages to fetch.
+        proxy_pool (Iterator, optional): The pool of proxies to use, proxies are fetched and checked if not given.
+        headers_pool (Iterator, optional): The pool of headers to use, taken from the settings file if not given.
+
+    Returns:
+        int: The number of updated cars.
+    """
+    enricher: DetailEnricher = DetailEnricher()
+    if not enricher.find_incomplete(site, urls, limit=1):
+        return 0
+    own_proxy_pool: bool = proxy_pool is None
+    if own_proxy_pool:
+        proxy_pool = get_proxy_pool()
+    if headers_pool is None:
+        headers_pool = get_headers_pool()
+    # Detailné stránky sú HTML aj v režime API a čítajú sa celé
+    scraper = create_scraper(site, api=False)
+    scraper.streaming = False
+    scraper.proxy_pool = proxy_pool if isinstance(proxy_pool, ProxyPool) else None
+    try:
+        return enricher.enrich(site, scraper, proxy_pool, headers_pool, urls=urls, limit=limit)
+    finally:
+        if own_proxy_pool:
+            close_proxy_pool(proxy_pool)
+
+
+def discover_listings(site: str, sitemap_url: str = None, limit: int = None, proxy_pool: Iterator = None, headers_pool: Iterator = None):
+    """
+    Reads the sitemaps of a site and queues the listings not stored in the database yet (see sitemap.SitemapDiscovery).
+    A few requests give the whole inventory of the site, without paginating its search.
+
+    Args:
+        site (str): The site key from SITES.
+        sitemap_url (str, optional): The sitemap index, sitemap_settings.sites.<site>.url if not given (may be a local file).
+        limit (int, optional): Stop after this many listing URLs.
+        proxy_pool (Iterator, optional): The pool of proxies to use, proxies are fetched and checked if not given.
+        headers_pool (Iterator, optional): The pool of headers to use, taken from the settings file if not given.
+
+    Returns:
+        dict: {'sitemaps', 'listings', 'queued'}, see SitemapDiscovery.discover.
+    """
+    discovery: SitemapDiscovery = SitemapDiscovery(site, sitemap_url=sitemap_url)
+    # Lokálne súbory sa čítajú bez proxy
+    own_proxy_pool: bool = proxy_pool is None and local_path(discovery.sitemap_url or '') is None
+    if own_proxy_pool:
+        proxy_pool = get_proxy_pool()
+    discovery.proxy_pool = proxy_pool
+    discovery.headers_pool = headers_pool if headers_pool is not None else get_headers_pool()
+    try:
+        with metrics.timer('stage_seconds', site=site, stage='sitemap'), profiling.stage(site, 'sitemap'):
+            return discovery.discover(limit=limit)
+    finally:
+        if own_proxy_pool:
+            close_proxy_pool(proxy_pool)
+
+
+def scrape_listing_queue(site: str, limit: int = None, proxy_pool: Iterator = None, headers_pool: Iterator = None):
+    """
+    Scrapes the listings queued from the sitemaps of a site (see discover_listings) from their detail pages:
+    inserts the cars not stored yet and marks the listings done, or failed if the page could not be fetched
+    or shows no car. Run one process per site at a time, the pending listings are not reserved.
+
+    Args:
+        site (str): The site key from SITES.
+        limit (int, optional): The maximum number of listings.
+        proxy_pool (Iterator, optional): The pool of proxies to use, proxies are fetched and checked if not given.
+        headers_pool (Iterator, optional): The pool of headers to use, taken from the settings file if not given.
+
+    Returns:
+        dict: {'fetched': listings parsed, 'inserted': cars inserted, 'failed': listings failed}.
+    """
+    result: dict = {'fetched': 0, 'inserted': 0, 'failed': 0}
+    if not pending_listings(site, limit=1):
+        return result
+    own_proxy_pool: bool = proxy_pool is None
+    if own_proxy_pool:
+        proxy_pool = get_proxy_pool()
+    if headers_pool is None:
+        headers_pool = get_headers_pool()
+    # Detailné stránky sú HTML aj v režime API a čítajú sa celé
+    scraper = create_scraper(site, api=False)
+    scraper.streaming = False
+    scraper.proxy_pool = proxy_pool if isinstance(proxy_pool, ProxyPool) else None
+    check_new_items: CheckNewItems = CheckNewItems()
+    try:
+        with metrics.timer('stage_seconds', site=site, stage='listings'), profiling.stage(site, 'listings'):
+            for cars, done, failed in ListingQueueScraper().iter_batches(site, scraper, proxy_pool, headers_pool, limit=limit):
+                if cars:
+                    # Auto mohlo byť medzitým uložené z vyhľadávania
+                    df: pd.DataFrame = check_new_items.compare_details_with_db(cars)
+                    if not df.empty:
+                        write_output(df, site, 'db', '')
+                    result['inserted'] += len(df)
+                mark_listings(done, 'done')
+                mark_listings(failed, 'failed')
+                result['fetched'] += len(done)
+                result['failed'] += len(failed)
+    finally:
+        if own_proxy_pool:
+            close_proxy_pool(proxy_pool)
+    logger.info(f'Queued listings of {site}: {result["fetched"]} fetched, {result["inserted"]} inserted, {result["failed"]} failed')
+    return result
+
+
+def write_output(df: pd.DataFrame, site: str, output: str, output_dir: str):
+    """
+    Writes the data to the output, see export_data.
+    """
+    if output == 'db':
+        db_manager_settings: DatabaseManagerSettings = DatabaseManagerSettings()
+        db_manager_settings.ensure_columns(CarData.__table__)
+        if 'listing_id' not in df.columns and not df.empty:
+            # Neinkrementálny beh: autá už uložené (alebo opakované) dostanú len site, index dovolí jeden listing_id
+            df = add_listing_keys(df)
+            df.loc[~new_listing_mask(df), 'listing_id'] = None
+        db_manager_settings.insert_data(df=df, Model=CarData)
+        logger.info(f"Data was successfully inserted. {df.shape[0]} rows inserted.")
+    elif output == 'csv':
+        unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        df.to_csv(os.path.join(output_dir, f'{site}_data_{unique_suffix}.csv'), index=False, encoding='utf-8-sig')
+        logger.info('Data was successfully exported to csv')
+    elif output == 'xlsx':
+        unique_suffix: str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        df.to_excel(os.path.join(output_dir, f'{site}_data_{unique_suffix}.xlsx'))
+        logger.info('Data was successfully exported to xlsx')
+    elif output == 'stdout':
+        print(df.to_string())
+    elif output != 'none':
+        raise ValueError(f'Unknown output: {output}')
@@ -0,0 +1,290 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from config import load_env
+from logs import logger
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_MAIN = os.getenv('LOG_DIR_MAIN')
+
+# Create logger object
+logger = logger.get_logger(log_file=LOG_DIR_MAIN, name='main')
+
+PROFILERS: tuple = ('cprofile', 'pyinstrument')
+
+# Number of lines in the text reports
+TOP_FUNCTIONS: int = 60
+TOP_ALLOCATIONS: int = 25
+
+# Profiler of the running scrape (None if profiling is off), see RunProfiler.start
+_active = None
+
+
+class PageTrace:
+    def __init__(self, site: str, page: int) -> None:
+        """
+        Initializes the trace of one page: durations of its steps (fetch, parse) and values like bytes or cars.
+        """
+        self.site = site
+        self.page = page
+        self.thread = threading.current_thread().name
+        self.started_at = datetime.now()
+        self.spans: dict = {}
+        self.values: dict = {}
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Measures the duration of the block as the step `name` of the page.
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = round(time.perf_counter() - start, 6)
+
+    def set(self, **values):
+        """
+        Stores values describing the page (e.g. bytes=..., cars=...).
+        """
+        self.values.update(values)
+
+    def to_dict(self):
+        return {
+            'site': self.site,
+            'page': self.page,
+            'thread': self.thread,
+            'started_at': self.started_at.isoformat(timespec='milliseconds'),
+            'seconds': self.spans,
+            **self.values,
+        }
+
+
+class NullPageTrace:
+    """Trace of a page that is not sampled, records nothing."""
+
+    @contextmanager
+    def span(self, name: str):
+        yield
+
+    def set(self, **values):
+        pass
+
+
+NULL_PAGE_TRACE = NullPageTrace()
+
+
+class RunProfiler:
+    def __init__(self, profiler: str = 'cprofile', memory: bool = True, page_sample: int = 10, output_dir: str = None) -> None:
+        """
+        Initializes the profiler of one scrape run.
+
+        The whole run is profiled by cProfile (on Python 3.12+ it also sees the fetch threads) or by pyinstrument
+        if it is installed (only the main thread). With `memory`, tracemalloc takes a snapshot after every stage
+        of the pipeline (scrape, dedup, export, ...). Every `page_sample`-th page gets a trace with the duration of
+        its fetch and parse, the size of the page and the number of cars.
+
+        Args:
+            profiler (str): 'cprofile' or 'pyinstrument'.
+            memory (bool): Take tracemalloc snapshots after the stages.
+            page_sample (int): Trace every n-th page, 0 turns the page traces off.
+            output_dir (str, optional): The directory of the reports, by default profiles/<timestamp> next to the logs.
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler: {profiler}')
+        self.profiler_name = profiler
+        self.memory = memory
+        self.page_sample = page_sample
+        self.output_dir = output_dir or default_output_dir()
+        self.profiler = None
+        self.lock = threading.Lock()
+        self.pages_seen: int = 0
+        self.page_traces: list = []
+        self.stages: list = []
+        self.previous_snapshot = None
+        self.tracing_started: bool = False
+        self.started_at = None
+        self.start_time = None
+
+    def start(self):
+        """
+        Starts profiling and makes this profiler the active one for pipeline hooks (stage, trace_page).
+
+        Returns:
+            RunProfiler: The profiler itself.
+        """
+        global _active
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.profiler_name == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+                self.profiler = Profiler()
+            except ImportError:
+                logger.warning('pyinstrument is not installed, using cProfile')
+                self.profiler_name = 'cprofile'
+        if self.profiler_name == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing_started = True
+            self.previous_snapshot = take_snapshot()
+        self.started_at = datetime.now()
+        self.start_time = time.perf_counter()
+        _active = self
+        logger.info(f'Profiling the run ({self.profiler_name}) into {self.output_dir}')
+        return self
+
+    def stop(self):
+        """
+        Stops profiling and writes the reports into the output directory.
+        """
+        global _active
+        _active = None
+        if self.profiler_name == 'cprofile':
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.join(self.output_dir, 'profile.prof'))
+            report = io.StringIO()
+            pstats.Stats(self.profiler, stream=report).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            self.write_text('profile.txt', report.getvalue())
+        else:
+            self.profiler.stop()
+            self.write_text('profile.html', self.profiler.output_html())
+            self.write_text('profile.txt', self.profiler.output_text(unicode=True))
+
+        if self.tracing_started:
+            tracemalloc.stop()
+            self.tracing_started = False
+        if self.page_traces:
+            with open(os.path.join(self.output_dir, 'pages.jsonl'), 'w', encoding='utf-8') as file:
+                for trace in self.page_traces:
+                    file.write(json.dumps(trace, ensure_ascii=False) + '\n')
+
+        summary: dict = {
+            'profiler': self.profiler_name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self.start_time, 3),
+            'stages': self.stages,
+            'pages_seen': self.pages_seen,
+            'pages_traced': len(self.page_traces),
+        }
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w', encoding='utf-8') as file:
+            json.dump(summary, file, indent=2, ensure_ascii=False)
+        logger.info(f'Profile written to {self.output_dir}')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+
+    def write_text(self, name: str, text: str):
+        with open(os.path.join(self.output_dir, name), 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    def end_stage(self, site: str, name: str, seconds: float):
+        """
+        Records a finished stage and, with memory profiling, the allocations that grew most during it.
+        """
+        stage: dict = {'site': site, 'stage': name, 'seconds': round(seconds, 6)}
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            stage.update(memory_current_kb=round(current / 1024, 1), memory_peak_kb=round(peak / 1024, 1))
+            with self.lock:
+                number: int = len(self.stages) + 1
+                statistics: list = snapshot.compare_to(self.previous_snapshot, 'lineno')
+                self.previous_snapshot = snapshot
+            lines: list = [f'Stage {name} of {site}: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB', '']
+            lines.extend(str(statistic) for statistic in statistics[:TOP_ALLOCATIONS])
+            self.write_text(f'memory_{number:02d}_{site}_{name}.txt', '\n'.join(lines) + '\n')
+            tracemalloc.reset_peak()
+        with self.lock:
+            self.stages.append(stage)
+
+    def sample_page(self):
+        """
+        Returns True for every `page_sample`-th page (the first page is always traced).
+        """
+        if not self.page_sample:
+            return False
+        with self.lock:
+            self.pages_seen += 1
+            return (self.pages_seen - 1) % self.page_sample == 0
+
+    def add_page_trace(self, trace: PageTrace):
+        with self.lock:
+            self.page_traces.append(trace.to_dict())
+
+
+def take_snapshot():
+    """
+    Returns a tracemalloc snapshot without the allocations of tracemalloc and of the import system.
+    """
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+
+
+def default_output_dir():
+    """
+    Returns profiles/<timestamp> in the directory of the log files (LOG_DIR_MAIN), or in the working directory.
+    """
+    log_file: str = os.getenv('LOG_DIR_MAIN') or os.getenv('LOG_DIR_SCRAPING') or ''
+    return os.path.join(os.path.dirname(log_file), 'profiles', datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+
+
+@contextmanager
+def stage(site: str, name: str):
+    """
+    Marks a stage of the pipeline for the active profiler; does nothing when profiling is off.
+
+    Example:
+        with profiling.stage('sauto', 'dedup'):
+            df = CheckNewItems().compare_details_with_db(list_cars_details)
+    """
+    profiler: RunProfiler = _active
+    if profiler is None:
+        yield
+        return
+    start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.end_stage(site, name, time.perf_counter() - start)
+
+
+@contextmanager
+def trace_page(site: str, page: int):
+    """
+    Yields the trace of the page if it is sampled by the active profiler, otherwise a trace that records nothing.
+
+    Example:
+        with profiling.trace_page(site, page) as trace:
+            with trace.span('fetch'):
+                response = scraper.fetch_page(base_url, page, proxy, headers)
+    """
+    profiler: RunProfiler = _active
+    if profiler is None or not profiler.sample_page():
+        yield NULL_PAGE_TRACE
+        return
+    trace: PageTrace = PageTrace(site, page)
+    try:
+        yield trace
+    finally:
+        profiler.add_page_trace(trace)
@@ -1,27 +1,30 @@
-import logging
 import requests
 import random
-import pandas as pd
 import os
 import csv
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime
 from io import StringIO
-from bs4 import BeautifulSoup
 from logs import logger
-from dotenv import load_dotenv
+from metrics import metrics
 from rich import print
-from config import load_settings
-from db import DatabaseManagerSettings, ProxySettings
+from config import load_env, get_settings, get_db_settings
 
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (once per process)
+load_env()
 
 # Load logger settings from .env file
 LOG_DIR_PROXIES = os.getenv('LOG_DIR_PROXIES')
 
 # Create logger object
-logger = logger.get_logger(log_file=LOG_DIR_PROXIES, log_level=logging.INFO)
+logger = logger.get_logger(log_file=LOG_DIR_PROXIES, name='proxies')
+
+# Zdroje proxy pre ProxyHarvester
+HARVESTER_SOURCES: tuple = ('csv', 'proxyscrape', 'free_proxy_list')
 
 
 class ProxyScraper:
@@ -29,7 +32,7 @@ class ProxyScraper:
         """
         Initializes the ProxyScraper class.
         """
-        self.db_manager_settings = DatabaseManagerSettings()
+        pass
     
 
     # Function to get proxy list from csv file and return random sample
@@ -38,13 +41,11 @@ class ProxyScraper:
         Function to get proxy list from csv file and return random sample
         """
         try:
-            # Read number of proxies to use from database
-            proxy_settings: pd.DataFrame = self.db_manager_settings.read_data(ProxySettings)
-            number_of_proxies: int = proxy_settings['number_of_proxies'][0]
-            self.db_manager_settings.close_connection()
+            # Read number of proxies to use from database (cached)
+            number_of_proxies: int = get_db_settings().number_of_proxies
 
             # Check if proxy list file exists
-            proxy_list_file: str = load_settings()['proxy_settings']['proxy_list3']
+            proxy_list_file: str = get_settings().proxy['proxy_list3']
             if not os.path.isfile(proxy_list_file):
                 raise FileNotFoundError(f'Proxy list file not found: {proxy_list_file}')
 
@@ -77,7 +78,7 @@ class ProxyScraper:
         if proxies is None:
             raise ValueError('Proxy list is empty')
 
-        proxy_check_url: str = load_settings()['proxy_settings']['proxy_check_url']
+        proxy_check_url: str = get_settings().proxy['proxy_check_url']
         if proxy_check_url is None:
             raise ValueError('Proxy check URL is empty')
 
@@ -95,7 +96,7 @@ class ProxyScraper:
                     logger.error(f'Proxy {index} :: {proxy}  --  Null Response')
                 elif response.status_code == 200:
                     logger.info(f'Proxy {index} :: {proxy}  --  Available')
-                    available_proxies.append(response.json()["origin"])
+                    available_proxies.append(proxy)
                 else:
                     logger.info(f'Proxy {index} :: {proxy}  --  Not Available ({response.status_code})')
             except requests.exceptions.ConnectTimeout as e:
@@ -123,8 +124,8 @@ class ProxyScraper:
 
 
     # Function to get proxy list from API and return list of proxies
-    def get_proxy_list_from_api(self):
-        url: str = "https://api.proxyscrape.com/v3/free-proxy-list/get?request=getproxies&skip=0&proxy_format=protocolipport&format=json&limit=7"  # limit=20 = 20 proxies at once 
+    def get_proxy_list_from_api(self, limit: int = 7, timeout: float = None):
+        url: str = f"https://api.proxyscrape.com/v3/free-proxy-list/get?request=getproxies&protocol=http&skip=0&proxy_format=protocolipport&format=json&limit={limit}"  # limit=20 = 20 proxies at once 
 
         headers: dict = {
         'accept': 'application/json, text/plain, */*',
@@ -140,7 +141,7 @@ class ProxyScraper:
         'sec-fetch-site': 'same-site',
         'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
         }
-        response: requests.models.Response = requests.request("GET", url, headers=headers)
+        response: requests.models.Response = requests.request("GET", url, headers=headers, timeout=timeout)
         json_data: dict = response.json()
         start_point: list = json_data['proxies']
 
@@ -165,9 +166,12 @@ class FreeProxyList:
         pass
 
 
-    def get_free_proxy_list(self):
+    def get_free_proxy_list(self, timeout: float = None):
+        import pandas as pd
+        from bs4 import BeautifulSoup
+
         url = 'https://free-proxy-list.net'
-        response: requests.models.Response = requests.get(url)
+        response: requests.models.Response = requests.get(url, timeout=timeout)
         soup: BeautifulSoup = BeautifulSoup(response.text, 'html.parser')
         table: BeautifulSoup = soup.find('table')
 
@@ -186,7 +190,7 @@ class FreeProxyList:
                 response: requests.models.Response = requests.get(url, proxies={"http": proxy, "https": proxy})
                 if response.status_code == 200:
                     print(f'Num. {index} Available proxy: {proxy}')
-                    available_proxies.append(response.json()["origin"])
+                    available_proxies.append(proxy)
             except:
                 pass
                 # print(f'Proxy {index} is not available: {proxy}')
@@ -202,7 +206,340 @@ class FreeProxyList:
 
 
 
+# Formát proxy ip:port, voliteľne so schémou (http://ip:port)
+PROXY_PATTERN = re.compile(r'^(?:https?://)?(\d{1,3}(?:\.\d{1,3}){3}):(\d{1,5})/?$')
+
+
+def normalize_proxy(value):
+    """
+    Returns the proxy as ip:port, or None if the value is not an IPv4 proxy (e.g. http://1.2.3.4:80/ -> 1.2.3.4:80).
+    """
+    match = PROXY_PATTERN.match(str(value).strip().lower())
+    if match is None:
+        return None
+    ip, port = match.groups()
+    if any(int(part) > 255 for part in ip.split('.')) or not 0 < int(port) < 65536:
+        return None
+    return f'{ip}:{int(port)}'
+
+
+def read_proxy_csv(path: str):
+    """
+    Returns the proxies from the first column of a CSV file.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return [row[0] for row in csv.reader(file) if row]
+
 
+class ProxyHarvester:
+    def __init__(self, sources: list = None, source_timeout: float = None, check_workers: int = None, check_timeout: float = None, check_url: str = None) -> None:
+        """
+        Initializes the harvester which collects proxies from all sources at once and checks them as they arrive.
 
+        The defaults are taken from proxy_settings.harvester in the settings file.
 
+        Args:
+            sources (list, optional): The sources to use: 'csv' (the proxy_list* files), 'proxyscrape' (API)
+                and 'free_proxy_list' (free-proxy-list.net).
+            source_timeout (float, optional): Seconds to wait for one source.
+            check_workers (int, optional): The number of proxies checked at the same time.
+            check_timeout (float, optional): Seconds to wait for the answer of one checked proxy.
+            check_url (str, optional): The URL requested through the checked proxies (proxy_settings.proxy_check_url).
+        """
+        proxy_settings: dict = get_settings().proxy
+        harvester_settings: dict = proxy_settings.get('harvester', {})
+        self.sources: list = sources or harvester_settings.get('sources', list(HARVESTER_SOURCES))
+        self.source_timeout: float = source_timeout or harvester_settings.get('source_timeout_seconds', 10)
+        self.api_limit: int = harvester_settings.get('api_limit', 100)
+        self.check_workers: int = check_workers or harvester_settings.get('check_workers', 32)
+        self.check_timeout: float = check_timeout or harvester_settings.get('check_timeout_seconds', 3)
+        self.check_url: str = check_url or proxy_settings['proxy_check_url']
+        self.csv_files: list = [value for key, value in sorted(proxy_settings.items()) if key.startswith('proxy_list')]
+        self.latencies: dict = {}  # Proxy -> čas odpovede pri poslednej kontrole
+        unknown: set = set(self.sources) - set(HARVESTER_SOURCES)
+        if unknown:
+            raise ValueError(f'Unknown proxy sources: {", ".join(sorted(unknown))}')
+
+    def fetch_source(self, source: str):
+        """
+        Returns the normalized proxies of one source, or an empty list if the source failed.
+        """
+        start_time = datetime.now()
+        try:
+            if source == 'csv':
+                proxies: list = []
+                for path in self.csv_files:
+                    if os.path.isfile(path):
+                        proxies.extend(read_proxy_csv(path))
+            elif source == 'proxyscrape':
+                proxies = ProxyScraper().get_proxy_list_from_api(limit=self.api_limit, timeout=self.source_timeout)
+            else:
+                proxies = FreeProxyList().get_free_proxy_list(timeout=self.source_timeout)
+        except Exception as e:
+            logger.error(f'Proxy source {source} failed: {e}')
+            return []
+        normalized: list = [proxy for proxy in map(normalize_proxy, proxies) if proxy is not None]
+        logger.info(f'Proxy source {source}: {len(normalized)} proxies in {datetime.now() - start_time}')
+        return normalized
 
+    def harvest(self):
+        """
+        Returns the unique proxies (ip:port) of all sources, fetched at the same time.
+
+        Returns:
+            list: The proxies in the order the sources finished.
+        """
+        with ThreadPoolExecutor(max_workers=len(self.sources)) as executor:
+            futures: list = [executor.submit(self.fetch_source, source) for source in self.sources]
+            return list(dict.fromkeys(proxy for future in as_completed(futures) for proxy in future.result()))
+
+    def check_proxy(self, proxy: str):
+        """
+        Requests the check URL through the proxy.
+
+        Returns:
+            float or None: The response time in seconds, or None if the proxy does not work.
+        """
+        start_time: float = time.perf_counter()
+        try:
+            response: requests.models.Response = requests.get(self.check_url, proxies={"http": proxy, "https": proxy}, timeout=self.check_timeout)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return time.perf_counter() - start_time
+
+    def harvest_healthy(self, limit: int = None, exclude: set = frozenset()):
+        """
+        Yields working proxies as soon as they pass the check.
+
+        The candidates of every source go to the checker the moment the source finishes, so the first
+        working proxies are available before the slow sources answer. Duplicates (same ip:port from several
+        sources) are checked only once.
+
+        Args:
+            limit (int, optional): Stop after this many working proxies.
+            exclude (set): Proxies not to check (e.g. already in the pool).
+
+        Yields:
+            str: A working proxy as ip:port (its response time is in `latencies`).
+        """
+        seen: set = set(exclude)
+        found: int = 0
+        source_executor = ThreadPoolExecutor(max_workers=len(self.sources))
+        check_executor = ThreadPoolExecutor(max_workers=self.check_workers)
+        try:
+            source_futures: set = {source_executor.submit(self.fetch_source, source) for source in self.sources}
+            check_futures: dict = {}
+            pending: set = set(source_futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in source_futures:
+                        for proxy in future.result():
+                            if proxy not in seen:
+                                seen.add(proxy)
+                                check_future = check_executor.submit(self.check_proxy, proxy)
+                                check_futures[check_future] = proxy
+                                pending.add(check_future)
+                        continue
+                    proxy: str = check_futures.pop(future)
+                    latency: float = future.result()
+                    if latency is None:
+                        continue
+                    self.latencies[proxy] = latency
+                    found += 1
+                    yield proxy
+                    if limit is not None and found >= limit:
+                        return
+        finally:
+            source_executor.shutdown(wait=False, cancel_futures=True)
+            check_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ProxyPool:
+    def __init__(self, proxies: list = (), target_size: int = None, max_failures: int = None, quarantine_seconds: float = None, wait_seconds: float = 0) -> None:
+        """
+        Initializes the thread-safe pool of proxies used by the fetch workers.
+
+        The pool is an endless iterator like itertools.cycle, but a proxy failing `max_failures` times in a row
+        is moved to quarantine and not served until a ProxyPoolRefresher checks it again.
+        The defaults are taken from proxy_settings.pool in the settings file.
+
+        Args:
+            proxies (list): The initial working proxies (ip:port).
+            target_size (int, optional): The number of working proxies the refresher keeps in the pool.
+            max_failures (int, optional): Failures in a row after which a proxy is quarantined.
+            quarantine_seconds (float, optional): Seconds before a quarantined proxy is checked again.
+            wait_seconds (float): How long `next()` waits for a working proxy when the pool is empty.
+        """
+        pool_settings: dict = get_settings().proxy.get('pool', {})
+        self.target_size: int = target_size or len(proxies)
+        self.max_failures: int = max_failures or pool_settings.get('max_failures', 3)
+        self.quarantine_seconds: float = quarantine_seconds or pool_settings.get('quarantine_seconds', 300)
+        self.wait_seconds: float = wait_seconds
+        self.condition = threading.Condition()
+        self.healthy: list = []
+        self.failures: dict = {}
+        self.quarantine: dict = {}  # Proxy -> (čas karantény, počet neúspešných kontrol)
+        self.position: int = 0
+        self.refresher = None
+        self.add(proxies)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        proxy: str = self.get(self.wait_seconds)
+        if proxy is None:
+            raise StopIteration
+        return proxy
+
+    def get(self, timeout: float = 0):
+        """
+        Returns the next working proxy (round-robin), waiting up to `timeout` seconds if there is none.
+
+        Returns:
+            str or None: The proxy, or None if no working proxy appeared in time.
+        """
+        with self.condition:
+            if not self.healthy and timeout:
+                self.condition.wait_for(lambda: self.healthy, timeout)
+            if not self.healthy:
+                return None
+            self.position = (self.position + 1) % len(self.healthy)
+            return self.healthy[self.position]
+
+    def add(self, proxies: list):
+        """
+        Adds working proxies to the pool (also takes them out of quarantine).
+
+        Returns:
+            int: The number of proxies that were not yet in the pool.
+        """
+        added: int = 0
+        with self.condition:
+            for proxy in proxies:
+                self.quarantine.pop(proxy, None)
+                if proxy not in self.healthy:
+                    self.healthy.append(proxy)
+                    self.failures[proxy] = 0
+                    added += 1
+            if added:
+                self.condition.notify_all()
+        return added
+
+    def report(self, proxy: str, ok: bool):
+        """
+        Records the result of a request through the proxy; quarantines it after `max_failures` failures in a row.
+        """
+        with self.condition:
+            if proxy not in self.failures:
+                return
+            if ok:
+                self.failures[proxy] = 0
+                return
+            self.failures[proxy] += 1
+            if self.failures[proxy] >= self.max_failures and proxy in self.healthy:
+                self.healthy.remove(proxy)
+                self.quarantine[proxy] = (time.monotonic(), 0)
+                logger.info(f'Proxy {proxy} quarantined after {self.failures[proxy]} failures, {len(self.healthy)} proxies left')
+                metrics.inc('proxy_quarantined_total')
+
+    def due_for_recheck(self):
+        """
+        Returns the quarantined proxies whose quarantine is over.
+        """
+        now: float = time.monotonic()
+        with self.condition:
+            return [proxy for proxy, (since, _) in self.quarantine.items() if now - since >= self.quarantine_seconds]
+
+    def recheck_failed(self, proxy: str, max_rechecks: int):
+        """
+        Keeps the proxy in quarantine after a failed check, or drops it after `max_rechecks` failed checks.
+        """
+        with self.condition:
+            if proxy not in self.quarantine:
+                return
+            rechecks: int = self.quarantine[proxy][1] + 1
+            if rechecks >= max_rechecks:
+                del self.quarantine[proxy]
+                del self.failures[proxy]
+            else:
+                self.quarantine[proxy] = (time.monotonic(), rechecks)
+
+    def known(self):
+        """
+        Returns all proxies of the pool, working and quarantined.
+        """
+        with self.condition:
+            return set(self.healthy) | set(self.quarantine)
+
+    def stats(self):
+        with self.condition:
+            return {'healthy': len(self.healthy), 'quarantined': len(self.quarantine), 'target': self.target_size}
+
+    def close(self):
+        """
+        Stops the refresher of the pool, if any.
+        """
+        if self.refresher is not None:
+            self.refresher.stop()
+            self.refresher = None
+
+
+class ProxyPoolRefresher(threading.Thread):
+    def __init__(self, pool: ProxyPool, harvester: 'ProxyHarvester' = None, interval: float = None, max_rechecks: int = None) -> None:
+        """
+        Initializes the background thread which keeps the pool at its target size during long crawls.
+
+        Every `interval` seconds it checks the proxies whose quarantine is over (working ones return to the pool,
+        others stay in quarantine or are dropped after `max_rechecks` checks) and, if the pool is still below
+        its target size, harvests and checks new proxies. The fetch workers are never blocked by the checks.
+
+        Args:
+            pool (ProxyPool): The pool to refresh.
+            harvester (ProxyHarvester, optional): The source of new proxies and their checker.
+            interval (float, optional): Seconds between refreshes (proxy_settings.pool.refresh_interval_seconds).
+            max_rechecks (int, optional): Failed checks after which a quarantined proxy is dropped.
+        """
+        super().__init__(name='proxy-pool-refresher', daemon=True)
+        pool_settings: dict = get_settings().proxy.get('pool', {})
+        self.pool = pool
+        self.harvester = harvester or ProxyHarvester()
+        self.interval: float = interval or pool_settings.get('refresh_interval_seconds', 60)
+        self.max_rechecks: int = max_rechecks or pool_settings.get('max_rechecks', 3)
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f'Proxy pool refresh failed: {e}')
+
+    def refresh(self):
+        """
+        Rechecks the quarantined proxies and tops the pool up with new ones.
+        """
+        due: list = self.pool.due_for_recheck()
+        if due:
+            with ThreadPoolExecutor(max_workers=min(len(due), self.harvester.check_workers)) as executor:
+                for proxy, latency in zip(due, executor.map(self.harvester.check_proxy, due)):
+                    if latency is not None:
+                        self.pool.add([proxy])
+                        metrics.inc('proxy_restored_total')
+                    else:
+                        self.pool.recheck_failed(proxy, self.max_rechecks)
+
+        missing: int = self.pool.target_size - self.pool.stats()['healthy']
+        if missing > 0 and not self.stop_event.is_set():
+            for proxy in self.harvester.harvest_healthy(limit=missing, exclude=self.pool.known()):
+                self.pool.add([proxy])
+                metrics.inc('proxy_harvested_total')
+                if self.stop_event.is_set():
+                    break
+        logger.info(f'Proxy pool refreshed: {self.pool.stats()}')
+
+    def stop(self):
+        self.stop_event.set()
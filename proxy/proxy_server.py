@@ -1,94 +1,849 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
 import socket
-import ssl
-import threading
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+# Koreň projektu, aby skript spustený z priečinka proxy našiel moduly projektu (proxy.py, config.py)
+PROJECT_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+logger = logging.getLogger('proxy_server')
+
+HEADER_END: bytes = b'\r\n\r\n'
+MAX_HEADER_SIZE: int = 64 * 1024
+BUFFER_SIZE: int = 64 * 1024
+
+UPSTREAM_STRATEGIES: tuple = ('round_robin', 'latency')
+
+# Statusy, ktoré vracia upstream proxy, keď sama nefunguje
+PROXY_FAILURE_STATUSES: frozenset = frozenset((407, 502, 503, 504))
+
+# Hlavičky platné len pre jedno spojenie, neposielajú sa ďalej
+HOP_BY_HOP_HEADERS: frozenset = frozenset((
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer', 'upgrade',
+))
+
+
+class ProxyError(Exception):
+    def __init__(self, status: int, reason: str) -> None:
+        """
+        Error answered to the client with the given HTTP status (only before the response has started).
+        """
+        super().__init__(f'{status} {reason}')
+        self.status = status
+        self.reason = reason
+
+
+class ReadError(ConnectionError):
+    def __init__(self, connection: 'Connection', message: str) -> None:
+        """
+        Reading from the connection failed (reset, or closed in the middle of a message). A relay raises it
+        for the connection it reads from, so the side which failed can be told from the one it sends to.
+        """
+        super().__init__(message)
+        self.connection = connection
+
+
+class Connection:
+    def __init__(self, sock: socket.socket, key=None, timeout: float = None) -> None:
+        """
+        Wraps a non-blocking socket with a read buffer, for both the client and the upstream side.
+
+        Bodies and tunnels are relayed through one preallocated buffer per connection (`sock_recv_into`
+        and a memoryview of the received part), without creating new bytes objects for every chunk.
+
+        Args:
+            sock (socket.socket): The connected socket.
+            key (tuple, optional): The key of the upstream connection pool.
+            timeout (float, optional): Seconds one receive may wait for data, no limit if not given.
+        """
+        sock.setblocking(False)
+        self.sock = sock
+        self.loop = asyncio.get_running_loop()
+        self.buffer = bytearray()
+        self.scratch = memoryview(bytearray(BUFFER_SIZE))
+        self.key = key
+        self.timeout = timeout
+        self.received: int = 0
+        self.absolute_form: bool = False  # Send the absolute URL in the request line (the upstream is a proxy)
+        self.reused: bool = False
+        self.upstream = None  # Upstream proxy of the connection (RotatingProxyGateway)
+        self.idle_since: float = 0.0
+        self.closed: bool = False
+
+    async def receive(self, view: memoryview):
+        """
+        Receives data into the view. Returns the number of received bytes (0 when the peer closed).
+
+        Raises:
+            ReadError: If the socket failed or the peer sent nothing for `timeout` seconds.
+        """
+        try:
+            size: int = await asyncio.wait_for(self.loop.sock_recv_into(self.sock, view), self.timeout)
+        except asyncio.TimeoutError as e:
+            raise ReadError(self, f'No data for {self.timeout} seconds') from e
+        except OSError as e:
+            raise ReadError(self, f'Receiving failed: {e!r}') from e
+        self.received += size
+        return size
+
+    async def fill(self):
+        """
+        Receives more data into the read buffer. Returns the number of received bytes (0 when the peer closed).
+        """
+        size: int = await self.receive(self.scratch)
+        self.buffer += self.scratch[:size]
+        return size
+
+    async def read_until(self, separator: bytes, limit: int = MAX_HEADER_SIZE):
+        """
+        Returns the data up to and including the separator, or None if the peer closed before sending anything.
+        """
+        start: int = 0
+        while True:
+            end: int = self.buffer.find(separator, start)
+            if end != -1:
+                data: bytes = bytes(self.buffer[:end + len(separator)])
+                del self.buffer[:end + len(separator)]
+                return data
+            if len(self.buffer) > limit:
+                raise ProxyError(431, 'Request Header Fields Too Large')
+            start = max(0, len(self.buffer) - len(separator) + 1)
+            if await self.fill() == 0:
+                if self.buffer:
+                    raise ReadError(self, 'Connection closed in the middle of a message')
+                return None
+
+    async def send(self, data):
+        await self.loop.sock_sendall(self.sock, data)
+
+    async def relay_exact(self, target: 'Connection', length: int):
+        """
+        Relays exactly `length` bytes to the target connection.
+        """
+        if self.buffer:
+            part: int = min(len(self.buffer), length)
+            await target.send(self.buffer[:part])
+            del self.buffer[:part]
+            length -= part
+        while length > 0:
+            size: int = await self.receive(self.scratch[:min(length, BUFFER_SIZE)])
+            if size == 0:
+                raise ReadError(self, 'Connection closed before the end of the body')
+            await target.send(self.scratch[:size])
+            length -= size
+
+    async def relay_chunked(self, target: 'Connection'):
+        """
+        Relays a body in chunked transfer encoding, including the trailers.
+        """
+        while True:
+            line: bytes = await self.read_until(b'\r\n')
+            if line is None:
+                raise ReadError(self, 'Connection closed before the end of the body')
+            await target.send(line)
+            size: int = int(line.split(b';')[0].strip(), 16)
+            if size == 0:
+                while True:
+                    line = await self.read_until(b'\r\n')
+                    if line is None:
+                        raise ReadError(self, 'Connection closed in the trailers')
+                    await target.send(line)
+                    if line == b'\r\n':
+                        return
+            await self.relay_exact(target, size + 2)
+
+    async def relay_until_close(self, target: 'Connection'):
+        """
+        Relays everything until the peer closes its side, then closes the writing side of the target.
+        """
+        if self.buffer:
+            await target.send(self.buffer)
+            self.buffer.clear()
+        while True:
+            size: int = await self.receive(self.scratch)
+            if size == 0:
+                break
+            await target.send(self.scratch[:size])
+        try:
+            target.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
+
+def parse_head(head: bytes):
+    """
+    Splits the head of an HTTP message into the start line and a list of (name, value) headers.
+    """
+    lines: list = head.decode('latin-1').split('\r\n')
+    headers: list = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def header_tokens(headers: list, name: str):
+    """
+    Returns the lower-case comma separated values of all headers with the name (e.g. Connection: close).
+    """
+    return {token.strip().lower() for key, value in headers if key.lower() == name for token in value.split(',')}
+
+
+def header_value(headers: list, name: str):
+    return next((value for key, value in headers if key.lower() == name), None)
+
+
+def build_head(start_line: str, headers: list):
+    return (start_line + '\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers) + '\r\n').encode('latin-1')
+
 
 class ProxyServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, max_connections: int = 512, max_idle_per_host: int = 8, idle_timeout: float = 30.0,
+                 connect_timeout: float = 10.0, read_timeout: float = 60.0, tunnel_idle_timeout: float = 300.0, backlog: int = 128):
+        """
+        Initializes the forwarding HTTP proxy.
+
+        All clients are served by one asyncio event loop on non-blocking sockets. Plain HTTP requests
+        (absolute URL in the request line) are forwarded over kept-alive upstream connections, HTTPS goes
+        through CONNECT tunnels. Subclasses can change where upstream connections go by overriding
+        `open_upstream` (e.g. to an upstream proxy).
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+            max_connections (int): The maximum number of clients served at the same time, others wait in the backlog.
+            max_idle_per_host (int): The maximum number of idle kept-alive connections per upstream.
+            idle_timeout (float): Seconds after which an idle upstream connection is not reused.
+            connect_timeout (float): Seconds to wait for an upstream connection.
+            read_timeout (float): Seconds to wait for the head of a request or of a response, and for the next
+                data of a body being relayed; a stalled peer is disconnected and frees its slot.
+            tunnel_idle_timeout (float): Seconds after which a CONNECT tunnel with no data in either direction is closed.
+            backlog (int): The listen backlog of the server socket.
+        """
         self.server_host = host
         self.server_port = port
+        self.max_connections = max_connections
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tunnel_idle_timeout = tunnel_idle_timeout
+        self.backlog = backlog
+        self.idle_upstreams: dict = {}
+        self.tasks: set = set()
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.server_host, self.server_port))
+        self.server_port = self.server_socket.getsockname()[1]
 
     def listen_for_clients(self):
-        self.server_socket.listen(10)
+        """
+        Serves the clients until interrupted.
+        """
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """
+        Accepts the clients and serves each of them in its own task, at most `max_connections` at once.
+        """
+        loop = asyncio.get_running_loop()
+        self.server_socket.setblocking(False)
+        self.server_socket.listen(self.backlog)
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(self.max_connections)
         print(f"Proxy Server is listening on: {self.server_host}:{self.server_port}")
-        while True:
-            client_socket, client_address = self.server_socket.accept()
-            client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_address))
-            client_thread.start()
+        try:
+            while True:
+                await semaphore.acquire()
+                try:
+                    client_socket, client_address = await loop.sock_accept(self.server_socket)
+                except BaseException:
+                    semaphore.release()
+                    raise
+                task = loop.create_task(self.serve_client(client_socket, client_address, semaphore))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            self.close_idle_upstreams()
 
-    def handle_client(self, client_socket, client_address):
-        request = client_socket.recv(1024)
-        print(f"Received request from: {client_address}: {request.decode('utf-8')}")
+    async def serve_client(self, client_socket: socket.socket, client_address, semaphore: asyncio.Semaphore):
+        client: Connection = Connection(client_socket, timeout=self.read_timeout)
+        try:
+            await self.handle_client(client, client_address)
+        finally:
+            client.close()
+            semaphore.release()
 
-        # Rozparsovanie HTTP požiadavky a získanie cieľovej URL
-        first_line = request.decode('utf-8').split('\n')[0]
-        url = first_line.split(' ')[1]
+    async def handle_client(self, client: Connection, client_address):
+        """
+        Serves the requests of one client connection (several with keep-alive, or one CONNECT tunnel).
+        """
+        try:
+            while True:
+                head: bytes = await asyncio.wait_for(client.read_until(HEADER_END), self.read_timeout)
+                if head is None:
+                    return
+                request_line, headers = parse_head(head)
+                parts: list = request_line.split(' ')
+                if len(parts) != 3:
+                    raise ProxyError(400, 'Bad Request')
+                method, target, version = parts
+                logger.debug(f'{client_address[0]}: {method} {target}')
 
-        # Presmerovanie požiadavky
-        self.forward_request(request, client_socket, url)
+                if method == 'CONNECT':
+                    await self.tunnel(client, target)
+                    return
+                if not await self.forward_request(client, method, target, version, headers):
+                    return
+        except ProxyError as e:
+            logger.info(f'{client_address[0]}: {e}')
+            body: bytes = f'{e.status} {e.reason}\n'.encode()
+            try:
+                await client.send(build_head(f'HTTP/1.1 {e.status} {e.reason}', [
+                    ('Content-Type', 'text/plain'), ('Content-Length', str(len(body))), ('Connection', 'close'),
+                ]) + body)
+            except OSError:
+                pass
+        except (OSError, ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            logger.debug(f'{client_address[0]}: connection closed ({e!r})')
 
-    def forward_request(self, request, client_socket, url):
-        # Vytvorenie SSL kontextu
-        context = ssl.create_default_context()
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
+    async def tunnel(self, client: Connection, target: str):
+        """
+        Opens a CONNECT tunnel and relays the bytes in both directions until both sides close,
+        or until no data went through it for `tunnel_idle_timeout` seconds (checked every `tunnel_idle_timeout`).
+        """
+        host, port = self.get_host_port_from_url(target if '://' in target else f'//{target}', default_port=443)
+        try:
+            upstream: Connection = await self.open_upstream(host, port, tunnel=True)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ProxyError(502, 'Bad Gateway') from e
+        try:
+            await client.send(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+            # Jedna strana tunela môže dlho mlčať, kým druhá posiela, preto sa sleduje tunel ako celok
+            client.timeout = upstream.timeout = None
+            relays: list = [
+                asyncio.ensure_future(client.relay_until_close(upstream)),
+                asyncio.ensure_future(upstream.relay_until_close(client)),
+            ]
+            try:
+                received: int = -1
+                while True:
+                    done, pending = await asyncio.wait(relays, timeout=self.tunnel_idle_timeout, return_when=asyncio.FIRST_EXCEPTION)
+                    for relay in done:
+                        relay.result()
+                    if not pending:
+                        break
+                    if client.received + upstream.received == received:
+                        logger.debug(f'Tunnel to {host}:{port} idle for {self.tunnel_idle_timeout} seconds, closing')
+                        break
+                    received = client.received + upstream.received
+            finally:
+                for relay in relays:
+                    relay.cancel()
+        finally:
+            upstream.close()
 
-        # Vytvorenie socketu pre pripojenie k cieľovému serveru
-        target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        target_host, target_port = self.get_host_port_from_url(url)
+    async def forward_request(self, client: Connection, method: str, target: str, version: str, headers: list):
+        """
+        Forwards one plain HTTP request over a pooled upstream connection and relays the response.
 
-        # Obalenie socketu SSL kontextom, ak je to HTTPS požiadavka
-        if url.startswith('https://'):
-            target_socket = context.wrap_socket(target_socket, server_hostname=target_host)
+        Returns:
+            bool: True if the client connection can be used for the next request.
+        """
+        url = urlsplit(target)
+        if url.scheme != 'http' or not url.hostname:
+            # HTTPS goes through CONNECT, the proxy does not open TLS connections itself
+            raise ProxyError(400, 'Bad Request')
+        host, port = url.hostname, url.port or 80
+        path: str = (url.path or '/') + (f'?{url.query}' if url.query else '')
 
-        target_socket.connect((target_host, target_port))
-        target_socket.sendall(request)
+        client_tokens: set = header_tokens(headers, 'connection') | header_tokens(headers, 'proxy-connection')
+        client_keep_alive: bool = 'close' not in client_tokens and (version == 'HTTP/1.1' or 'keep-alive' in client_tokens)
+        content_length: str = header_value(headers, 'content-length')
+        chunked: bool = 'chunked' in header_tokens(headers, 'transfer-encoding')
+        has_body: bool = chunked or (content_length is not None and int(content_length) > 0)
 
-        # Prijatie odpovede od cieľového serveru
-        while True:
-            response = target_socket.recv(4096)
-            if not response:
+        upstream_headers: list = [(name, value) for name, value in headers if name.lower() not in HOP_BY_HOP_HEADERS]
+        if header_value(upstream_headers, 'host') is None:
+            upstream_headers.insert(0, ('Host', url.netloc))
+        upstream_headers.append(('Connection', 'keep-alive'))
+
+        upstream: Connection = await self.acquire_upstream(host, port)
+        for attempt in range(2):
+            request_target: str = target if upstream.absolute_form else path
+            start_time: float = time.perf_counter()
+            try:
+                await upstream.send(build_head(f'{method} {request_target} HTTP/1.1', upstream_headers))
+                if chunked:
+                    await client.relay_chunked(upstream)
+                elif has_body:
+                    await client.relay_exact(upstream, int(content_length))
+                response_head: bytes = await asyncio.wait_for(upstream.read_until(HEADER_END), self.read_timeout)
+                if response_head is None:
+                    raise ConnectionError('Upstream closed the connection')
                 break
-            client_socket.send(response)
+            except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                upstream.close()
+                # Klient prestal posielať telo požiadavky, upstream za to nemôže
+                if isinstance(e, ReadError) and e.connection is client:
+                    raise
+                # Kept-alive spojenie mohol server medzitým zavrieť, požiadavku bez tela skúsime znova
+                if attempt or not upstream.reused or has_body:
+                    self.upstream_failed(upstream, e)
+                    raise ProxyError(502, 'Bad Gateway') from e
+                upstream = await self.acquire_upstream(host, port, fresh=True)
 
-        # Zatvorenie socketov
-        target_socket.close()
-        client_socket.close()
+        try:
+            status_line, response_headers = parse_head(response_head)
+            response_version, status = status_line.split(' ')[0], int(status_line.split(' ')[1])
+        except (IndexError, ValueError) as e:
+            upstream.close()
+            self.upstream_failed(upstream, e)
+            raise ProxyError(502, 'Bad Gateway') from e
+        self.upstream_responded(upstream, status, time.perf_counter() - start_time)
 
-    def get_host_port_from_url(self, url):
-        # Predpokladáme, že URL začína s http:// alebo https://
-        http_pos = url.find("://")
-        if http_pos == -1:
-            temp = url
-        else:
-            temp = url[(http_pos+3):]
-
-        # Získanie portu, ak je uvedený, inak predvolený port
-        port_pos = temp.find(":")
-        server_pos = temp.find("/")
-        if server_pos == -1:
-            server_pos = len(temp)
-        webserver = ""
-        port = -1
-        if (port_pos == -1 or server_pos < port_pos):
-            port = 80
-            webserver = temp[:server_pos]
+        upstream_tokens: set = header_tokens(response_headers, 'connection')
+        response_chunked: bool = 'chunked' in header_tokens(response_headers, 'transfer-encoding')
+        response_length: str = header_value(response_headers, 'content-length')
+        no_body: bool = method == 'HEAD' or status in (204, 304) or 100 <= status < 200
+        framed: bool = no_body or response_chunked or response_length is not None
+        keep_alive: bool = client_keep_alive and framed
+
+        client_headers: list = [(name, value) for name, value in response_headers if name.lower() not in HOP_BY_HOP_HEADERS]
+        client_headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+        try:
+            await client.send(build_head(status_line, client_headers))
+            if no_body:
+                pass
+            elif response_chunked:
+                await upstream.relay_chunked(client)
+            elif response_length is not None:
+                await upstream.relay_exact(client, int(response_length))
+            else:
+                await upstream.relay_until_close(client)
+        except BaseException:
+            upstream.close()
+            raise
+
+        if framed and response_version == 'HTTP/1.1' and 'close' not in upstream_tokens and not upstream.buffer:
+            self.release_upstream(upstream)
         else:
-            port = int((temp[(port_pos+1):])[:server_pos-port_pos-1])
-            webserver = temp[:port_pos]
+            upstream.close()
+        return keep_alive
+
+    async def acquire_upstream(self, host: str, port: int, fresh: bool = False):
+        """
+        Returns an idle kept-alive connection to the upstream, or opens a new one.
+
+        Args:
+            host (str): The host of the requested URL.
+            port (int): The port of the requested URL.
+            fresh (bool): Always open a new connection.
+
+        Returns:
+            Connection: The upstream connection.
+        """
+        key: tuple = (host, port)
+        upstream: Connection = None if fresh else self.take_idle_upstream(key)
+        if upstream is not None:
+            return upstream
+        try:
+            upstream = await self.open_upstream(host, port, tunnel=False)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ProxyError(502, 'Bad Gateway') from e
+        upstream.key = key
+        return upstream
+
+    def take_idle_upstream(self, key: tuple):
+        """
+        Returns an idle connection from the pool under the key, or None. Connections idle for too long are closed.
+        """
+        idle: list = self.idle_upstreams.get(key, [])
+        now: float = time.monotonic()
+        while idle:
+            upstream: Connection = idle.pop()
+            if now - upstream.idle_since < self.idle_timeout:
+                upstream.reused = True
+                return upstream
+            upstream.close()
+        return None
 
-        return webserver, port
+    def release_upstream(self, upstream: Connection):
+        """
+        Returns the upstream connection to the pool of idle connections for reuse.
+        """
+        idle: list = self.idle_upstreams.setdefault(upstream.key, [])
+        if len(idle) >= self.max_idle_per_host:
+            upstream.close()
+            return
+        upstream.idle_since = time.monotonic()
+        idle.append(upstream)
+
+    def upstream_responded(self, upstream: Connection, status: int, seconds: float):
+        """
+        Called when the upstream answered a forwarded request, with the status and the time to the response head.
+        """
+
+    def upstream_failed(self, upstream: Connection, error: Exception):
+        """
+        Called when a forwarded request failed on the upstream connection.
+        """
+
+    def close_idle_upstreams(self):
+        for idle in self.idle_upstreams.values():
+            for upstream in idle:
+                upstream.close()
+        self.idle_upstreams.clear()
+
+    async def open_upstream(self, host: str, port: int, tunnel: bool):
+        """
+        Opens a connection to the origin server. Override to connect elsewhere (e.g. through an upstream proxy).
+
+        Args:
+            host (str): The host of the requested URL or CONNECT target.
+            port (int): The port of the requested URL or CONNECT target.
+            tunnel (bool): True for a CONNECT tunnel, False for forwarded HTTP requests.
+
+        Returns:
+            Connection: The new connection.
+        """
+        return await self.connect(host, port)
+
+    async def connect(self, host: str, port: int):
+        """
+        Opens a non-blocking TCP connection, trying all addresses of the host.
+        """
+        loop = asyncio.get_running_loop()
+        addresses: list = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        last_error: Exception = OSError(f'No address for {host}')
+        for family, type_, proto, _, address in addresses:
+            sock: socket.socket = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, address), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                last_error = e
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return Connection(sock, timeout=self.read_timeout)
+        raise last_error
+
+    def get_host_port_from_url(self, url, default_port: int = 80):
+        """
+        Returns the host and port of an URL (http://host:port/path) or of a CONNECT target (//host:port).
+        """
+        url = urlsplit(url)
+        if not url.hostname:
+            raise ProxyError(400, 'Bad Request')
+        return url.hostname, url.port or default_port
 
     def shutdown(self):
+        self.close_idle_upstreams()
         self.server_socket.close()
 
-if __name__ == "__main__":
-    host = '0.0.0.0'
-    port = 8080
-    proxy = ProxyServer(host, port)
+
+class Upstream:
+    def __init__(self, address: str) -> None:
+        """
+        Initializes the state of one upstream proxy (ip:port) of the gateway.
+        """
+        self.address = address
+        self.host, _, port = address.rpartition(':')
+        self.port = int(port)
+        self.latency: float = None  # EWMA času odpovede v sekundách
+        self.failures: int = 0  # Chyby za sebou
+        self.ejected_until: float = 0.0
+        self.requests: int = 0
+        self.errors: int = 0
+
+    def is_available(self, now: float):
+        return self.ejected_until <= now
+
+
+class UpstreamBalancer:
+    def __init__(self, proxies: list = (), strategy: str = 'round_robin', max_failures: int = 3, cooldown: float = 120.0, alpha: float = 0.3) -> None:
+        """
+        Chooses the upstream proxy for every request and ejects the failing ones for a cooldown.
+
+        Args:
+            proxies (list): The proxies as ip:port.
+            strategy (str): 'round_robin', or 'latency' (random choice weighted by 1 / EWMA of the response time).
+            max_failures (int): Failures in a row after which a proxy is ejected.
+            cooldown (float): Seconds an ejected proxy is not used; afterwards it gets one request to prove itself.
+            alpha (float): The weight of the newest response time in the EWMA.
+        """
+        if strategy not in UPSTREAM_STRATEGIES:
+            raise ValueError(f'Unknown strategy: {strategy}')
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.upstreams: dict = {}
+        self.position: int = 0
+        self.random = random.Random()
+        self.replace(proxies)
+
+    def replace(self, proxies: list):
+        """
+        Sets a new list of proxies, keeping the statistics of the proxies which stay.
+        """
+        self.upstreams = {address: self.upstreams.get(address) or Upstream(address) for address in dict.fromkeys(proxies)}
+
+    def choose(self, exclude: set = frozenset()):
+        """
+        Returns the upstream for the next request.
+
+        If all proxies are ejected, the one whose cooldown ends first is used.
+
+        Args:
+            exclude (set): Addresses not to choose (e.g. already failed for this request).
+
+        Returns:
+            Upstream: The chosen upstream, or None if there are no proxies.
+        """
+        now: float = time.monotonic()
+        upstreams: list = [upstream for upstream in self.upstreams.values() if upstream.address not in exclude]
+        if not upstreams:
+            return None
+        available: list = [upstream for upstream in upstreams if upstream.is_available(now)]
+        if not available:
+            return min(upstreams, key=lambda upstream: upstream.ejected_until)
+
+        if self.strategy == 'round_robin':
+            self.position = (self.position + 1) % len(available)
+            return available[self.position]
+
+        measured: list = [upstream.latency for upstream in available if upstream.latency is not None]
+        default_latency: float = sum(measured) / len(measured) if measured else 1.0
+        weights: list = [1 / max(upstream.latency if upstream.latency is not None else default_latency, 0.001) for upstream in available]
+        return self.random.choices(available, weights=weights)[0]
+
+    def report(self, upstream: Upstream, ok: bool, seconds: float = None):
+        """
+        Records the result of a request through the upstream.
+
+        Args:
+            upstream (Upstream): The upstream.
+            ok (bool): True if the proxy worked.
+            seconds (float, optional): The response time, added to the EWMA on success.
+        """
+        upstream.requests += 1
+        if ok:
+            upstream.failures = 0
+            upstream.ejected_until = 0.0
+            if seconds is not None:
+                upstream.latency = seconds if upstream.latency is None else self.alpha * seconds + (1 - self.alpha) * upstream.latency
+            return
+        upstream.errors += 1
+        upstream.failures += 1
+        if upstream.failures >= self.max_failures:
+            upstream.ejected_until = time.monotonic() + self.cooldown
+            logger.info(f'Upstream {upstream.address} ejected for {self.cooldown:.0f} s after {upstream.failures} failures')
+
+    def stats(self):
+        """
+        Returns the number of all and of currently usable proxies.
+        """
+        now: float = time.monotonic()
+        return {'proxies': len(self.upstreams), 'available': sum(upstream.is_available(now) for upstream in self.upstreams.values())}
+
+
+class RotatingProxyGateway(ProxyServer):
+    def __init__(self, host, port, proxies: list = None, strategy: str = 'round_robin', max_failures: int = 3, cooldown: float = 120.0,
+                 refresh_interval: float = 600.0, connect_attempts: int = 3, **kwargs):
+        """
+        Initializes the local gateway which sends every request through one of the checked upstream proxies.
+
+        The scraper workers use the gateway as their only proxy, so the proxies are loaded and checked once per host.
+        Plain HTTP requests are forwarded to the chosen proxy (kept-alive connections are pooled per proxy),
+        CONNECT tunnels are opened through it. Proxies failing `max_failures` times in a row are ejected for
+        `cooldown` seconds.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+            proxies (list, optional): The upstream proxies as ip:port. If not given, they are loaded and checked
+                by ProxyHarvester and reloaded every `refresh_interval` seconds.
+            strategy (str): 'round_robin' or 'latency', see UpstreamBalancer.
+            max_failures (int): Failures in a row after which a proxy is ejected.
+            cooldown (float): Seconds an ejected proxy is not used.
+            refresh_interval (float): Seconds between reloads of the proxies from ProxyHarvester, 0 to load them once.
+            connect_attempts (int): Proxies tried for one request before answering 502.
+            **kwargs: Options of ProxyServer (max_connections, ...).
+        """
+        super().__init__(host, port, **kwargs)
+        self.load_from_scraper: bool = proxies is None
+        self.balancer = UpstreamBalancer(proxies or [], strategy, max_failures, cooldown)
+        self.refresh_interval = refresh_interval
+        self.connect_attempts = connect_attempts
+
+    async def serve(self):
+        refresher = None
+        if self.load_from_scraper:
+            await self.refresh_proxies()
+            if self.refresh_interval:
+                refresher = asyncio.ensure_future(self.refresh_periodically())
+        try:
+            await super().serve()
+        finally:
+            if refresher is not None:
+                refresher.cancel()
+
+    async def refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh_proxies()
+
+    async def refresh_proxies(self):
+        """
+        Collects and checks the proxies with ProxyHarvester in a worker thread, without blocking the clients.
+        """
+        try:
+            proxies: list = await asyncio.get_running_loop().run_in_executor(None, load_checked_proxies)
+        except Exception as e:
+            logger.error(f'Failed to load proxies: {e}')
+            return
+        if proxies:
+            self.balancer.replace(proxies)
+        logger.info(f'Upstream proxies: {self.balancer.stats()}')
+
+    async def acquire_upstream(self, host: str, port: int, fresh: bool = False):
+        # Proxy sa vyberá pre každú požiadavku, kept-alive spojenia sa držia pre každú proxy zvlášť
+        upstream: Upstream = self.balancer.choose()
+        if upstream is None:
+            raise ProxyError(503, 'No Upstream Proxy Available')
+        if not fresh:
+            connection: Connection = self.take_idle_upstream(('proxy', upstream.address))
+            if connection is not None:
+                return connection
+        try:
+            return await self.open_upstream(host, port, tunnel=False, first_choice=upstream)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ProxyError(502, 'Bad Gateway') from e
+
+    async def open_upstream(self, host: str, port: int, tunnel: bool, first_choice: Upstream = None):
+        """
+        Connects to an upstream proxy, trying up to `connect_attempts` proxies. For a tunnel, the proxy is asked
+        to CONNECT to host:port; otherwise the connection forwards requests with absolute URLs.
+        """
+        tried: set = set()
+        last_error: Exception = OSError('No upstream proxy available')
+        for _ in range(self.connect_attempts):
+            upstream: Upstream = first_choice if first_choice is not None and not tried else self.balancer.choose(exclude=tried)
+            if upstream is None:
+                break
+            tried.add(upstream.address)
+            start_time: float = time.perf_counter()
+            try:
+                connection: Connection = await self.connect(upstream.host, upstream.port)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.balancer.report(upstream, ok=False)
+                last_error = e
+                continue
+            connection.upstream = upstream
+            if not tunnel:
+                connection.absolute_form = True
+                connection.key = ('proxy', upstream.address)
+                return connection
+            try:
+                await connection.send(f'CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n'.encode('latin-1'))
+                head: bytes = await asyncio.wait_for(connection.read_until(HEADER_END), self.read_timeout)
+                status_line: str = parse_head(head)[0] if head else ''
+                if status_line.split(' ')[1:2] != ['200']:
+                    raise ConnectionError(f'CONNECT refused: {status_line or "no answer"}')
+            except (OSError, ConnectionError, asyncio.TimeoutError, ProxyError) as e:
+                connection.close()
+                self.balancer.report(upstream, ok=False)
+                last_error = OSError(str(e))
+                continue
+            self.balancer.report(upstream, ok=True, seconds=time.perf_counter() - start_time)
+            return connection
+        raise last_error
+
+    def upstream_responded(self, upstream: Connection, status: int, seconds: float):
+        # 407, 502, 503 a 504 vracia väčšinou samotná proxy, nie cieľový server
+        proxy: Upstream = upstream.upstream
+        if proxy is not None:
+            self.balancer.report(proxy, ok=status not in PROXY_FAILURE_STATUSES, seconds=seconds)
+
+    def upstream_failed(self, upstream: Connection, error: Exception):
+        proxy: Upstream = upstream.upstream
+        if proxy is not None:
+            self.balancer.report(proxy, ok=False)
+
+
+def load_checked_proxies():
+    """
+    Returns up to proxy_settings.gateway.max_proxies working proxies (ip:port) collected by ProxyHarvester
+    from all proxy sources.
+    """
+    from proxy import ProxyHarvester
+
+    return list(ProxyHarvester().harvest_healthy(limit=get_gateway_settings().get('max_proxies', 50)))
+
+
+def get_gateway_settings():
+    """
+    Returns proxy_settings.gateway from the settings file, or an empty dict if the file is not available.
+    """
+    try:
+        from config import get_settings
+        return get_settings().proxy.get('gateway', {})
+    except (ImportError, FileNotFoundError, ValueError):
+        return {}
+
+
+def main(argv: list = None):
+    gateway_settings: dict = get_gateway_settings()
+    parser = argparse.ArgumentParser(description='Forwarding HTTP proxy with CONNECT tunnels and kept-alive upstream connections.')
+    parser.add_argument('--host', default=gateway_settings.get('host', '0.0.0.0'), help='Address to listen on (default: 0.0.0.0).')
+    parser.add_argument('--port', type=int, default=gateway_settings.get('port', 8080), help='Port to listen on (default: 8080).')
+    parser.add_argument('--max-connections', type=int, default=512, help='Clients served at the same time (default: 512).')
+    parser.add_argument('--max-idle-per-host', type=int, default=8, help='Idle kept-alive connections per upstream (default: 8).')
+    parser.add_argument('--gateway', action='store_true', help='Send the requests through the checked proxies of ProxyHarvester (rotating gateway).')
+    parser.add_argument('--proxies', nargs='+', help='Upstream proxies (ip:port) of the gateway instead of the harvested ones.')
+    parser.add_argument('--strategy', choices=UPSTREAM_STRATEGIES, default=gateway_settings.get('strategy', 'round_robin'), help='Choice of the upstream proxy.')
+    parser.add_argument('--max-failures', type=int, default=gateway_settings.get('max_failures', 3), help='Failures in a row before a proxy is ejected.')
+    parser.add_argument('--cooldown', type=float, default=gateway_settings.get('cooldown_seconds', 120), help='Seconds an ejected proxy is not used.')
+    parser.add_argument('--refresh-interval', type=float, default=gateway_settings.get('refresh_interval_seconds', 600), help='Seconds between reloads of the proxy list.')
+    parser.add_argument('--read-timeout', type=float, default=gateway_settings.get('read_timeout_seconds', 60), help='Seconds a peer may send nothing in a message (default: 60).')
+    parser.add_argument('--tunnel-idle-timeout', type=float, default=gateway_settings.get('tunnel_idle_timeout_seconds', 300), help='Seconds after which an idle CONNECT tunnel is closed (default: 300).')
+    parser.add_argument('--log-level', default='INFO', help='Logging level (default: INFO).')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.gateway or args.proxies:
+        proxy = RotatingProxyGateway(
+            args.host, args.port, proxies=args.proxies, strategy=args.strategy, max_failures=args.max_failures,
+            cooldown=args.cooldown, refresh_interval=args.refresh_interval,
+            max_connections=args.max_connections, max_idle_per_host=args.max_idle_per_host,
+            read_timeout=args.read_timeout, tunnel_idle_timeout=args.tunnel_idle_timeout,
+        )
+    else:
+        proxy = ProxyServer(args.host, args.port, max_connections=args.max_connections, max_idle_per_host=args.max_idle_per_host,
+                            read_timeout=args.read_timeout, tunnel_idle_timeout=args.tunnel_idle_timeout)
     try:
         proxy.listen_for_clients()
     except KeyboardInterrupt:
         proxy.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import math
+import sys
+from datetime import date, datetime
+import pandas as pd
+
+
+# Columns of a scraped car, in the order of CarData
+CAR_COLUMNS: tuple = ('znacka', 'model', 'rok', 'km', 'palivo', 'prevodovka', 'vykon_motora', 'objem_motora', 'cena', 'url', 'krajina', 'datum_pridania')
+
+# Columns with a few hundred distinct values repeated in every car (the dimension tables of dimensions.py)
+CATEGORICAL_COLUMNS: tuple = ('znacka', 'model', 'palivo', 'prevodovka', 'krajina')
+
+
+def missing_value(value):
+    """
+    Returns True for a value the parsers use for a missing column (None, NaN or an empty string).
+    """
+    return value is None or value == '' or (isinstance(value, float) and math.isnan(value))
+
+
+class CarBatch:
+    __slots__ = ('columns', 'run_date')
+
+    def __init__(self, run_date: date = None) -> None:
+        """
+        Initializes an empty batch of scraped cars stored column by column (one list per column).
+
+        The parsers return one dict of column lists per page; the batch appends them to its own lists instead of
+        turning every car into a dict (edit_list_cars_details), so a car costs one list slot per column. The values
+        of CATEGORICAL_COLUMNS are interned, the thousands of 'Škoda' strings of a crawl are one object.
+        Missing values (np.nan, '') are stored as None. The date of all cars is the date of the run, taken once.
+
+        Args:
+            run_date (date, optional): The datum_pridania of the cars, today if not given.
+        """
+        self.columns: dict = {column: [] for column in CAR_COLUMNS if column != 'datum_pridania'}
+        self.run_date: date = run_date or datetime.now().date()
+
+    def extend(self, page: dict):
+        """
+        Appends the cars of a parsed page (a dict of column lists, see Scraper.parse_page); its datum_pridania
+        is ignored.
+        """
+        for column, values in self.columns.items():
+            if column in CATEGORICAL_COLUMNS:
+                values.extend(None if missing_value(value) else sys.intern(str(value)) for value in page[column])
+            else:
+                values.extend(None if missing_value(value) else value for value in page[column])
+
+    def __len__(self):
+        return len(self.columns['url'])
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def to_frame(self):
+        """
+        Returns the cars as a DataFrame with the columns of CAR_COLUMNS: CATEGORICAL_COLUMNS with the pandas
+        category dtype, the other text columns as objects with None for a missing value.
+
+        Returns:
+            pd.DataFrame: The cars.
+        """
+        data: dict = {
+            column: pd.Categorical(values) if column in CATEGORICAL_COLUMNS else pd.Series(values, dtype=object)
+            for column, values in self.columns.items()
+        }
+        data['datum_pridania'] = pd.Series([self.run_date] * len(self), dtype=object)
+        return pd.DataFrame(data, columns=list(CAR_COLUMNS))
@@ -1,33 +1,87 @@
+import codecs
 from datetime import datetime
+import hashlib
+from html.parser import HTMLParser
+import json
+import math
+import re
+import threading
 import time
 import traceback
-from typing import Iterator
 from bs4 import BeautifulSoup
 import requests
 import pandas as pd
 import numpy as np
-import logging
 from db import DatabaseManagerSettings, CarData
-from itertools import cycle
-from proxy import ProxyScraper
+from listings import add_listing_keys, new_listing_mask, ensure_listing_ids
 from logs import logger
-from dotenv import load_dotenv
+from config import load_env, get_settings
+from metrics import metrics
+from records import CarBatch
 import os
 from rich import print
-from config import load_settings
 
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (once per process)
+load_env()
 
 # Load logger settings from .env file
 LOG_DIR_SCRAPING = os.getenv('LOG_DIR_SCRAPING')
 
 # Create logger object
-logger = logger.get_logger(log_file=LOG_DIR_SCRAPING, log_level=logging.INFO)
+logger = logger.get_logger(log_file=LOG_DIR_SCRAPING, name='scraping')
+
+# JSON endpoint called by the listing of sauto.cz (used instead of the HTML pages if scraping_settings.sauto_api.enabled)
+SAUTO_API_URL: str = 'https://www.sauto.cz/api/v1/items/search?category_id=838&limit={limit}&offset={offset}'
+
+
+class ListingStreamParser(HTMLParser):
+    def __init__(self, listing: tuple, pagination: tuple) -> None:
+        """
+        Initializes the incremental parser which watches a listing page while it is being downloaded.
+
+        The page is complete for the parsers once a listing card was seen and the pagination after the cards
+        was closed; everything after it (footer, scripts, inline state) is not needed. A page where this never
+        happens (the last page without cards, a changed layout) is simply read to the end.
+
+        Args:
+            listing (tuple): (tag, classes) of a listing card, e.g. ('div', 'card box').
+            pagination (tuple): (tag, classes) of the pagination element, e.g. ('nav', 'pagenav').
+        """
+        super().__init__(convert_charrefs=False)
+        self.listing = listing
+        self.pagination = pagination
+        self.listing_seen: bool = False
+        self.pagination_depth: int = 0  # Otvorené elementy s tagom stránkovania, od jeho začiatku
+        self.done: bool = False
+
+    @staticmethod
+    def matches(tag: str, attrs: list, marker: tuple):
+        if tag != marker[0]:
+            return False
+        classes: str = next((value or '' for name, value in attrs if name == 'class'), '')
+        return set(marker[1].split()) <= set(classes.split())
+
+    def handle_starttag(self, tag: str, attrs: list):
+        if self.pagination_depth:
+            if tag == self.pagination[0]:
+                self.pagination_depth += 1
+        elif self.matches(tag, attrs, self.listing):
+            self.listing_seen = True
+        elif self.listing_seen and self.matches(tag, attrs, self.pagination):
+            self.pagination_depth = 1
+
+    def handle_endtag(self, tag: str):
+        if self.pagination_depth and tag == self.pagination[0]:
+            self.pagination_depth -= 1
+            if not self.pagination_depth:
+                self.done = True
 
 
 class Scraper:
+    site: str = None  # Site key (pipeline.SITES), used as a label of the metrics
+    stream_markers: tuple = None  # (listing card, pagination) as (tag, classes), see ListingStreamParser
+
     def __init__(self, request_call_limit: int, request_period_seconds: int, requests_made: int, number_of_attempts: int) -> None:
         """
         Initializes a new instance of the class.
@@ -46,7 +100,14 @@ class Scraper:
         self.requests_made = requests_made  # Tracking the number of requests your scraper sent to the server during a certain period of time
         self.last_request_time = None
         self.number_of_attempts = number_of_attempts
-    
+        self.rate_limit_lock = threading.Lock()  # Pages can be fetched from several threads at once (pipeline.scrape_pages)
+        self.request_timeout = get_settings().scraping.get('request_timeout', 30)  # Seconds to wait for the server
+        self.proxy_pool = None  # proxy.ProxyPool set by the pipeline, gets the results of the requests
+        streaming_settings: dict = get_settings().scraping.get('streaming_fetch', {})
+        # Listing pages are read only up to the pagination (scraping_settings.streaming_fetch)
+        self.streaming: bool = bool(streaming_settings.get('enabled', False)) and self.stream_markers is not None
+        self.stream_chunk_size: int = streaming_settings.get('chunk_size', 8192)
+
     def fetch_page(self, base_url: str, page_url: str, proxy: str, headers: dict):
         """
         Fetches a web page using the specified proxy and headers.
@@ -64,41 +125,159 @@ class Scraper:
         logger.info(f'Fetching page: {page_url}')
         
         # Obmedzenie počtu volaní
-        if self.requests_made >= self.request_call_limit:
-            time_elapsed = time.time() - self.last_request_time
-            if time_elapsed < self.request_period_seconds:
-                time.sleep(self.request_period_seconds - time_elapsed)
-            self.requests_made = 0
-        
-        # Opätovné skúšanie
+        with self.rate_limit_lock:
+            if self.requests_made >= self.request_call_limit:
+                time_elapsed = time.time() - self.last_request_time
+                if time_elapsed < self.request_period_seconds:
+                    time.sleep(self.request_period_seconds - time_elapsed)
+                self.requests_made = 0
+
+        # Bez proxy, ak je vypnuté v nastaveniach (proxy_settings.use_proxy); stránky sú na https, preto aj "https"
+        proxies: dict = {"http": f'{proxy}', "https": f'{proxy}'} if proxy is not None else None
+
+        # Opätovné skúšanie (chyby spojenia, 429 a 5xx)
         for attempt in range(self.number_of_attempts):  # Počet pokusov
+            if attempt > 0:
+                metrics.inc('request_retries_total', site=self.site)
+            wait: int = 2 ** attempt  # Exponenciálne zvyšovanie času čakania
+            is_last_attempt: bool = attempt == self.number_of_attempts - 1
+
+            start_time: float = time.perf_counter()
             try:
-                try:
-                    response: requests.models.Response = requests.get(url=base_url + str(page_url), proxies={"http": f'{proxy}'}, headers=headers)
-                except Exception as e:
-                    logger.error(f'Failed to get page: {e}')
-                    logger.error(traceback.format_exc())
-                    return None
-                if response is None:
-                    logger.error('Fetched page is None')
-                    return None
-                try:
-                    response.raise_for_status()
-                except Exception as e:
-                    logger.error(f'Failed to get page: {e}')
-                    logger.error(traceback.format_exc())
-                    return None
-                
+                response: requests.models.Response = requests.get(url=base_url + str(page_url), proxies=proxies, headers=headers, timeout=self.request_timeout, stream=self.streaming)
+            except requests.exceptions.RequestException as e:
+                metrics.observe('request_latency_seconds', time.perf_counter() - start_time, site=self.site, proxy=str(proxy))
+                metrics.inc('requests_total', site=self.site, status='error')
+                logger.error(f'Failed to get page: {e}')
+                if self.proxy_pool is not None and proxy is not None:
+                    # Ďalší pokus cez inú proxy, nefunkčné proxy idú do karantény
+                    self.proxy_pool.report(proxy, ok=False)
+                    proxy = self.proxy_pool.get() or proxy
+                    proxies = {"http": f'{proxy}', "https": f'{proxy}'}
+                if not is_last_attempt:
+                    time.sleep(wait)
+                continue
+            metrics.observe('request_latency_seconds', time.perf_counter() - start_time, site=self.site, proxy=str(proxy))
+            if self.proxy_pool is not None and proxy is not None:
+                self.proxy_pool.report(proxy, ok=True)
+            metrics.inc('requests_total', site=self.site, status=str(response.status_code))
+            if not self.streaming:
+                metrics.inc('bytes_downloaded_total', len(response.content), site=self.site)
+
+            with self.rate_limit_lock:
                 self.requests_made += 1
                 self.last_request_time = time.time()
-                
-                if response.status_code == 200:
-                    return response.text
-            except requests.exceptions.RequestException as e:
-                wait: int = 2 ** attempt  # Exponenciálne zvyšovanie času čakania
-                time.sleep(wait)
+
+            if response.status_code == 429 or response.status_code >= 500:
+                response.close()
+                logger.error(f'Failed to get page: {response.status_code} {response.reason} (attempt {attempt + 1}/{self.number_of_attempts})')
+                retry_after: str = response.headers.get('Retry-After', '')
+                if not is_last_attempt:
+                    time.sleep(int(retry_after) if retry_after.isdigit() else wait)
+                continue
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                response.close()
+                logger.error(f'Failed to get page: {e}')
+                logger.error(traceback.format_exc())
+                return None
+            if self.streaming:
+                try:
+                    return self.read_listing(response)
+                except requests.exceptions.RequestException as e:
+                    logger.error(f'Failed to read page: {e}')
+                    if not is_last_attempt:
+                        time.sleep(wait)
+                    continue
+            return response.text
         return None
 
+    def read_listing(self, response: requests.models.Response):
+        """
+        Reads a streamed listing page chunk by chunk and closes the connection as soon as the cards and the
+        pagination after them were received (see ListingStreamParser), so the rest of the page is not downloaded.
+
+        Args:
+            response (requests.models.Response): The response of a request made with stream=True.
+
+        Returns:
+            str: The page up to the end of the pagination, or the whole page.
+        """
+        detector: ListingStreamParser = ListingStreamParser(*self.stream_markers)
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        chunks: list = []
+        received: int = 0
+        try:
+            for chunk in response.iter_content(chunk_size=self.stream_chunk_size):
+                received += len(chunk)
+                text: str = decoder.decode(chunk)
+                chunks.append(text)
+                detector.feed(text)
+                if detector.done:
+                    metrics.inc('pages_stopped_early_total', site=self.site)
+                    break
+            else:
+                chunks.append(decoder.decode(b'', final=True))
+        finally:
+            response.close()
+            metrics.inc('bytes_downloaded_total', received, site=self.site)
+        return ''.join(chunks)
+
+    def listing_fingerprint(self, response: str):
+        """
+        Returns the fingerprint of the listing cards of a page: a hash of the HTML from the first card to the
+        pagination (URLs, prices and everything else the parsers read), without the whitespace. The header,
+        footer and the pagination itself do not change it.
+
+        Args:
+            response (str): The content of the listing page.
+
+        Returns:
+            str or None: The fingerprint, or None if the page has no cards or pagination (e.g. the last page).
+        """
+        if self.stream_markers is None:
+            return None
+        (_, card_classes), (_, pagination_classes) = self.stream_markers
+        first_card: int = response.find(f'class="{card_classes}"')
+        if first_card == -1:
+            return None
+        start: int = response.rfind('<', 0, first_card)
+        end: int = response.find(f'class="{pagination_classes}', first_card)
+        if end == -1:
+            return None
+        end = response.rfind('<', first_card, end)
+        return hashlib.blake2b(' '.join(response[start:end].split()).encode('utf-8'), digest_size=20).hexdigest()
+
+    def discover_last_page(self, response: str):
+        """
+        Reads the number of the last listing page from the first page, so the whole range can be scheduled at once.
+        The base class does not know the markup of any site.
+
+        Args:
+            response (str): The content of the first listing page.
+
+        Returns:
+            int or None: The number of the last page, or None if it cannot be found.
+        """
+        return None
+
+    @staticmethod
+    def max_page_number(links: list, parameter: str):
+        """
+        Returns the highest page number among pagination links, from the `parameter` of their URL or from their text.
+        """
+        pattern = re.compile(rf'[?&]{parameter}=(\d+)')
+        numbers: list = []
+        for link in links:
+            match = pattern.search(link.get('href') or '')
+            text: str = link.get_text(strip=True)
+            if match:
+                numbers.append(int(match.group(1)))
+            elif text.isdigit():
+                numbers.append(int(text))
+        return max(numbers) if numbers else None
+
     def edit_list_cars_details(self, list_cars: list):
         """
         Edits the details of a list of cars by creating a new list of rows.
@@ -132,6 +311,9 @@ class Scraper:
     
     
 class AaaAutoScraper(Scraper):
+    site: str = 'aaaauto'
+    stream_markers: tuple = (('div', 'card box'), ('nav', 'pagenav'))
+
     def __init__(self, request_call_limit: int, request_period_seconds: int, requests_made: int, number_of_attempts: int) -> None:
         """
         Initializes a new instance of the class.
@@ -212,6 +394,7 @@ class AaaAutoScraper(Scraper):
                 'krajina': [],
                 'datum_pridania': [],
             }
+            today = datetime.now().date()
             for car_item in start_point:
                 try:
                     list_cars['znacka'].append(car_item.find('a', class_ = 'primary notranslate').text.split()[0])
@@ -254,7 +437,7 @@ class AaaAutoScraper(Scraper):
                 except:
                     list_cars['url'].append(np.nan)
                 list_cars['krajina'].append('Czech Republic')
-                list_cars['datum_pridania'].append(datetime.now().date())
+                list_cars['datum_pridania'].append(today)
             
             return list_cars
         else:
@@ -262,6 +445,22 @@ class AaaAutoScraper(Scraper):
             no_result: str = result[0].h3.text
             # print('Page not found:', no_result)
             return None
+
+    def discover_last_page(self, response: str):
+        """
+        Reads the number of the last page from the page navigation (nav.pagenav) of the first listing page.
+
+        Args:
+            response (str): The content of the first listing page.
+
+        Returns:
+            int or None: The number of the last page, or None if it cannot be found.
+        """
+        soup: BeautifulSoup = BeautifulSoup(response, 'html.parser')
+        pagenav = soup.find('nav', class_ = 'pagenav noprint center')
+        if pagenav is None:
+            return None
+        return self.max_page_number(pagenav.find_all('a'), 'page')
     
     def edit_list_cars_details(self, list_cars: list):
         """
@@ -282,16 +481,24 @@ class CheckNewItems:
         Initializes the CheckNewItems class.
         """
         self.db_manager_settings  = DatabaseManagerSettings()
+        # Staršia databáza nemusí mať nové stĺpce (blocking_key, duplicate_of, site, listing_id, *_id dimenzií)
+        self.db_manager_settings.ensure_columns(CarData.__table__)
+        # Autá uložené pred zavedením listing_id (raz za proces)
+        ensure_listing_ids()
     
     def compare_details_with_db(self, cars_details: list):
         """
         Compares the given list of car details with the database and returns a dataframe of new details to insert.
+        Cars are compared by their listing key (site and listing id from the URL, see listings.py), so URL variants
+        of the same listing are not new; cars whose URL has no listing id are compared by the URL.
+        The stored keys are read in batches, not one query per car.
 
         Parameters:
-            cars_details (list): A list of dictionaries representing car details.
+            cars_details (list | CarBatch): A list of dictionaries representing car details, or the batch of cars
+                from pipeline.scrape_pages.
 
         Returns:
-            pd.DataFrame: A dataframe containing the new car details to insert into the database.
+            pd.DataFrame: A dataframe containing the new car details to insert into the database (with site and listing_id).
 
         Raises:
             ValueError: If the cars_details parameter is empty.
@@ -302,47 +509,40 @@ class CheckNewItems:
         if not cars_details:
             logger.error('The parameter cars_details cannot be empty')
             # raise ValueError('The parameter cars_details cannot be empty')
-        if not isinstance(cars_details, list):
-            logger.error('The parameter cars_details must be a list')
+        if not isinstance(cars_details, (list, CarBatch)):
+            logger.error('The parameter cars_details must be a list or a CarBatch')
             # raise TypeError('The parameter cars_details must be a list')
 
         # Create dataframe from list
-        df: pd.DataFrame = pd.DataFrame(cars_details)
+        df: pd.DataFrame = cars_details.to_frame() if isinstance(cars_details, CarBatch) else pd.DataFrame(cars_details)
         
         # Create blank dataframe to store new details
         column_names: list = ['znacka', 'model', 'rok', 'km', 'palivo', 'prevodovka', 'vykon_motora', 'objem_motora', 'cena', 'url', 'krajina', 'datum_pridania']
         df_to_insert: pd.DataFrame = pd.DataFrame(columns=column_names)
         
         start_time = datetime.now()
+        dedup_start: float = time.perf_counter()
 
         try:
-            for index, row in df.iterrows():
-                # Get URL
-                url: str = row['url']
-                # Check if URL already exists in the database
-                df_database: pd.DataFrame = self.db_manager_settings.read_data(model=CarData, conditions=CarData.url == url)
-                                
-                if url not in df_database['url'].values:
-                    logger.info(f'New URL found: {url}')
-                    # If a new URL is found, return the corresponding row
-                    row_to_insert: pd.DataFrame = pd.DataFrame([row.values], columns=column_names)
-                    df_to_insert: pd.DataFrame = pd.concat([df_to_insert, row_to_insert], ignore_index=True)
-                
-                if url in df_database['url'].values:
-                    logger.info(f'Skipping... URL already exists in the database: {url}')
-                    continue
-                
+            if not df.empty:
+                df = add_listing_keys(df)
+                new: pd.Series = new_listing_mask(df)
+                df_to_insert = df.loc[new].reindex(columns=column_names + ['site', 'listing_id']).reset_index(drop=True)
+                logger.info(f'New cars found: {len(df_to_insert)}, skipping {len(df) - len(df_to_insert)} cars already in the database')
         except Exception as e:
             logger.error(f"An unexpected error occurred: {e}")
             raise
         
-        self.db_manager_settings.close_connection()
         end_time = datetime.now()
+        metrics.observe('dedup_seconds', time.perf_counter() - dedup_start)
         logger.info(f'Elapsed time for comparing details with database: {end_time - start_time}')
         return df_to_insert
 
     
 class SautoScraper(Scraper):
+    site: str = 'sauto'
+    stream_markers: tuple = (('div', 'c-item__data-wrap'), ('nav', 'c-paging'))
+
     def __init__(self, request_call_limit: int, request_period_seconds: int, requests_made: int, number_of_attempts: int) -> None:
         """
         Initializes a new instance of the class.
@@ -420,6 +620,7 @@ class SautoScraper(Scraper):
                     'krajina': [],
                     'datum_pridania': [],
                 }
+            today = datetime.now().date()
             for point in start_point:
                 try:
                     parsed_data['znacka'].append(point.find('span', class_='c-item__name c-item__name--hide').text.split(',')[0].split(' ')[0])
@@ -459,12 +660,25 @@ class SautoScraper(Scraper):
                 except:
                     parsed_data['url'].append(np.nan)
                 parsed_data['krajina'].append('Czech Republic')
-                parsed_data['datum_pridania'].append(datetime.now().date())
+                parsed_data['datum_pridania'].append(today)
                     
             return parsed_data
         else:
             return None
 
+    def discover_last_page(self, response: str):
+        """
+        Reads the number of the last page from the paging buttons (a.c-paging__btn-page) of the first listing page.
+
+        Args:
+            response (str): The content of the first listing page.
+
+        Returns:
+            int or None: The number of the last page, or None if it cannot be found.
+        """
+        soup: BeautifulSoup = BeautifulSoup(response, 'html.parser')
+        return self.max_page_number(soup.find_all('a', class_='c-paging__btn-page'), 'strana')
+
     def edit_list_cars_details(self, list_cars: list):
         """
         Edits the details of a list of cars by creating a new list of rows.
@@ -482,7 +696,117 @@ class SautoScraper(Scraper):
         return super().edit_list_cars_details(list_cars)
 
 
+class SautoApiScraper(SautoScraper):
+    stream_markers: tuple = None  # JSON, always read whole
+    def __init__(self, request_call_limit: int, request_period_seconds: int, requests_made: int, number_of_attempts: int, page_size: int = None) -> None:
+        """
+        Initializes the scraper of sauto.cz which reads the listing from the JSON endpoint of the site
+        (scraping_settings.sauto_api) instead of the HTML pages.
+
+        One page has `page_size` cars (the HTML listing has 20), so the same cars need fewer requests
+        and parsing JSON is much cheaper than parsing HTML. Page N is offset (N - 1) * page_size.
+
+        Args:
+            request_call_limit (int): The maximum number of requests that can be made to the server within a certain period of time.
+            request_period_seconds (int): The duration of the period in seconds.
+            requests_made (int): The number of requests made to the server during the current period.
+            number_of_attempts (int): The number of times the scraper will attempt to fetch a page before giving up.
+            page_size (int, optional): The number of cars requested per page (scraping_settings.sauto_api.page_size).
+
+        Returns:
+            None
+        """
+        super().__init__(request_call_limit, request_period_seconds, requests_made, number_of_attempts)
+        api_settings: dict = get_settings().scraping.get('sauto_api', {})
+        self.api_url: str = api_settings.get('url', SAUTO_API_URL)
+        self.page_size: int = page_size or api_settings.get('page_size', 100)
+
+    def fetch_page(self, base_url: str, page_url: str, proxy: str, headers: dict):
+        """
+        Fetches one page of the JSON listing (the base URL of the HTML listing is not used).
+
+        Args:
+            base_url (str): The base URL of the HTML listing, ignored.
+            page_url (str): The page number.
+            proxy (str): The proxy to use for the request.
+            headers (dict): The headers to include in the request.
+
+        Returns:
+            str: The JSON of the page as a string, or None if the page could not be fetched.
+        """
+        url: str = self.api_url.format(limit=self.page_size, offset=(int(page_url) - 1) * self.page_size)
+        return Scraper.fetch_page(self, url, '', proxy, {**headers, 'accept': 'application/json'})
+
+    def get_parsed_data(self, response: str, page: int):
+        """
+        Maps the cars of a JSON page straight to the columns of CarData.
+
+        Args:
+            response (str): The JSON of the page.
+            page (int): The page number.
+
+        Returns:
+            dict: A dictionary of lists with the same keys as SautoScraper.get_parsed_data
+                (vykon_motora is filled, objem_motora is in ccm).
+
+            Returns None if the page has no cars (after the last page).
+        """
+        logger.info(f'Start parsing API page {page}\n')
+
+        results: list = json.loads(response).get('results') or []
+        if not results:
+            return None
+
+        def name(item: dict, key: str, field: str = 'name'):
+            value = (item.get(key) or {}).get(field)
+            return value if value else np.nan
+
+        def text(value):
+            return str(value) if value is not None else np.nan
+
+        parsed_data: dict = {key: [] for key in ('znacka', 'model', 'rok', 'km', 'palivo', 'prevodovka', 'vykon_motora', 'objem_motora', 'cena', 'url', 'krajina', 'datum_pridania')}
+        today = datetime.now().date()
+        for item in results:
+            parsed_data['znacka'].append(name(item, 'manufacturer_cb'))
+            parsed_data['model'].append(name(item, 'model_cb'))
+            parsed_data['rok'].append((item.get('manufacturing_date') or '')[:4] or np.nan)
+            parsed_data['km'].append(text(item.get('tachometer')))
+            parsed_data['palivo'].append(name(item, 'fuel_cb'))
+            parsed_data['prevodovka'].append(name(item, 'gearbox_cb'))
+            parsed_data['vykon_motora'].append(text(item.get('engine_power')))
+            parsed_data['objem_motora'].append(text(item.get('engine_volume')))
+            parsed_data['cena'].append(text(item.get('price')))
+            try:
+                parsed_data['url'].append(
+                    f"https://www.sauto.cz/{(item.get('category_cb') or {}).get('seo_name') or 'osobni'}/detail/"
+                    f"{item['manufacturer_cb']['seo_name']}/{item['model_cb']['seo_name']}/{item['id']}"
+                )
+            except (KeyError, TypeError):
+                parsed_data['url'].append(np.nan)
+            parsed_data['krajina'].append('Czech Republic')
+            parsed_data['datum_pridania'].append(today)
+        return parsed_data
+
+    def discover_last_page(self, response: str):
+        """
+        Computes the number of the last page from the total number of cars (pagination.total) of the first page.
+
+        Args:
+            response (str): The content of the first listing page.
+
+        Returns:
+            int or None: The number of the last page, or None if it cannot be found.
+        """
+        total = (json.loads(response).get('pagination') or {}).get('total')
+        if not total:
+            return None
+        return math.ceil(int(total) / self.page_size)
+
+
 class TipCarsScraper(Scraper):
+    site: str = 'tipcars'
+    stream_markers: tuple = (('a', 'w-100 float-l'), ('div', 'strankovani'))
+
     def __init__(self, request_call_limit: int, request_period_seconds: int, requests_made: int, number_of_attempts: int) -> None:
         """
         Initializes a new instance of the class.
@@ -565,6 +889,7 @@ class TipCarsScraper(Scraper):
                 'krajina': [],
                 'datum_pridania': [],
             }
+            today = datetime.now().date()
             for car in all_cars_list:
                 model = car.find('h2', class_='fs-20px lh-19 fs-tucne').text
                 for index, title in enumerate(model.split()):
@@ -620,11 +945,27 @@ class TipCarsScraper(Scraper):
                 except:
                     cars_list['url'].append(np.nan)
                 cars_list['krajina'].append('Czech Republic')
-                cars_list['datum_pridania'].append(datetime.now().date())
+                cars_list['datum_pridania'].append(today)
                 
             return cars_list
         else:
             return None
+
+    def discover_last_page(self, response: str):
+        """
+        Reads the number of the last page from the page links (?str=) of the paging (div.strankovani) of the first listing page.
+
+        Args:
+            response (str): The content of the first listing page.
+
+        Returns:
+            int or None: The number of the last page, or None if it cannot be found.
+        """
+        soup: BeautifulSoup = BeautifulSoup(response, 'html.parser')
+        paging = soup.find('div', class_='strankovani')
+        if paging is None:
+            return None
+        return self.max_page_number(paging.find_all('a'), 'str')
         
     def edit_list_cars_details(self, list_cars: list):
         """
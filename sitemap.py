@@ -0,0 +1,398 @@
+import gzip
+import io
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
+from urllib.parse import urljoin, urlsplit, urldefrag
+from urllib.request import url2pathname
+from xml.etree.ElementTree import iterparse, ParseError
+import requests
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.exc import IntegrityError
+from logs import logger
+from metrics import metrics
+from config import load_env, get_settings
+from db import DatabaseManagerSettings, CarData, ListingUrl, session_scope
+from enrichment import TokenBucket, parse_listing_page
+from listings import listing_key, stored_listing_keys, stored_urls
+from proxy import ProxyPool
+from records import CAR_COLUMNS, CarBatch
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_SCRAPING = os.getenv('LOG_DIR_SCRAPING')
+
+# Create logger object (the same logger as in scraper.py)
+logger = logger.get_logger(log_file=LOG_DIR_SCRAPING, name='scraping')
+
+# Sitemap index and the pattern of the listing (detail page) URLs of every site, see sitemap_settings.sites
+DEFAULT_SITEMAPS: dict = {
+    'aaaauto': {'url': 'https://www.aaaauto.cz/sitemap.xml', 'listing_pattern': r'/car\.html\?id=\d+'},
+    'sauto': {'url': 'https://www.sauto.cz/sitemap.xml', 'listing_pattern': r'/osobni/detail/[^/]+/[^/]+/\d+'},
+    'tipcars': {'url': 'https://www.tipcars.com/sitemap.xml', 'listing_pattern': r'-ojete-\d+\.html$'},
+}
+
+GZIP_MAGIC: bytes = b'\x1f\x8b'
+
+
+def canonical_url(url: str):
+    """
+    Returns the URL without its fragment (...car.html?id=1#promo=listing -> ...car.html?id=1), the form compared
+    with the sitemaps and stored in the listing queue.
+    """
+    return urldefrag(url.strip())[0]
+
+
+def local_path(location: str):
+    """
+    Returns the file path of a file:// URL or of a plain path, None for an http(s) URL.
+    """
+    parts = urlsplit(location)
+    if parts.scheme == 'file':
+        return url2pathname(parts.path)
+    if parts.scheme in ('http', 'https'):
+        return None
+    return location
+
+
+def iter_sitemap_entries(stream):
+    """
+    Reads a sitemap or a sitemap index with a streaming parser. Every entry is cleared from the tree as soon
+    as it is read, so the memory does not grow with the size of the file.
+
+    Args:
+        stream: A binary file-like object with the XML (already decompressed).
+
+    Yields:
+        tuple: (kind, loc, lastmod), kind 'sitemap' for an entry of an index, 'url' for a page of a urlset.
+    """
+    root = None
+    for event, element in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            continue
+        # Menné priestory sa ignorujú, niektoré weby používajú staré URL schémy
+        tag: str = element.tag.rsplit('}', 1)[-1]
+        if tag not in ('url', 'sitemap'):
+            continue
+        loc: str = ''
+        lastmod: str = None
+        for child in element:
+            child_tag: str = child.tag.rsplit('}', 1)[-1]
+            if child_tag == 'loc':
+                loc = (child.text or '').strip()
+            elif child_tag == 'lastmod':
+                lastmod = (child.text or '').strip() or None
+        element.clear()
+        root.clear()
+        if loc:
+            yield tag, loc, lastmod
+
+
+class SitemapDiscovery:
+    def __init__(self, site: str, sitemap_url: str = None, listing_pattern: str = None, batch_size: int = None,
+                 max_depth: int = None, proxy_pool: Iterator = None, headers_pool: Iterator = None) -> None:
+        """
+        Initializes the discovery of the listings of a site from its sitemaps instead of the paginated search.
+
+        The sitemap index is read recursively (nested indexes, gzipped sitemaps) with a streaming parser;
+        the URLs matching `listing_pattern` are compared with the stored cars and the ones not stored yet are queued
+        in the listing_queue table (ListingUrl), `batch_size` URLs per query. The defaults are taken from
+        sitemap_settings in the settings file.
+
+        Args:
+            site (str): The site key from pipeline.SITES.
+            sitemap_url (str, optional): The sitemap index (http(s) URL, file:// URL or path of a local file).
+            listing_pattern (str, optional): Regular expression of the listing URLs, other pages are skipped.
+            batch_size (int, optional): The number of URLs compared and queued in one query.
+            max_depth (int, optional): The maximum nesting of sitemap indexes.
+            proxy_pool (Iterator, optional): The pool of proxies to use, requests go directly if not given.
+            headers_pool (Iterator, optional): The pool of headers to use.
+        """
+        sitemap_settings: dict = get_settings().sitemaps
+        site_settings: dict = {**DEFAULT_SITEMAPS.get(site, {}), **sitemap_settings.get('sites', {}).get(site, {})}
+        self.site = site
+        self.sitemap_url: str = sitemap_url or site_settings.get('url')
+        self.listing_pattern = re.compile(listing_pattern or site_settings.get('listing_pattern', ''))
+        self.batch_size: int = batch_size or sitemap_settings.get('batch_size', 1000)
+        self.max_depth: int = max_depth or sitemap_settings.get('max_depth', 3)
+        self.timeout: int = get_settings().scraping.get('request_timeout', 10)
+        self.proxy_pool = proxy_pool
+        self.headers_pool = headers_pool
+        self.sitemaps_read: int = 0
+        self.db_manager_settings = DatabaseManagerSettings()
+        self.db_manager_settings.ensure_columns(ListingUrl.__table__)
+        # Nová databáza ešte nemusí mať tabuľku áut, s ktorou sa URL porovnávajú
+        self.db_manager_settings.ensure_columns(CarData.__table__)
+
+    @contextmanager
+    def open_sitemap(self, location: str):
+        """
+        Opens a sitemap for streaming, decompressing it if it is gzipped (by its first bytes, not by its name).
+
+        Yields:
+            A binary file-like object with the XML.
+        """
+        path: str = local_path(location)
+        if path is not None:
+            raw = open(path, 'rb')
+        else:
+            proxy = next(self.proxy_pool) if self.proxy_pool is not None else None
+            headers: dict = next(self.headers_pool) if self.headers_pool is not None else {}
+            # Položka poolu sa použije bez zmeny ako v Scraper.fetch_page (aj URL brány, napr. http://127.0.0.1:8899)
+            proxies: dict = {'http': proxy, 'https': proxy} if proxy else None
+            pool: ProxyPool = self.proxy_pool if isinstance(self.proxy_pool, ProxyPool) and proxy else None
+            try:
+                response = requests.get(location, headers=headers, proxies=proxies, timeout=self.timeout, stream=True)
+            except requests.RequestException:
+                # Nefunkčné proxy idú do karantény rovnako ako pri sťahovaní stránok
+                if pool is not None:
+                    pool.report(proxy, ok=False)
+                raise
+            if pool is not None:
+                pool.report(proxy, ok=True)
+            response.raise_for_status()
+            # Content-Encoding: gzip rozbalí urllib3, súbory .xml.gz rozbalí GzipFile nižšie
+            response.raw.decode_content = True
+            # io.BufferedReader číta ďalej aj po poslednom bloku, urllib3 by odpoveď zavrel
+            response.raw.auto_close = False
+            raw = response.raw
+        try:
+            stream = io.BufferedReader(raw) if path is None else raw
+            if stream.peek(2)[:2] == GZIP_MAGIC:
+                stream = gzip.GzipFile(fileobj=stream)
+            self.sitemaps_read += 1
+            yield stream
+        finally:
+            raw.close()
+
+    def iter_listing_urls(self, location: str = None, depth: int = 0, visited: set = None):
+        """
+        Walks the sitemap index of the site and yields the listing URLs in canonical form (see canonical_url).
+        A sitemap that cannot be read is logged and skipped.
+
+        Args:
+            location (str, optional): The sitemap to read, the index of the site if not given.
+            depth (int): The nesting of the sitemap (0 for the index).
+            visited (set, optional): Sitemaps read in this walk, a sitemap is never read twice.
+
+        Yields:
+            tuple: (url, lastmod)
+        """
+        location = location or self.sitemap_url
+        visited = set() if visited is None else visited
+        if location in visited:
+            return
+        visited.add(location)
+        children: list = []
+        try:
+            with self.open_sitemap(location) as stream:
+                for kind, loc, lastmod in iter_sitemap_entries(stream):
+                    if kind == 'sitemap':
+                        # Vnorené sitemapy sa čítajú až po zatvorení tejto
+                        children.append(urljoin(location, loc))
+                    elif self.listing_pattern.search(loc):
+                        yield canonical_url(urljoin(location, loc)), lastmod
+        except (requests.RequestException, OSError, ParseError) as e:
+            logger.error(f'Failed to read sitemap {location}: {e}')
+        if children and depth >= self.max_depth:
+            logger.warning(f'Sitemap {location} nested deeper than {self.max_depth} levels, {len(children)} sitemaps skipped')
+            return
+        for child in children:
+            yield from self.iter_listing_urls(child, depth + 1, visited)
+
+    def queue_batch(self, batch: dict):
+        """
+        Queues the URLs of a batch which are neither stored in CarData nor already queued. They are compared
+        by their listing key (listings.listing_key), so the URL variants of a stored car are not queued;
+        URLs without a listing id are compared as they are. If another node queues some of the URLs at the same
+        time, the insert is repeated without them.
+
+        Args:
+            batch (dict): Canonical URL -> lastmod.
+
+        Returns:
+            int: The number of queued URLs.
+        """
+        keys: dict = {url: listing_key(url) for url in batch}
+        stored_keys: set = stored_listing_keys([key for key in keys.values() if key[1] is not None], self.batch_size)
+        stored: set = stored_urls([url for url, key in keys.items() if key[1] is None], self.batch_size)
+        unseen: list = [url for url, key in keys.items() if key not in stored_keys and url not in stored]
+        if not unseen:
+            return 0
+        for attempt in range(3):
+            try:
+                with session_scope() as session:
+                    queued: set = set(session.scalars(select(ListingUrl.url).where(ListingUrl.url.in_(unseen))))
+                    now: datetime = datetime.now()
+                    rows: list = [
+                        {'site': self.site, 'url': url, 'lastmod': batch[url], 'status': 'pending', 'discovered_at': now}
+                        for url in unseen if url not in queued
+                    ]
+                    if rows:
+                        session.execute(insert(ListingUrl), rows)
+                return len(rows)
+            except IntegrityError:
+                # Iný uzol medzitým zaradil niektoré z týchto URL, pri ďalšom pokuse sa vynechajú
+                if attempt == 2:
+                    raise
+                logger.info(f'Listings of {self.site} queued by another process at the same time, retrying the batch')
+
+    def discover(self, limit: int = None):
+        """
+        Reads the sitemaps of the site and queues its listings which are not in the database yet.
+
+        Args:
+            limit (int, optional): Stop after this many listing URLs from the sitemaps.
+
+        Returns:
+            dict: {'sitemaps': sitemaps read, 'listings': listing URLs found, 'queued': newly queued URLs}.
+        """
+        if not self.sitemap_url:
+            logger.error(f'No sitemap of {self.site} in sitemap_settings')
+            return {'sitemaps': 0, 'listings': 0, 'queued': 0}
+        logger.info(f'Reading sitemaps of {self.site} from {self.sitemap_url}')
+        start_time: float = time.perf_counter()
+        listings: int = 0
+        queued: int = 0
+        batch: dict = {}
+        for url, lastmod in self.iter_listing_urls():
+            listings += 1
+            batch[url] = lastmod
+            if len(batch) >= self.batch_size:
+                queued += self.queue_batch(batch)
+                batch = {}
+            if limit and listings >= limit:
+                break
+        queued += self.queue_batch(batch)
+
+        metrics.observe('sitemap_seconds', time.perf_counter() - start_time, site=self.site)
+        metrics.inc('sitemap_listings_total', listings, site=self.site)
+        metrics.inc('listings_queued_total', queued, site=self.site)
+        logger.info(f'Sitemaps of {self.site}: {self.sitemaps_read} sitemaps, {listings} listings, {queued} new listings queued')
+        return {'sitemaps': self.sitemaps_read, 'listings': listings, 'queued': queued}
+
+
+def listing_queue_stats():
+    """
+    Returns the number of queued listings by site and status.
+
+    Returns:
+        dict: (site, status) -> count
+    """
+    DatabaseManagerSettings().ensure_columns(ListingUrl.__table__)
+    with session_scope() as session:
+        rows = session.execute(select(ListingUrl.site, ListingUrl.status, func.count()).group_by(ListingUrl.site, ListingUrl.status))
+        return {(site, status): count for site, status, count in rows}
+
+
+def pending_listings(site: str, limit: int = None):
+    """
+    Returns the queued listings of a site waiting to be scraped (status pending), in the order they were queued.
+
+    Returns:
+        list: (id, url) of the listings.
+    """
+    DatabaseManagerSettings().ensure_columns(ListingUrl.__table__)
+    with session_scope() as session:
+        query = select(ListingUrl.id, ListingUrl.url).where(ListingUrl.site == site, ListingUrl.status == 'pending').order_by(ListingUrl.id)
+        return [tuple(row) for row in session.execute(query.limit(limit))]
+
+
+def mark_listings(ids: list, status: str, batch_size: int = 1000):
+    """
+    Sets the status of the queued listings (done or failed), `batch_size` listings per statement.
+    """
+    with session_scope() as session:
+        for index in range(0, len(ids), batch_size):
+            session.execute(update(ListingUrl).where(ListingUrl.id.in_(ids[index:index + batch_size])).values(status=status))
+
+
+class ListingQueueScraper:
+    def __init__(self, workers: int = None, rate_per_second: float = None, burst: int = None, batch_size: int = None) -> None:
+        """
+        Initializes the scraper of the listings queued by SitemapDiscovery.
+
+        The detail pages of the pending listings are fetched by a bounded pool of `workers` threads with the rate
+        budget of the detail pages (enrichment_settings, a token bucket separate from the listing crawl) and parsed
+        into cars by enrichment.parse_listing_page, `batch_size` listings at a time.
+
+        Args:
+            workers (int, optional): The number of detail pages fetched at the same time.
+            rate_per_second (float, optional): The average number of detail pages fetched per second.
+            burst (int, optional): The number of detail pages which may be fetched at once after a pause.
+            batch_size (int, optional): The number of listings fetched, inserted and marked together.
+        """
+        enrichment_settings: dict = get_settings().enrichment
+        self.workers: int = workers or enrichment_settings.get('workers', 4)
+        self.batch_size: int = batch_size or enrichment_settings.get('batch_size', 100)
+        self.rate_limiter = TokenBucket(
+            rate_per_second if rate_per_second is not None else enrichment_settings.get('rate_per_second', 2),
+            burst or enrichment_settings.get('burst', self.workers),
+        )
+
+    def fetch_listing(self, scraper, url: str, proxy: str, headers: dict):
+        """
+        Fetches the detail page of a queued listing and returns its car, or None if it cannot be fetched or parsed.
+        """
+        self.rate_limiter.acquire()
+        try:
+            # fetch_page skladá URL ako base_url + page_url
+            html: str = scraper.fetch_page(url, '', proxy, headers)
+        except Exception as e:
+            logger.error(f'Failed to fetch listing {url}: {e}')
+            return None
+        if html is None:
+            return None
+        car: dict = parse_listing_page(html, url)
+        if car is None:
+            logger.info(f'No car found on {url}')
+        return car
+
+    def iter_batches(self, site: str, scraper, proxy_pool: Iterator, headers_pool: Iterator, limit: int = None):
+        """
+        Fetches the pending listings of a site batch by batch.
+
+        Args:
+            site (str): The site key from pipeline.SITES.
+            scraper (Scraper): The scraper of the site used for fetching.
+            proxy_pool (Iterator): The pool of proxies to use.
+            headers_pool (Iterator): The pool of headers to use.
+            limit (int, optional): The maximum number of listings.
+
+        Yields:
+            tuple: (CarBatch of the parsed cars, ids of their listings, ids of the listings which failed)
+        """
+        listings: list = pending_listings(site, limit)
+        if not listings:
+            return
+        logger.info(f'Fetching {len(listings)} queued listings of {site} ({self.workers} workers)')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index in range(0, len(listings), self.batch_size):
+                batch: list = listings[index:index + self.batch_size]
+                # Proxy a hlavičky sa berú tu, pooly nie sú thread-safe
+                try:
+                    jobs: list = [(url, next(proxy_pool), next(headers_pool)) for _, url in batch]
+                except StopIteration:
+                    logger.error('Proxy pool empty')
+                    return
+                cars: CarBatch = CarBatch()
+                done: list = []
+                failed: list = []
+                for (listing_id, _), car in zip(batch, executor.map(lambda job: self.fetch_listing(scraper, *job), jobs)):
+                    if car is None:
+                        failed.append(listing_id)
+                        continue
+                    cars.extend({column: [car.get(column)] for column in CAR_COLUMNS})
+                    done.append(listing_id)
+                metrics.inc('listings_fetched_total', len(done), site=site)
+                metrics.inc('listings_failed_total', len(failed), site=site)
+                yield cars, done, failed
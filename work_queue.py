@@ -0,0 +1,271 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, func, or_, and_
+from logs import logger
+from config import load_env, get_settings
+from db import DatabaseManagerSettings, CrawlTask, session_scope
+
+
+# Load environment variables (once per process)
+load_env()
+
+# Load logger settings from .env file
+LOG_DIR_SCRAPING = os.getenv('LOG_DIR_SCRAPING')
+
+# Create logger object (the same logger as in scraper.py)
+logger = logger.get_logger(log_file=LOG_DIR_SCRAPING, name='scraping')
+
+
+def utc_now():
+    """
+    Returns the current UTC time without tzinfo, so leases compare the same way on every node and database.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class WorkQueue:
+    def __init__(self, lease_seconds: int = None, max_attempts: int = None, worker_id: str = None) -> None:
+        """
+        Initializes the WorkQueue class.
+
+        The queue is the `crawl_tasks` table in the database from DATABASE_URL, so every node pointing
+        to the same database shares it. A task is claimed by leasing it for `lease_seconds`; a task whose
+        lease expired (crashed worker) can be claimed again until it was tried `max_attempts` times.
+
+        Args:
+            lease_seconds (int, optional): How long a claimed task stays reserved for its worker.
+            max_attempts (int, optional): How many times a task is tried before it is marked as failed.
+            worker_id (str, optional): The name of this worker, hostname-pid-random by default.
+        """
+        work_queue_settings: dict = get_settings().work_queue
+        self.lease_seconds = lease_seconds or work_queue_settings.get('lease_seconds', 600)
+        self.max_attempts = max_attempts or work_queue_settings.get('max_attempts', 3)
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self.db_manager_settings = DatabaseManagerSettings()
+        CrawlTask.__table__.create(self.db_manager_settings.engine, checkfirst=True)
+
+    def enqueue(self, site: str, start_page: int, end_page: int, pages_per_task: int = None):
+        """
+        Splits the page range of a site into tasks and adds them to the queue.
+
+        Args:
+            site (str): The site key from pipeline.SITES.
+            start_page (int): The first page to scrape.
+            end_page (int): The last page to scrape.
+            pages_per_task (int, optional): The number of pages in one task.
+
+        Returns:
+            int: The number of tasks added.
+        """
+        pages_per_task = pages_per_task or get_settings().work_queue.get('pages_per_task', 5)
+        now: datetime = utc_now()
+        tasks: list = [
+            CrawlTask(site=site, start_page=page, end_page=min(page + pages_per_task - 1, end_page),
+                      status='pending', attempts=0, created_at=now, updated_at=now)
+            for page in range(start_page, end_page + 1, pages_per_task)
+        ]
+        with session_scope() as session:
+            session.add_all(tasks)
+        logger.info(f'Enqueued {len(tasks)} tasks for {site}, pages {start_page}-{end_page}')
+        return len(tasks)
+
+    def claimable(self, now: datetime):
+        """
+        Returns the condition for tasks which can be claimed: pending ones and leased ones with an expired lease.
+        """
+        return and_(
+            or_(CrawlTask.status == 'pending', and_(CrawlTask.status == 'leased', CrawlTask.lease_expires_at < now)),
+            CrawlTask.attempts < self.max_attempts,
+        )
+
+    def claim(self):
+        """
+        Claims the oldest claimable task for this worker.
+
+        The task is reserved with a conditional UPDATE which succeeds for exactly one worker, so it works the same
+        on SQLite and Postgres. On Postgres the candidate row is also locked with SKIP LOCKED, so workers don't
+        compete for the same row.
+
+        Returns:
+            CrawlTask or None: The claimed task (detached from the session), or None if the queue is empty.
+        """
+        self.fail_exhausted()
+        with self.db_manager_settings.Session() as session:
+            while True:
+                now: datetime = utc_now()
+                query = select(CrawlTask.id).where(self.claimable(now)).order_by(CrawlTask.id).limit(1)
+                if session.bind.dialect.name == 'postgresql':
+                    query = query.with_for_update(skip_locked=True)
+                task_id: int = session.execute(query).scalar()
+                if task_id is None:
+                    session.rollback()
+                    return None
+
+                result = session.execute(
+                    update(CrawlTask)
+                    .where(CrawlTask.id == task_id, self.claimable(now))
+                    .values(status='leased', lease_owner=self.worker_id,
+                            lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                            attempts=CrawlTask.attempts + 1, updated_at=now)
+                )
+                session.commit()
+                if result.rowcount == 1:
+                    task: CrawlTask = session.get(CrawlTask, task_id)
+                    session.expunge(task)
+                    logger.info(f'Worker {self.worker_id} claimed task {task.id}: {task.site} pages {task.start_page}-{task.end_page}')
+                    return task
+                # Another worker was faster, try the next task
+
+    def extend_lease(self, task: CrawlTask):
+        """
+        Extends the lease of a task which is still being processed.
+
+        Returns:
+            bool: False if the lease was lost (expired and claimed by another worker).
+        """
+        now: datetime = utc_now()
+        return self._finish(task, status='leased', lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+
+    def complete(self, task: CrawlTask):
+        """
+        Marks the task as done.
+
+        Returns:
+            bool: False if the lease was lost (expired and claimed by another worker).
+        """
+        return self._finish(task, status='done', lease_expires_at=None, error=None)
+
+    def fail(self, task: CrawlTask, error: str):
+        """
+        Returns the task to the queue, or marks it as failed after max_attempts.
+
+        Returns:
+            bool: False if the lease was lost (expired and claimed by another worker).
+        """
+        status: str = 'failed' if task.attempts >= self.max_attempts else 'pending'
+        return self._finish(task, status=status, lease_expires_at=None, error=error[:2000])
+
+    def _finish(self, task: CrawlTask, **values):
+        with session_scope() as session:
+            result = session.execute(
+                update(CrawlTask)
+                .where(CrawlTask.id == task.id, CrawlTask.status == 'leased', CrawlTask.lease_owner == self.worker_id)
+                .values(updated_at=utc_now(), **values)
+            )
+        if result.rowcount != 1:
+            logger.warning(f'Worker {self.worker_id} lost the lease of task {task.id}')
+            return False
+        return True
+
+    def fail_exhausted(self):
+        """
+        Marks tasks whose lease expired after the last allowed attempt as failed.
+        """
+        with session_scope() as session:
+            session.execute(
+                update(CrawlTask)
+                .where(CrawlTask.status == 'leased', CrawlTask.lease_expires_at < utc_now(), CrawlTask.attempts >= self.max_attempts)
+                .values(status='failed', error='Lease expired after the last attempt', updated_at=utc_now())
+            )
+
+    def stats(self):
+        """
+        Returns the number of tasks in each status.
+
+        Returns:
+            dict: Status -> number of tasks.
+        """
+        with session_scope() as session:
+            rows = session.execute(select(CrawlTask.status, func.count()).group_by(CrawlTask.status)).all()
+        return {status: count for status, count in rows}
+
+
+class LeaseKeeper(threading.Thread):
+    def __init__(self, queue: WorkQueue, task: CrawlTask) -> None:
+        """
+        Background thread which extends the lease of a task while a worker processes it.
+
+        Args:
+            queue (WorkQueue): The queue the task was claimed from.
+            task (CrawlTask): The claimed task.
+        """
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.task = task
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            if not self.queue.extend_lease(self.task):
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_worker(queue: WorkQueue, concurrency: int = 1, incremental: bool = True, poll_interval: float = None, exit_when_empty: bool = False):
+    """
+    Claims tasks from the queue, scrapes their pages and inserts the new cars into the database.
+
+    Inserting and completing a task are separate commits, so a task can be processed twice if a worker dies
+    in between. With `incremental` the second run finds the cars already stored and inserts nothing.
+
+    Args:
+        queue (WorkQueue): The queue to take the tasks from.
+        concurrency (int): The number of pages fetched at the same time.
+        incremental (bool): If True, only the cars not yet stored in the database are inserted.
+        poll_interval (float, optional): Seconds to wait when the queue is empty.
+        exit_when_empty (bool): Stop the worker when there is no task left instead of waiting for new ones.
+
+    Returns:
+        int: The number of processed tasks.
+    """
+    from pipeline import close_proxy_pool, create_scraper, export_data, get_headers_pool, get_proxy_pool, scrape_site, wait_for_enrichment
+
+    poll_interval = poll_interval or get_settings().work_queue.get('poll_interval_seconds', 30)
+    scrapers: dict = {}
+    proxy_pool = None
+    headers_pool = get_headers_pool()
+    processed: int = 0
+
+    logger.info(f'Worker {queue.worker_id} started')
+    try:
+        while True:
+            task: CrawlTask = queue.claim()
+            if task is None:
+                if exit_when_empty:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            # Proxies are checked once per worker, not once per task (the pool refreshes itself in the background)
+            if proxy_pool is None:
+                proxy_pool = get_proxy_pool()
+            if task.site not in scrapers:
+                scrapers[task.site] = create_scraper(task.site)
+
+            lease_keeper: LeaseKeeper = LeaseKeeper(queue, task)
+            lease_keeper.start()
+            try:
+                df = scrape_site(task.site, task.start_page, task.end_page, concurrency=concurrency, incremental=incremental,
+                                 scraper=scrapers[task.site], proxy_pool=proxy_pool, headers_pool=headers_pool)
+                export_data(df, task.site, 'db', proxy_pool=proxy_pool)
+            except Exception as e:
+                lease_keeper.stop()
+                logger.exception(f'Task {task.id} failed: {e}')
+                queue.fail(task, str(e))
+                continue
+            lease_keeper.stop()
+            queue.complete(task)
+            processed += 1
+    finally:
+        wait_for_enrichment()
+        close_proxy_pool(proxy_pool)
+
+    logger.info(f'Worker {queue.worker_id} finished, {processed} tasks processed')
+    return processed